@@ -1,7 +1,17 @@
+import asyncio
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI, Depends, Request, status
 from fastapi.responses import JSONResponse, Response
 
-from caddy_core.utils.monitoring import logger
+from caddy_core.utils.monitoring import logger, metrics
+from caddy_core.utils.concurrency import (
+    configure_event_loop,
+    drain_messages,
+    run_blocking,
+)
+from caddy_core.services.opensearch_client import close_opensearch_clients
+from caddy_core.services.retrieval_chain import preload_reranker
 from caddy_core.models import UserNotEnrolledException, NoSupervisionSpaceException
 
 from integrations.google_chat.structures import GoogleChat
@@ -13,7 +23,17 @@ from integrations.google_chat.verification import (
 
 from integrations.microsoft_teams.structures import initialise_teams_client
 
-app = FastAPI(docs_url=None)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    configure_event_loop(asyncio.get_running_loop())
+    await run_blocking(preload_reranker)
+    yield
+    await drain_messages()
+    await close_opensearch_clients()
+
+
+app = FastAPI(docs_url=None, lifespan=lifespan)
 
 
 @app.get("/health")
@@ -21,6 +41,11 @@ def health():
     return JSONResponse(status_code=status.HTTP_200_OK, content={"status": "Online"})
 
 
+@app.get("/metrics")
+def metrics_endpoint():
+    return JSONResponse(status_code=status.HTTP_200_OK, content=metrics.snapshot())
+
+
 @app.post("/google-chat/chat")
 async def google_chat_endpoint(event=Depends(verify_google_chat_request)) -> dict:
     """
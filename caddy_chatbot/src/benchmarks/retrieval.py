@@ -0,0 +1,288 @@
+import argparse
+import itertools
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional
+
+import numpy as np
+import pydantic
+from langchain_core.embeddings import Embeddings
+
+from caddy_core.models import RetrievalParameters
+from caddy_core.services.retrievers import context_tokens
+from caddy_core.utils.monitoring import logger
+
+
+class LabelledQuery(pydantic.BaseModel):
+    query: str
+    sources: List[str]
+    relevant: List[str]
+
+
+class CountingEmbeddings(Embeddings):
+    """
+    Embeddings wrapper counting the calls and texts that reach the wrapped model
+    """
+
+    def __init__(self, embeddings: Embeddings):
+        self.embeddings = embeddings
+        self.calls = 0
+        self.texts = 0
+        self._lock = threading.Lock()
+
+    def _count(self, texts: int):
+        with self._lock:
+            self.calls += 1
+            self.texts += texts
+
+    def reset(self):
+        with self._lock:
+            self.calls = 0
+            self.texts = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self._count(len(texts))
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        self._count(1)
+        return self.embeddings.embed_query(text)
+
+
+class RecordedEmbeddings(Embeddings):
+    """
+    Embeddings replayed from a JSON recording of text to vector, so benchmarks run
+    offline and repeatably. Misses go to the live model when one is given and are
+    added to the recording, otherwise they raise KeyError
+
+    Args:
+        path (str): recording file, created on save if missing
+        live (Embeddings): model for texts missing from the recording
+    """
+
+    def __init__(self, path: str, live: Optional[Embeddings] = None):
+        self.path = path
+        self.live = live
+        self.vectors: Dict[str, List[float]] = {}
+        self.recorded = 0
+        if os.path.exists(path):
+            with open(path) as file:
+                self.vectors = json.load(file)
+
+    def _vector(self, text: str) -> List[float]:
+        vector = self.vectors.get(text)
+        if vector is None:
+            if self.live is None:
+                raise KeyError(f"No recorded embedding for: {text[:80]}")
+            vector = self.vectors[text] = self.live.embed_query(text)
+            self.recorded += 1
+        return vector
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._vector(text)
+
+    def save(self):
+        if self.recorded:
+            with open(self.path, "w") as file:
+                json.dump(self.vectors, file)
+
+
+def read_queries(path: str) -> List[LabelledQuery]:
+    """
+    Reads a JSON lines file of {"query", "sources", "relevant"} objects, where
+    relevant lists the source URLs a good answer should cite
+    """
+    with open(path) as file:
+        return [LabelledQuery(**json.loads(line)) for line in file if line.strip()]
+
+
+def parameter_grid(grid: Dict[str, List[Any]]) -> Iterator[RetrievalParameters]:
+    names = list(grid)
+    for values in itertools.product(*(grid[name] for name in names)):
+        yield RetrievalParameters(**dict(zip(names, values)))
+
+
+def recall(relevant: List[str], retrieved: List[str]) -> float:
+    if not relevant:
+        return 1.0
+    return len(set(relevant) & set(retrieved)) / len(set(relevant))
+
+
+def run_configuration(
+    parameters: RetrievalParameters,
+    queries: List[LabelledQuery],
+    backend: Any,
+    embeddings: CountingEmbeddings,
+    warmup: int = 1,
+) -> Dict[str, Any]:
+    """
+    Runs every query through a retriever built with parameters, without the
+    semantic retrieval cache, and summarises quality and cost
+
+    Args:
+        parameters (RetrievalParameters): configuration under test
+        queries (List[LabelledQuery]): labelled queries
+        backend: search backend, normally a LocalSearchBackend
+        embeddings (CountingEmbeddings): embeddings the retriever uses
+        warmup (int): untimed queries run first
+
+    Returns:
+        Dict[str, Any]: parameters with recall@k, latency, embedding and token stats
+    """
+    from caddy_core.services.retrieval_chain import build_retriever
+
+    retrievers: Dict[tuple, Any] = {}
+
+    def retriever_for(sources: List[str]):
+        key = tuple(sources)
+        if key not in retrievers:
+            retrievers[key] = build_retriever(
+                sources,
+                parameters=parameters,
+                backend=backend,
+                retriever_embeddings=embeddings,
+                cache=False,
+            )
+        return retrievers[key]
+
+    for labelled in queries[:warmup]:
+        retriever_for(labelled.sources).invoke(labelled.query)
+
+    embeddings.reset()
+    latencies, recalls, documents, tokens = [], [], [], []
+    for labelled in queries:
+        retriever = retriever_for(labelled.sources)
+        started = time.perf_counter()
+        results = retriever.invoke(labelled.query)
+        latencies.append(time.perf_counter() - started)
+
+        recalls.append(
+            recall(
+                labelled.relevant,
+                [document.metadata.get("source", "") for document in results],
+            )
+        )
+        documents.append(len(results))
+        tokens.append(context_tokens(results))
+
+    return {
+        **parameters.model_dump(),
+        "queries": len(queries),
+        "recall_at_k": round(float(np.mean(recalls)), 4),
+        "mean_k": round(float(np.mean(documents)), 2),
+        "latency_p50_ms": round(float(np.percentile(latencies, 50)) * 1000, 1),
+        "latency_p95_ms": round(float(np.percentile(latencies, 95)) * 1000, 1),
+        "embedding_calls_per_query": round(embeddings.calls / len(queries), 2),
+        "embedded_texts_per_query": round(embeddings.texts / len(queries), 2),
+        "prompt_tokens_mean": round(float(np.mean(tokens)), 1),
+        "prompt_tokens_p95": round(float(np.percentile(tokens, 95)), 1),
+    }
+
+
+COLUMNS = [
+    "total_source_docs",
+    "fetched_docs_multiplier",
+    "input_docs_multiplier",
+    "lambda_mult",
+    "clusters_per_source",
+    "hybrid",
+    "adaptive_allocation",
+    "recall_at_k",
+    "mean_k",
+    "latency_p50_ms",
+    "latency_p95_ms",
+    "embedding_calls_per_query",
+    "prompt_tokens_mean",
+]
+
+
+def print_table(results: List[Dict[str, Any]]):
+    widths = [
+        max(len(column), *(len(str(result[column])) for result in results))
+        for column in COLUMNS
+    ]
+    print("  ".join(c.rjust(w) for c, w in zip(COLUMNS, widths)))
+    for result in results:
+        print("  ".join(str(result[c]).rjust(w) for c, w in zip(COLUMNS, widths)))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=(
+            "Sweep build_retriever parameters over a labelled query set against a "
+            "local vector store, e.g. python -m benchmarks.retrieval queries.jsonl "
+            "--store vector_store --embeddings recorded.json --total-source-docs 4 6 8"
+        )
+    )
+    parser.add_argument("queries", help="JSON lines file of labelled queries")
+    parser.add_argument("--store", required=True, help="local vector store root")
+    parser.add_argument(
+        "--embeddings", required=True, help="JSON recording of query embeddings"
+    )
+    parser.add_argument(
+        "--record",
+        action="store_true",
+        help="embed and record queries missing from the recording with Bedrock",
+    )
+    parser.add_argument("--total-source-docs", type=int, nargs="+", default=[6])
+    parser.add_argument("--input-docs-multiplier", type=int, nargs="+", default=[2])
+    parser.add_argument("--fetched-docs-multiplier", type=int, nargs="+", default=[3])
+    parser.add_argument("--lambda-mult", type=float, nargs="+", default=[0.2])
+    parser.add_argument("--clusters-per-source", type=int, nargs="+", default=[1])
+    parser.add_argument("--context-token-budget", type=int, nargs="+", default=[None])
+    parser.add_argument(
+        "--adaptive-allocation",
+        type=lambda value: value.lower() == "true",
+        nargs="+",
+        default=[False],
+    )
+    parser.add_argument("--max-docs-per-source", type=int, nargs="+", default=[None])
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--output", help="write results as JSON")
+    args = parser.parse_args()
+
+    from caddy_core.services.local_vector_store import LocalSearchBackend
+
+    live = None
+    if args.record:
+        from caddy_core.services.llm import get_embeddings
+
+        live = get_embeddings()
+    recorded = RecordedEmbeddings(args.embeddings, live=live)
+    embeddings = CountingEmbeddings(recorded)
+    backend = LocalSearchBackend(args.store, embeddings)
+    queries = read_queries(args.queries)
+
+    grid = {
+        "total_source_docs": args.total_source_docs,
+        "input_docs_multiplier": args.input_docs_multiplier,
+        "fetched_docs_multiplier": args.fetched_docs_multiplier,
+        "lambda_mult": args.lambda_mult,
+        "clusters_per_source": args.clusters_per_source,
+        "context_token_budget": args.context_token_budget,
+        "adaptive_allocation": args.adaptive_allocation,
+        "max_docs_per_source": args.max_docs_per_source,
+    }
+    results = []
+    for parameters in parameter_grid(grid):
+        logger.info(f"Benchmarking {parameters.model_dump()}")
+        results.append(
+            run_configuration(
+                parameters, queries, backend, embeddings, warmup=args.warmup
+            )
+        )
+    recorded.save()
+
+    print_table(results)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
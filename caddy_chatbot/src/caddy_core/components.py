@@ -1,22 +1,37 @@
 import json
-import os
+from contextlib import aclosing
 from datetime import datetime
-from time import sleep
+from functools import partial
 from typing import Any, Dict, List, Tuple, Union
 
 from boto3.dynamodb.conditions import Key
 from caddy_core.models import (
     ApprovalEvent,
+    ApprovedAnswer,
     CaddyMessageEvent,
     LlmResponse,
     ProcessChatMessageEvent,
     SupervisionEvent,
     UserMessage,
 )
-from caddy_core.services import enrolment
+from caddy_core.services.approved_answers import (
+    APPROVED_ANSWERS_ENABLED,
+    approved_answers,
+)
 from caddy_core.services.evaluation import execute_optional_modules
-from caddy_core.services.retrieval_chain import build_chain
-from caddy_core.utils.monitoring import logger
+from caddy_core.services.llm import get_chat_model
+from caddy_core.services.prefetch import prefetch_message_context
+from caddy_core.services.rewrite_cache import rewrite_cache, rewrite_namespace
+from caddy_core.services.streaming import CardUpdateScheduler
+from caddy_core.services.retrieval_chain import (
+    build_answer_chain,
+    build_chain,
+    get_retriever,
+    retrieve_for_query,
+)
+from caddy_core.utils.concurrency import run_blocking
+from caddy_core.utils.monitoring import logger, metrics
+from caddy_core.utils.resilience import RetryPolicy, bedrock_breaker, retry_async
 from caddy_core.utils.prompt import get_prompt, retrieve_route_specific_augmentation
 from caddy_core.utils.tables import (
     evaluation_table,
@@ -28,9 +43,30 @@ from caddy_core.utils.prompts.rewording_query import query_length_prompts
 from fastapi import status
 from fastapi.responses import Response
 from langchain.prompts import PromptTemplate
-from langchain_aws import ChatBedrock
 from pytz import timezone
 
+generation_retry_policy = RetryPolicy("generation")
+
+REWORD_PROMPT = """You are an information extraction assistant called Caddy.
+    Your task is to analyze the given message and extract key information that would be relevant
+    for a legal assistance chatbot to perform a RAG (Retrieval-Augmented Generation) search.
+    Follow these guidelines:
+        1. Identify the main legal topic or issue being discussed.
+        2. Extract any specific questions being asked.
+        3. Note any relevant personal details of the individual involved (e.g., age, nationality, employment status).
+        4. Identify key facts or circumstances related to the legal situation.
+        5. Extract any mentioned dates, locations, or monetary amounts.
+        6. Identify any legal terms or concepts mentioned.
+    Provide your response in a structured format with clear headings for each category of extracted information.
+    If any category is not applicable or no relevant information is found skip it.
+    Remember to focus only on extracting factual information without adding any interpretation or advice.
+
+    Input:
+    {message}
+
+    Extracted Information:
+    """
+
 
 def rct_survey_reminder(event, user_record, chat_client):
     """
@@ -47,12 +83,15 @@ def rct_survey_reminder(event, user_record, chat_client):
     )
 
 
-def handle_message(caddy_message, chat_client):
+async def handle_message(caddy_message, chat_client):
     logger.info("Running message handler")
-    module_values, survey_complete = check_existing_call(caddy_message)
+    module_values, survey_complete = await run_blocking(
+        check_existing_call, caddy_message
+    )
 
     if survey_complete is True:
-        chat_client.update_message_in_adviser_space(
+        await run_blocking(
+            chat_client.update_message_in_adviser_space,
             message_type="text",
             space_id=caddy_message.space_id,
             message_id=caddy_message.message_id,
@@ -66,13 +105,14 @@ def handle_message(caddy_message, chat_client):
 
     message_query = format_chat_message(caddy_message)
 
-    store_message(message_query)
+    await run_blocking(store_message, message_query)
 
     if continue_conversation is False:
         control_group_card = chat_client.responses.control_group_selection(
             control_group_message, caddy_message
         )
-        chat_client.update_message_in_adviser_space(
+        await run_blocking(
+            chat_client.update_message_in_adviser_space,
             message_type="cardsV2",
             space_id=message_query.conversation_id,
             message_id=message_query.message_id,
@@ -85,20 +125,125 @@ def handle_message(caddy_message, chat_client):
         if isinstance(output, dict) and output.get("end_interaction"):
             return Response(status_code=status.HTTP_204_NO_CONTENT)
 
-    chat_client.update_message_in_adviser_space(
+    if await offer_approved_answer(message_query, chat_client):
+        return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+    await compose_answer(message_query, chat_client)
+
+
+async def notify_message_failed(chat_client, space_id: str, message_id: str):
+    """
+    Shows the request failure card on an adviser message whose pipeline raised
+    """
+    await run_blocking(
+        chat_client.update_message_in_adviser_space,
+        message_type="cardsV2",
+        space_id=space_id,
+        message_id=message_id,
+        message=chat_client.messages.REQUEST_FAILURE,
+    )
+
+
+async def compose_answer(message_query: UserMessage, chat_client):
+    """
+    Generates an answer for the adviser message and sends it for supervision
+    """
+    await run_blocking(
+        chat_client.update_message_in_adviser_space,
         message_type="cardsV2",
         space_id=message_query.conversation_id,
         message_id=message_query.message_id,
         message=chat_client.messages.COMPOSING_MESSAGE,
     )
 
-    send_to_llm(
+    await send_to_llm(
         caddy_query=message_query,
         chat_client=chat_client,
         query_length_prompts=query_length_prompts,
     )
 
 
+async def offer_approved_answer(message_query: UserMessage, chat_client) -> bool:
+    """
+    Looks for a supervisor approved answer to a near identical question and, if
+    there is one, offers it to the adviser before any answer is generated
+
+    Args:
+        message_query (UserMessage): adviser message
+        chat_client: client to update the adviser message with
+
+    Returns:
+        bool: whether an approved answer was offered
+    """
+    if not APPROVED_ANSWERS_ENABLED:
+        return False
+    try:
+        approved_answer = await approved_answers.find(
+            message_query.message, message_query.user_email
+        )
+    except Exception as error:
+        logger.warning(f"Approved answer lookup failed: {error}")
+        return False
+    if approved_answer is None:
+        return False
+
+    logger.info(
+        f"Offering approved answer from thread {approved_answer.thread_id} at "
+        f"similarity {approved_answer.similarity:.3f}"
+    )
+    await run_blocking(
+        chat_client.update_message_in_adviser_space,
+        message_type="cardsV2",
+        space_id=message_query.conversation_id,
+        message_id=message_query.message_id,
+        message=chat_client.responses.approved_answer_offer(
+            approved_answer, message_query
+        ),
+    )
+    return True
+
+
+async def use_approved_answer(
+    message_query: UserMessage, approved_answer: ApprovedAnswer, chat_client
+):
+    """
+    Answers the adviser message with a previously approved answer, in place of
+    generating and supervising a new one
+
+    Args:
+        message_query (UserMessage): adviser message
+        approved_answer (ApprovedAnswer): the accepted approved answer
+        chat_client: client to send the answer with
+    """
+    metrics.increment("approved_answer_accepted")
+    response_card = await run_blocking(
+        chat_client.create_approved_answer_card, approved_answer
+    )
+    now = datetime.now()
+    llm_response = LlmResponse(
+        message_id=message_query.message_id,
+        llm_prompt=message_query.message,
+        llm_answer=approved_answer.answer,
+        thread_id=message_query.thread_id,
+        llm_prompt_timestamp=now,
+        llm_response_json=json.dumps(response_card),
+        llm_response_timestamp=now,
+        route="approved_answer",
+        context=approved_answer.context,
+    )
+    await run_blocking(store_response, llm_response)
+    await run_blocking(
+        store_approved_answer_reuse, message_query.thread_id, approved_answer
+    )
+    await run_blocking(
+        chat_client.update_message_in_adviser_space,
+        message_type="cardsV2",
+        space_id=message_query.conversation_id,
+        message_id=message_query.message_id,
+        message=response_card,
+    )
+
+
 def remove_role_played_responses(response: str) -> str:
     """
     This function checks for and cuts off the adviser output at the end of some LLM responses
@@ -373,9 +518,10 @@ def check_existing_call(caddy_message) -> Tuple[Dict[str, Any], bool]:
     return module_values, survey_complete
 
 
-def reword_advisor_orchestration(query: str, query_length_prompts: dict) -> str:
+async def reword_advisor_orchestration(query: str, query_length_prompts: dict) -> str:
     """An agent to reason whether the reworded query is sufficient.
-    It does this via two prompts for the different tail length, leaving queries in middle alone
+    It does this via two prompts for the different tail length, leaving queries in middle alone.
+    Rewrites are cached by normalised message so retries and resubmissions reuse them
 
     Args:
         query (str): incoming query from advisor
@@ -384,17 +530,24 @@ def reword_advisor_orchestration(query: str, query_length_prompts: dict) -> str:
     Returns:
         str: Rewritten query for RAG processing.
     """
+    return await rewrite_cache.get_or_rewrite(
+        query,
+        lambda message: _reword_advisor_orchestration(message, query_length_prompts),
+        namespace=rewrite_namespace(
+            get_chat_model("rewording").model_id,
+            REWORD_PROMPT,
+            *query_length_prompts.values(),
+        ),
+    )
 
-    reworded_query = reword_advisor_message(query)
+
+async def _reword_advisor_orchestration(query: str, query_length_prompts: dict) -> str:
+    reworded_query = await reword_advisor_message(query)
 
     if 50 <= len(reworded_query) <= 200:
         return reworded_query  # no flag
 
-    llm = ChatBedrock(
-        model_id=os.getenv("LLM"),
-        region_name="eu-west-3",
-        model_kwargs={"temperature": 0.3, "top_k": 5, "max_tokens": 2000},
-    )
+    llm = get_chat_model("rewording")
 
     prompt = (
         query_length_prompts["0 to 50"]
@@ -403,69 +556,84 @@ def reword_advisor_orchestration(query: str, query_length_prompts: dict) -> str:
     )
     prompt += f"\n\nIncoming rewritten query: {reworded_query}"
 
-    return llm.invoke(prompt).content
+    async with bedrock_breaker:
+        response = await llm.ainvoke(prompt)
+    return response.content
 
 
-def reword_advisor_message(message: str) -> str:
-    llm = ChatBedrock(
-        model_id=os.getenv("LLM"),
-        region_name="eu-west-3",
-        model_kwargs={"temperature": 0.3, "top_k": 5, "max_tokens": 2000},
-    )
-    prompt = f"""You are an information extraction assistant called Caddy.
-    Your task is to analyze the given message and extract key information that would be relevant
-    for a legal assistance chatbot to perform a RAG (Retrieval-Augmented Generation) search.
-    Follow these guidelines:
-        1. Identify the main legal topic or issue being discussed.
-        2. Extract any specific questions being asked.
-        3. Note any relevant personal details of the individual involved (e.g., age, nationality, employment status).
-        4. Identify key facts or circumstances related to the legal situation.
-        5. Extract any mentioned dates, locations, or monetary amounts.
-        6. Identify any legal terms or concepts mentioned.
-    Provide your response in a structured format with clear headings for each category of extracted information.
-    If any category is not applicable or no relevant information is found skip it.
-    Remember to focus only on extracting factual information without adding any interpretation or advice.
+async def reword_advisor_message(message: str) -> str:
+    llm = get_chat_model("rewording")
+    prompt = REWORD_PROMPT.format(message=message)
+    async with bedrock_breaker:
+        response = await llm.ainvoke(prompt)
+    return response.content
 
-    Input:
-    {message}
 
-    Extracted Information:
+async def update_streamed_card(
+    chat_client,
+    space_id: str,
+    message_id: str,
+    card_builder,
+    state: Tuple[str, bool],
+) -> Dict[str, Any]:
     """
-    response = llm.invoke(prompt)
-    return response.content
+    Renders the answer so far into a response card and updates it in the supervisor space
 
+    Args:
+        chat_client: chat client the card is rendered and sent with
+        space_id (str): supervisor space id
+        message_id (str): id of the streamed response message
+        card_builder: incremental card builder for this response
+        state (tuple): answer text and whether still streaming
 
-def send_to_llm(caddy_query: UserMessage, chat_client, query_length_prompts):
-    query = caddy_query.message
+    Returns:
+        Dict[str, Any]: the card sent
+    """
+    answer, streaming = state
+    response_card = await chat_client.build_response_card(
+        answer, card_builder, streaming=streaming
+    )
+    if streaming:
+        response_card["cardsV2"][0]["card"]["sections"][0]["widgets"].append(
+            chat_client.messages.RESPONSE_STREAMING
+        )
+    await run_blocking(
+        chat_client.update_message_in_supervisor_space,
+        space_id=space_id,
+        message_id=message_id,
+        new_message=response_card,
+    )
+    return response_card
 
-    domain = caddy_query.user_email.split("@")[1]
 
-    chat_history = get_chat_history(caddy_query)
+async def send_to_llm(caddy_query: UserMessage, chat_client, query_length_prompts):
+    query = caddy_query.message
 
-    route_specific_augmentation, route = retrieve_route_specific_augmentation(query)
+    message_context = await prefetch_message_context(caddy_query, get_chat_history)
+    chat_history = message_context.chat_history
+    route = message_context.route
 
     day_date_time = datetime.now(timezone("Europe/London")).strftime(
         "%A %d %B %Y %H:%M"
     )
 
-    _, office = enrolment.check_domain_status(domain)
-    office_regions = enrolment.get_office_coverage(office)
-
     CADDY_PROMPT = PromptTemplate(
-        template=get_prompt("CORE_PROMPT"),
+        template=message_context.core_prompt,
         input_variables=["context", "question"],
         partial_variables={
-            "route_specific_augmentation": route_specific_augmentation,
+            "route_specific_augmentation": message_context.route_specific_augmentation,
             "day_date_time": day_date_time,
-            "office_regions": ", ".join(office_regions),
+            "office_regions": ", ".join(message_context.office_regions),
         },
     )
 
-    chain, ai_prompt_timestamp = build_chain(CADDY_PROMPT, user=caddy_query.user_email)
+    retriever = await run_blocking(get_retriever, message_context.source_list)
+    answer_chain = build_answer_chain(CADDY_PROMPT)
+    ai_prompt_timestamp = datetime.now()
 
     user = caddy_query.user_email
 
-    supervisor_space = enrolment.get_designated_supervisor_space(user)
+    supervisor_space = message_context.supervisor_space
     if supervisor_space == "Unknown":
         raise Exception("supervision space returned unknown")
 
@@ -477,119 +645,148 @@ def send_to_llm(caddy_query: UserMessage, chat_client, query_length_prompts):
         request_rejected,
     ) = chat_client.create_supervision_request_card(user, initial_query=query)
 
-    supervision_thread_id, supervision_message_id = (
-        chat_client.send_message_to_supervisor_space(
-            space_id=supervisor_space, message=request_processing
-        )
+    supervision_thread_id, supervision_message_id = await run_blocking(
+        chat_client.send_message_to_supervisor_space,
+        space_id=supervisor_space,
+        message=request_processing,
     )
 
-    for attempt in range(4):
+    async def stream_response():
+        card_updates = None
         try:
             first_chunk = True
             caddy_response = {}
             accumulated_answer = ""
-            for chunk in chain.stream(
-                {
-                    "input": reword_advisor_orchestration(query, query_length_prompts),
-                    "chat_history": chat_history,
-                }
-            ):
-                for key, value in chunk.items():
-                    if (
-                        key in caddy_response
-                        and isinstance(value, str)
-                        and isinstance(caddy_response[key], str)
-                    ):
-                        caddy_response[key] += value
-                    else:
-                        caddy_response[key] = value
-
-                if "answer" in chunk:
-                    if first_chunk:
-                        context_sources = [
-                            document.metadata.get("source", "")
-                            for document in caddy_response.get("context", [])
-                        ]
-                        response_card = chat_client.create_card(
-                            caddy_response["answer"], context_sources
-                        )
-                        response_card["cardsV2"][0]["card"]["sections"][0][
-                            "widgets"
-                        ].append(chat_client.messages.RESPONSE_STREAMING)
-                        supervision_caddy_message_id = (
-                            chat_client.respond_to_supervisor_thread(
+            reworded_query, context = await retrieve_for_query(
+                retriever,
+                query,
+                reword_advisor_orchestration(query, query_length_prompts),
+            )
+            # Only the model stream counts against the Bedrock breaker, chat API
+            # errors raised while handling chunks do not
+            answer_stream = bedrock_breaker.guard_stream(
+                answer_chain.astream(
+                    {
+                        "input": reworded_query,
+                        "chat_history": chat_history,
+                        "context": context,
+                    }
+                )
+            )
+            async with aclosing(answer_stream) as chunks:
+                async for chunk in chunks:
+                    for key, value in chunk.items():
+                        if (
+                            key in caddy_response
+                            and isinstance(value, str)
+                            and isinstance(caddy_response[key], str)
+                        ):
+                            caddy_response[key] += value
+                        else:
+                            caddy_response[key] = value
+
+                    if "answer" in chunk:
+                        if first_chunk:
+                            context_sources = [
+                                document.metadata.get("source", "")
+                                for document in caddy_response.get("context", [])
+                            ]
+                            card_builder = chat_client.create_card_builder(
+                                context_sources
+                            )
+                            response_card = await chat_client.build_response_card(
+                                caddy_response["answer"],
+                                card_builder,
+                                streaming=True,
+                            )
+                            response_card["cardsV2"][0]["card"]["sections"][0][
+                                "widgets"
+                            ].append(chat_client.messages.RESPONSE_STREAMING)
+                            supervision_caddy_message_id = await run_blocking(
+                                chat_client.respond_to_supervisor_thread,
                                 space_id=supervisor_space,
                                 message=response_card,
                                 thread_id=supervision_thread_id,
                             )
-                        )
-                        chat_client.update_message_in_adviser_space(
-                            message_type="cardsV2",
-                            space_id=caddy_query.conversation_id,
-                            message_id=caddy_query.message_id,
-                            message=chat_client.messages.SUPERVISOR_REVIEWING_RESPONSE,
-                        )
-                        first_chunk = None
+                            await run_blocking(
+                                chat_client.update_message_in_adviser_space,
+                                message_type="cardsV2",
+                                space_id=caddy_query.conversation_id,
+                                message_id=caddy_query.message_id,
+                                message=chat_client.messages.SUPERVISOR_REVIEWING_RESPONSE,
+                            )
+                            card_updates = CardUpdateScheduler(
+                                partial(
+                                    update_streamed_card,
+                                    chat_client,
+                                    supervisor_space,
+                                    supervision_caddy_message_id,
+                                    card_builder,
+                                )
+                            )
+                            first_chunk = None
 
-                    accumulated_answer += chunk["answer"]
-                    if len(accumulated_answer) >= 75:
-                        early_terminate, caddy_response["answer"] = (
-                            remove_role_played_responses(caddy_response["answer"])
-                        )
-                        context_sources = [
-                            document.metadata.get("source", "")
-                            for document in caddy_response.get("context", [])
-                        ]
-                        response_card = chat_client.create_card(
-                            caddy_response["answer"], context_sources
-                        )
-                        response_card["cardsV2"][0]["card"]["sections"][0][
-                            "widgets"
-                        ].append(chat_client.messages.RESPONSE_STREAMING)
-                        chat_client.update_message_in_supervisor_space(
-                            space_id=supervisor_space,
-                            message_id=supervision_caddy_message_id,
-                            new_message=response_card,
+                        accumulated_answer += chunk["answer"]
+                        if len(accumulated_answer) >= 75:
+                            early_terminate, caddy_response["answer"] = (
+                                remove_role_played_responses(caddy_response["answer"])
+                            )
+                            accumulated_answer = ""
+                            if early_terminate is True:
+                                break
+                        card_updates.update(
+                            (caddy_response["answer"], True),
+                            new_chars=len(chunk["answer"]),
                         )
-                        accumulated_answer = ""
-                        if early_terminate is True:
-                            break
-            break
-        except Exception as error:
-            print(f"Attempt {attempt+1} failed with error: {error}")
-            if attempt == 3:
-                chat_client.update_message_in_adviser_space(
-                    message_type="cardsV2",
-                    space_id=caddy_query.conversation_id,
-                    message_id=caddy_query.message_id,
-                    message=chat_client.messages.REQUEST_FAILURE,
-                )
-                chat_client.update_message_in_supervisor_space(
-                    space_id=supervisor_space,
-                    message_id=supervision_message_id,
-                    new_message=request_failed,
-                )
-                raise Exception(f"Caddy failed to response, error: {error}")
-            chat_client.update_message_in_adviser_space(
+            return caddy_response, card_updates, supervision_caddy_message_id
+        except BaseException:
+            if card_updates is not None:
+                await card_updates.close()
+            raise
+
+    async def notify_retry(attempt: int, error: Exception, delay: float):
+        # One retry notice per message rather than one per attempt
+        if attempt == 1:
+            await run_blocking(
+                chat_client.update_message_in_adviser_space,
                 message_type="cardsV2",
                 space_id=caddy_query.conversation_id,
                 message_id=caddy_query.message_id,
                 message=chat_client.messages.COMPOSING_MESSAGE_RETRY,
             )
-            wait = attempt**2
-            print(f"Retrying in {wait}...")
-            sleep(wait)
+
+    try:
+        (
+            caddy_response,
+            card_updates,
+            supervision_caddy_message_id,
+        ) = await retry_async(
+            stream_response, policy=generation_retry_policy, on_retry=notify_retry
+        )
+    except Exception as error:
+        logger.error(f"Caddy failed to respond: {error}")
+        await run_blocking(
+            chat_client.update_message_in_adviser_space,
+            message_type="cardsV2",
+            space_id=caddy_query.conversation_id,
+            message_id=caddy_query.message_id,
+            message=chat_client.messages.REQUEST_FAILURE,
+        )
+        await run_blocking(
+            chat_client.update_message_in_supervisor_space,
+            space_id=supervisor_space,
+            message_id=supervision_message_id,
+            new_message=request_failed,
+        )
+        raise Exception(f"Caddy failed to response, error: {error}")
 
     _, caddy_response["answer"] = remove_role_played_responses(caddy_response["answer"])
     context_sources = [
         document.metadata.get("source", "")
         for document in caddy_response.get("context", [])
     ]
-    response_card = chat_client.create_card(caddy_response["answer"], context_sources)
-    chat_client.update_message_in_supervisor_space(
-        space_id=supervisor_space,
-        message_id=supervision_caddy_message_id,
-        new_message=response_card,
+    response_card = await card_updates.close(
+        final_state=(caddy_response["answer"], False)
     )
 
     ai_response_timestamp = datetime.now()
@@ -608,7 +805,7 @@ def send_to_llm(caddy_query: UserMessage, chat_client, query_length_prompts):
         context=context_sources,
     )
 
-    store_response(llm_response)
+    await run_blocking(store_response, llm_response)
 
     supervision_event = SupervisionEvent(
         type="SUPERVISION_REQUIRED",
@@ -623,15 +820,17 @@ def send_to_llm(caddy_query: UserMessage, chat_client, query_length_prompts):
         response_id=str(llm_response.response_id),
     )
 
-    chat_client.update_message_in_adviser_space(
+    await run_blocking(
+        chat_client.update_message_in_adviser_space,
         message_type="cardsV2",
         space_id=caddy_query.conversation_id,
         message_id=caddy_query.message_id,
         message=chat_client.messages.AWAITING_SUPERVISOR_APPROVAL,
     )
-    store_user_thanked_timestamp(llm_response)
+    await run_blocking(store_user_thanked_timestamp, llm_response)
 
-    chat_client.update_message_in_supervisor_space(
+    await run_blocking(
+        chat_client.update_message_in_supervisor_space,
         space_id=supervisor_space,
         message_id=supervision_message_id,
         new_message=request_awaiting,
@@ -646,13 +845,14 @@ def send_to_llm(caddy_query: UserMessage, chat_client, query_length_prompts):
         card_for_approval=response_card,
     )
 
-    chat_client.update_message_in_supervisor_space(
+    await run_blocking(
+        chat_client.update_message_in_supervisor_space,
         space_id=supervisor_space,
         message_id=supervision_caddy_message_id,
         new_message=supervision_card,
     )
 
-    store_approver_received_timestamp(supervision_event)
+    await run_blocking(store_approver_received_timestamp, supervision_event)
 
 
 def store_approver_received_timestamp(
@@ -669,7 +869,7 @@ def store_approver_received_timestamp(
 
 
 def store_approver_event(thread_id: str, approval_event: ApprovalEvent):
-    responses_table.update_item(
+    response = responses_table.update_item(
         Key={"threadId": thread_id},
         UpdateExpression="set responseId=:rId, approverEmail=:email, approved=:approved, approvalTimestamp=:atime, userResponseTimestamp=:utime, supervisorMessage=:sMessage",
         ExpressionAttributeValues={
@@ -680,6 +880,19 @@ def store_approver_event(thread_id: str, approval_event: ApprovalEvent):
             ":utime": str(approval_event.user_response_timestamp),
             ":sMessage": approval_event.supervisor_message,
         },
+        ReturnValues="ALL_NEW",
+    )
+    approved_answers.record(response["Attributes"])
+
+
+def store_approved_answer_reuse(thread_id: str, approved_answer: ApprovedAnswer):
+    responses_table.update_item(
+        Key={"threadId": str(thread_id)},
+        UpdateExpression="set approvedAnswerThreadId=:tId, approvedAnswerSimilarity=:s",
+        ExpressionAttributeValues={
+            ":tId": approved_answer.thread_id,
+            ":s": str(round(approved_answer.similarity or 0.0, 4)),
+        },
         ReturnValues="UPDATED_NEW",
     )
 
@@ -729,7 +942,7 @@ async def temporary_teams_invoke(chat_client, caddy_event: CaddyMessageEvent):
     try:
         caddy_response = await chain.ainvoke(
             {
-                "input": reword_advisor_orchestration(
+                "input": await reword_advisor_orchestration(
                     caddy_event.message_string, query_length_prompts
                 ),
                 "chat_history": [],
@@ -91,9 +91,71 @@ class ProcessChatMessageEvent(pydantic.BaseModel):
     timestamp: datetime
 
 
+class MessageContext(pydantic.BaseModel):
+    chat_history: List[Any]
+    route: Optional[str] = None
+    route_specific_augmentation: Optional[str] = None
+    core_prompt: Optional[str] = None
+    office_regions: List[str]
+    source_list: List[str]
+    supervisor_space: str
+    timings: Dict[str, float] = {}
+
+
+class ApprovedAnswer(pydantic.BaseModel):
+    thread_id: str
+    question: str
+    answer: str
+    context: List[str] = []
+    approver_email: Optional[str] = None
+    supervisor_message: Optional[str] = None
+    approval_timestamp: Optional[datetime] = None
+    similarity: Optional[float] = None
+
+
+class ScrapedPage(pydantic.BaseModel):
+    source: str
+    markdown: str
+
+
+class IngestionReport(pydantic.BaseModel):
+    index: str
+    pages: int = 0
+    unchanged: int = 0
+    removed: int = 0
+    chunks_written: int = 0
+    chunks_deleted: int = 0
+    errors: int = 0
+    seconds: float = 0.0
+
+
+class RetrievalParameters(pydantic.BaseModel):
+    total_source_docs: int = 6
+    input_docs_multiplier: int = 2
+    fetched_docs_multiplier: int = 3
+    lambda_mult: float = 0.2
+    clusters_per_source: int = 1
+    hybrid: bool = False
+    reranker: bool = False
+    relevance_cutoff: float = 0.0
+    context_token_budget: Optional[int] = None
+    adaptive_allocation: bool = False
+    min_docs_per_source: int = 1
+    max_docs_per_source: Optional[int] = None
+    allocation_threshold: float = 0.3
+
+
 class UserNotEnrolledException(Exception):
     pass
 
 
 class NoSupervisionSpaceException(Exception):
     pass
+
+
+class PrefetchTimeoutError(Exception):
+    pass
+
+
+class CircuitOpenError(Exception):
+    pass
@@ -0,0 +1,353 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from boto3.dynamodb.conditions import Attr
+from langchain_core.embeddings import Embeddings
+
+from caddy_core.models import ApprovedAnswer
+from caddy_core.services import enrolment
+from caddy_core.services.embedding_cache import CachedEmbeddings
+from caddy_core.services.llm import (
+    COHERE_MAX_BATCH,
+    EMBEDDING_MODEL,
+    get_batched_embeddings,
+)
+from caddy_core.utils.cache import TTLCache
+from caddy_core.utils.concurrency import run_blocking
+from caddy_core.utils.monitoring import logger, metrics
+from caddy_core.utils.tables import responses_table
+
+APPROVED_ANSWERS_ENABLED = (
+    os.getenv("APPROVED_ANSWERS_ENABLED", "True").lower() == "true"
+)
+APPROVED_ANSWER_THRESHOLD = float(os.getenv("APPROVED_ANSWER_THRESHOLD", 0.92))
+APPROVED_ANSWER_MAX_AGE_DAYS = float(os.getenv("APPROVED_ANSWER_MAX_AGE_DAYS", 90))
+APPROVED_ANSWER_SCOPE_TTL = float(os.getenv("APPROVED_ANSWER_SCOPE_TTL", 300))
+
+# (office email domain, sources), answers are only shared within one scope
+Scope = Tuple[str, Tuple[str, ...]]
+
+# Approved questions embedded per request while backfilling
+EMBEDDING_BATCH_SIZE = COHERE_MAX_BATCH
+APPROVED_ROW_ATTRIBUTES = {
+    "#threadId": "threadId",
+    "#userEmail": "userEmail",
+    "#llmPrompt": "llmPrompt",
+    "#llmAnswer": "llmAnswer",
+    "#context": "context",
+    "#approverEmail": "approverEmail",
+    "#supervisorMessage": "supervisorMessage",
+    "#approvalTimestamp": "approvalTimestamp",
+}
+
+
+def approved_answer_from_row(row: Dict[str, Any]) -> Optional[ApprovedAnswer]:
+    """
+    Builds an ApprovedAnswer from a responses_table item, None unless the item is
+    an approved response with both question and answer
+    """
+    if row.get("approved") is not True or not row.get("llmPrompt"):
+        return None
+    if not row.get("llmAnswer"):
+        return None
+
+    try:
+        approval_timestamp = datetime.fromisoformat(row.get("approvalTimestamp"))
+    except (TypeError, ValueError):
+        approval_timestamp = None
+
+    return ApprovedAnswer(
+        thread_id=row["threadId"],
+        question=row["llmPrompt"],
+        answer=row["llmAnswer"],
+        context=[str(source) for source in row.get("context") or []],
+        approver_email=row.get("approverEmail"),
+        supervisor_message=row.get("supervisorMessage"),
+        approval_timestamp=approval_timestamp,
+    )
+
+
+def normalise(vectors: Any) -> np.ndarray:
+    array = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(array, axis=1, keepdims=True)
+    return array / np.where(norms == 0, 1.0, norms)
+
+
+class _Partition:
+    def __init__(self):
+        self.vectors: Optional[np.ndarray] = None
+        self.answers: List[ApprovedAnswer] = []
+        self.approved_at: List[float] = []
+
+    def remove(self, thread_id: str):
+        keep = np.array([a.thread_id != thread_id for a in self.answers], dtype=bool)
+        if keep.all():
+            return
+        self.vectors = self.vectors[keep] if keep.any() else None
+        self.answers = [a for a, k in zip(self.answers, keep) if k]
+        self.approved_at = [t for t, k in zip(self.approved_at, keep) if k]
+
+    def add(self, vector: np.ndarray, answer: ApprovedAnswer):
+        self.vectors = (
+            vector if self.vectors is None else np.vstack([self.vectors, vector])
+        )
+        self.answers.append(answer)
+        self.approved_at.append(
+            answer.approval_timestamp.timestamp()
+            if answer.approval_timestamp
+            else time.time()
+        )
+
+
+class ApprovedAnswerIndex:
+    """
+    In-memory similarity index of supervisor approved answers, so an adviser
+    asking a question that was approved before can be offered that answer instead
+    of waiting on generation and supervision.
+
+    Questions are indexed by their unit-normalised embeddings, partitioned by the
+    adviser's office and source set so an answer, which may carry client details,
+    is only offered to advisers in the same office drawing on the same sources.
+    Each adviser's scope is cached for APPROVED_ANSWER_SCOPE_TTL so enrolment
+    changes are picked up. The index is backfilled from responses_table on first use and
+    each new approval is added as it is stored. Embedding happens on a single
+    background worker, so lookups never wait on the backfill, they only pay for
+    embedding the question and one matrix product. The backfill embeds
+    EMBEDDING_BATCH_SIZE questions per Bedrock request, through the shared
+    embedding cache so workers on a host with its disk tier embed each once.
+
+    Args:
+        threshold (float): minimum cosine similarity between questions for a match
+        max_age_days (float): approvals older than this are not offered, 0 for no limit
+        embeddings (Embeddings): defaults to the cached, batched Cohere embeddings
+    """
+
+    def __init__(
+        self,
+        threshold: float,
+        max_age_days: float,
+        embeddings: Optional[Embeddings] = None,
+        table=responses_table,
+    ):
+        self.threshold = threshold
+        self.max_age = max_age_days * 86400
+        self.table = table
+        self._embeddings = embeddings
+        self._partitions: Dict[Scope, _Partition] = {}
+        self._thread_partitions: Dict[str, Scope] = {}
+        self._scopes = TTLCache(
+            "approved_answer_scopes", max_size=4096, ttl=APPROVED_ANSWER_SCOPE_TTL
+        )
+        self._loaded = False
+        self._lock = threading.Lock()
+        self._worker = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="approved-answers"
+        )
+        metrics.register_collector("approved_answers", self.stats)
+
+    @property
+    def embeddings(self) -> Embeddings:
+        if self._embeddings is None:
+            self._embeddings = CachedEmbeddings(
+                get_batched_embeddings(), EMBEDDING_MODEL
+            )
+        return self._embeddings
+
+    def _load_scope(self, user_email: str) -> Optional[Scope]:
+        domain = user_email.split("@")[1]
+        enrolled, _ = enrolment.check_domain_status(domain)
+        if not enrolled:
+            return None
+        return domain, tuple(enrolment.check_user_sources(user_email))
+
+    def user_scope(self, user_email: Optional[str]) -> Optional[Scope]:
+        """
+        Returns the adviser's office domain and sources, None when the domain is
+        not enrolled, in which case nothing is shared with or from them
+        """
+        if not user_email or "@" not in user_email:
+            return None
+        return self._scopes.get_or_create(
+            user_email, lambda: self._load_scope(user_email)
+        )
+
+    def _scan_approved(self):
+        kwargs = {
+            "FilterExpression": Attr("approved").eq(True),
+            "ProjectionExpression": ", ".join(APPROVED_ROW_ATTRIBUTES) + ", approved",
+            "ExpressionAttributeNames": APPROVED_ROW_ATTRIBUTES,
+        }
+        while True:
+            response = self.table.scan(**kwargs)
+            yield from response.get("Items", [])
+            if "LastEvaluatedKey" not in response:
+                return
+            kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+    def _add_rows(self, rows: List[Dict[str, Any]]):
+        entries = []
+        for row in rows:
+            answer = approved_answer_from_row(row)
+            scope = self.user_scope(row.get("userEmail"))
+            if answer is not None and scope is not None:
+                entries.append((scope, answer))
+        if not entries:
+            return
+
+        vectors = normalise(
+            self.embeddings.embed_documents([answer.question for _, answer in entries])
+        )
+        with self._lock:
+            for (scope, answer), vector in zip(entries, vectors):
+                previous = self._thread_partitions.get(answer.thread_id)
+                if previous is not None:
+                    self._partitions[previous].remove(answer.thread_id)
+                self._partitions.setdefault(scope, _Partition()).add(
+                    vector[None, :], answer
+                )
+                self._thread_partitions[answer.thread_id] = scope
+
+    def _backfill(self):
+        start = time.perf_counter()
+        batch = []
+        try:
+            for row in self._scan_approved():
+                batch.append(row)
+                if len(batch) >= EMBEDDING_BATCH_SIZE:
+                    self._add_rows(batch)
+                    batch = []
+            self._add_rows(batch)
+        except Exception as error:
+            logger.error(f"Approved answer backfill failed: {error}")
+            with self._lock:
+                self._loaded = False
+            return
+        logger.info(
+            f"Indexed {len(self._thread_partitions)} approved answers in "
+            f"{time.perf_counter() - start:.1f}s"
+        )
+
+    def load(self):
+        """
+        Starts the backfill from responses_table on the background worker, once
+        """
+        with self._lock:
+            if self._loaded:
+                return
+            self._loaded = True
+        self._worker.submit(self._backfill)
+
+    def record(self, row: Dict[str, Any]):
+        """
+        Queues a responses_table item for indexing, approved items are embedded
+        on the background worker and rejected ones are dropped from the index
+
+        Args:
+            row (dict): the full item after the approval was stored
+        """
+        if not APPROVED_ANSWERS_ENABLED:
+            return
+        if row.get("approved") is not True:
+            with self._lock:
+                scope = self._thread_partitions.pop(row.get("threadId"), None)
+                if scope is not None:
+                    self._partitions[scope].remove(row["threadId"])
+            return
+        self.load()
+        self._worker.submit(self._index_approval, row)
+
+    def _index_approval(self, row: Dict[str, Any]):
+        try:
+            self._add_rows([row])
+        except Exception as error:
+            logger.warning(
+                f"Approved answer for {row.get('threadId')} not indexed: {error}"
+            )
+
+    def _best_match(self, scope: Scope, vector: np.ndarray) -> Optional[ApprovedAnswer]:
+        with self._lock:
+            partition = self._partitions.get(scope)
+            if partition is None or partition.vectors is None:
+                return None
+            similarities = partition.vectors @ vector
+            if self.max_age:
+                expired = np.asarray(partition.approved_at) < time.time() - self.max_age
+                similarities[expired] = -1.0
+            best = int(np.argmax(similarities))
+            similarity = min(float(similarities[best]), 1.0)
+            if similarity < self.threshold:
+                return None
+            return partition.answers[best].model_copy(update={"similarity": similarity})
+
+    async def find(
+        self, question: str, user_email: Optional[str]
+    ) -> Optional[ApprovedAnswer]:
+        """
+        Returns the approved answer from the adviser's office and sources whose
+        question is most similar to question, if it reaches the threshold
+
+        Args:
+            question (str): adviser message
+            user_email (str): the adviser asking
+
+        Returns:
+            Optional[ApprovedAnswer]: the match, with its similarity
+        """
+        if not APPROVED_ANSWERS_ENABLED:
+            return None
+        self.load()
+        scope = await run_blocking(self.user_scope, user_email)
+        if scope is None:
+            return None
+        with self._lock:
+            partition = self._partitions.get(scope)
+            if partition is None or partition.vectors is None:
+                return None
+
+        start = time.perf_counter()
+        vector = normalise(await run_blocking(self.embeddings.embed_query, question))[0]
+        match = self._best_match(scope, vector)
+        metrics.observe("approved_answer_lookup_seconds", time.perf_counter() - start)
+        metrics.increment(
+            "approved_answer_matches" if match else "approved_answer_misses"
+        )
+        return match
+
+    def get(
+        self, thread_id: str, user_email: Optional[str]
+    ) -> Optional[ApprovedAnswer]:
+        """
+        Returns the approved answer for a thread if it is shared with the adviser's
+        scope, read from responses_table when this worker has not indexed it
+        """
+        scope = self.user_scope(user_email)
+        if scope is None:
+            return None
+        with self._lock:
+            indexed_scope = self._thread_partitions.get(thread_id)
+            if indexed_scope == scope:
+                for answer in self._partitions[scope].answers:
+                    if answer.thread_id == thread_id:
+                        return answer
+        response = self.table.get_item(Key={"threadId": thread_id})
+        row = response.get("Item", {})
+        if self.user_scope(row.get("userEmail")) != scope:
+            return None
+        return approved_answer_from_row(row)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "partitions": len(self._partitions),
+                "answers": len(self._thread_partitions),
+            }
+
+
+approved_answers = ApprovedAnswerIndex(
+    threshold=APPROVED_ANSWER_THRESHOLD, max_age_days=APPROVED_ANSWER_MAX_AGE_DAYS
+)
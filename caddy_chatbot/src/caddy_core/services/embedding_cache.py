@@ -0,0 +1,337 @@
+import fcntl
+import hashlib
+import os
+import re
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from caddy_core.utils.cache import TTLCache
+from caddy_core.utils.monitoring import logger, metrics
+
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", 10000))
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR")
+EMBEDDING_CACHE_MAX_DISK_ENTRIES = int(
+    os.getenv("EMBEDDING_CACHE_MAX_DISK_ENTRIES", 100000)
+)
+
+DIGEST_BYTES = 32
+
+# Input types in the cache key, models such as Cohere embed queries and documents
+# differently
+QUERY = "query"
+DOCUMENT = "document"
+
+
+def text_digest(model: str, input_type: str, text: str) -> bytes:
+    return hashlib.sha256(f"{model}\0{input_type}\0{text}".encode("utf-8")).digest()
+
+
+class VectorFile:
+    """
+    Append-mostly file of (sha256 digest, float32 vector) records for one model,
+    read through a memory map. Writes take an exclusive flock on a sidecar lock
+    file so several workers can share the file, and records written by other
+    workers are picked up when a lookup misses.
+
+    The file holds at most max_entries records. An append that would pass that
+    compacts the file to its newest max_entries / 2 records, written to a new file
+    and swapped in, so other workers see the new inode and rebuild their index.
+
+    Args:
+        path (str): vector file path
+        dimensions (int): embedding dimensions
+        max_entries (int): records kept on disk
+    """
+
+    def __init__(
+        self,
+        path: str,
+        dimensions: int,
+        max_entries: int = EMBEDDING_CACHE_MAX_DISK_ENTRIES,
+    ):
+        self.path = path
+        self.dimensions = dimensions
+        self.max_entries = max_entries
+        self.dtype = np.dtype(
+            [("digest", "u1", (DIGEST_BYTES,)), ("vector", "<f4", (dimensions,))]
+        )
+        self.compactions = 0
+        self._index: Dict[bytes, int] = {}
+        self._count = 0
+        self._inode = None
+        self._records = None
+        self._lock = threading.Lock()
+        self._refresh()
+
+    def _refresh(self):
+        try:
+            stat = os.stat(self.path)
+            size, inode = stat.st_size, stat.st_ino
+        except FileNotFoundError:
+            size, inode = 0, None
+        if inode != self._inode:
+            # Replaced by a compaction, positions in the old index are stale
+            self._index = {}
+            self._count = 0
+            self._records = None
+            self._inode = inode
+        # Ignore a trailing partial record left by an interrupted write
+        count = size // self.dtype.itemsize
+        if count == self._count:
+            return
+        records = np.memmap(self.path, dtype=self.dtype, mode="r", shape=(count,))
+        digests = records["digest"][self._count :].tobytes()
+        for offset in range(0, len(digests), DIGEST_BYTES):
+            self._index.setdefault(
+                digests[offset : offset + DIGEST_BYTES],
+                self._count + offset // DIGEST_BYTES,
+            )
+        self._count = count
+        self._records = records
+
+    def get(self, digest: bytes) -> Optional[np.ndarray]:
+        with self._lock:
+            position = self._index.get(digest)
+            if position is None:
+                self._refresh()
+                position = self._index.get(digest)
+                if position is None:
+                    return None
+            return np.array(self._records[position]["vector"])
+
+    @contextmanager
+    def _file_lock(self):
+        with open(f"{self.path}.lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _compact(self, keep: int):
+        count = os.path.getsize(self.path) // self.dtype.itemsize
+        records = np.fromfile(self.path, dtype=self.dtype, count=count)
+        temporary_path = f"{self.path}.tmp"
+        records[count - keep :].tofile(temporary_path)
+        os.replace(temporary_path, self.path)
+        self.compactions += 1
+        metrics.increment("embedding_cache_compactions")
+        logger.info(f"Compacted {self.path} from {count} to {keep} records")
+
+    def append(self, digests: List[bytes], vectors: List[np.ndarray]):
+        records = np.zeros(len(digests), dtype=self.dtype)
+        for i, (digest, vector) in enumerate(zip(digests, vectors)):
+            records[i]["digest"] = np.frombuffer(digest, dtype=np.uint8)
+            records[i]["vector"] = vector
+        records = records[-self.max_entries :]
+        with self._lock, self._file_lock():
+            size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+            count = size // self.dtype.itemsize
+            if count + len(records) > self.max_entries:
+                self._compact(
+                    keep=min(count, max(self.max_entries // 2 - len(records), 0))
+                )
+            with open(self.path, "ab") as file:
+                file.write(records.tobytes())
+                file.flush()
+            self._refresh()
+
+    def entries(self) -> int:
+        with self._lock:
+            return len(self._index)
+
+    def size_bytes(self) -> int:
+        return os.path.getsize(self.path) if os.path.exists(self.path) else 0
+
+
+class EmbeddingCache:
+    """
+    Two tier embedding cache keyed by a hash of model, input type and text: an
+    in-process LRU in front of an optional on-disk store of memory mapped vectors
+    (one bounded file per model in EMBEDDING_CACHE_DIR), shared by every worker on
+    the host
+
+    Args:
+        max_size (int): vectors kept in memory
+        directory (str): directory for the on-disk tier, None to disable it
+        max_disk_entries (int): vectors kept on disk per model
+    """
+
+    def __init__(
+        self,
+        max_size: int,
+        directory: Optional[str] = None,
+        max_disk_entries: int = EMBEDDING_CACHE_MAX_DISK_ENTRIES,
+    ):
+        self.memory = TTLCache("embedding", max_size=max_size)
+        self.directory = directory
+        self.max_disk_entries = max_disk_entries
+        self.disk_hits = 0
+        self.disk_misses = 0
+        self._files: Dict[str, VectorFile] = {}
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        metrics.register_collector("embedding_store", self.stats)
+
+    def _file_prefix(self, model: str) -> str:
+        return re.sub(r"[^A-Za-z0-9_.-]", "_", model)
+
+    def _vector_file(
+        self, model: str, dimensions: Optional[int] = None
+    ) -> Optional[VectorFile]:
+        if not self.directory:
+            return None
+        with self._lock:
+            vector_file = self._files.get(model)
+            if vector_file is not None:
+                return vector_file
+
+            prefix = self._file_prefix(model)
+            if dimensions is None:
+                for name in os.listdir(self.directory):
+                    match = re.fullmatch(re.escape(prefix) + r"\.(\d+)\.f32", name)
+                    if match:
+                        dimensions = int(match.group(1))
+                        break
+            if dimensions is None:
+                return None
+
+            path = os.path.join(self.directory, f"{prefix}.{dimensions}.f32")
+            vector_file = self._files[model] = VectorFile(
+                path, dimensions, self.max_disk_entries
+            )
+            return vector_file
+
+    def get(self, model: str, input_type: str, text: str) -> Optional[np.ndarray]:
+        digest = text_digest(model, input_type, text)
+        vector = self.memory.get(digest)
+        if vector is not None:
+            return vector
+
+        vector_file = self._vector_file(model)
+        if vector_file is None:
+            return None
+        vector = vector_file.get(digest)
+        if vector is None:
+            self.disk_misses += 1
+            return None
+        self.disk_hits += 1
+        self.memory.set(digest, vector)
+        return vector
+
+    def put(
+        self,
+        model: str,
+        input_type: str,
+        texts: List[str],
+        vectors: List[List[float]],
+    ):
+        digests = [text_digest(model, input_type, text) for text in texts]
+        arrays = [np.asarray(vector, dtype=np.float32) for vector in vectors]
+        for digest, array in zip(digests, arrays):
+            self.memory.set(digest, array)
+
+        if not arrays:
+            return
+        vector_file = self._vector_file(model, dimensions=len(arrays[0]))
+        if vector_file is not None:
+            try:
+                vector_file.append(digests, arrays)
+            except OSError as error:
+                logger.warning(f"Embedding cache write failed: {error}")
+
+    def embed(
+        self,
+        model: str,
+        texts: List[str],
+        embed_texts: Callable[[List[str]], List[List[float]]],
+        input_type: str = DOCUMENT,
+    ) -> List[List[float]]:
+        """
+        Returns embeddings for texts, only passing texts missing from both tiers
+        to embed_texts, each distinct text once
+
+        Args:
+            model (str): embedding model, part of the cache key
+            texts (List[str]): texts to embed
+            embed_texts (Callable): embeds a list of texts on a miss
+            input_type (str): QUERY or DOCUMENT, part of the cache key
+
+        Returns:
+            List[List[float]]: one embedding per text
+        """
+        results = [self.get(model, input_type, text) for text in texts]
+        missing = list(
+            dict.fromkeys(
+                text for text, result in zip(texts, results) if result is None
+            )
+        )
+        if missing:
+            metrics.increment("embedding_cache_embedded_texts", len(missing))
+            embedded = dict(zip(missing, embed_texts(missing)))
+            self.put(model, input_type, missing, [embedded[text] for text in missing])
+            results = [
+                result if result is not None else np.asarray(embedded[text])
+                for text, result in zip(texts, results)
+            ]
+        return [np.asarray(result, dtype=np.float32).tolist() for result in results]
+
+    def stats(self) -> dict:
+        with self._lock:
+            files = dict(self._files)
+        lookups = self.disk_hits + self.disk_misses
+        return {
+            "memory_bytes": sum(vector.nbytes for vector in self.memory.values()),
+            "disk_enabled": bool(self.directory),
+            "disk_hits": self.disk_hits,
+            "disk_misses": self.disk_misses,
+            "disk_hit_rate": round(self.disk_hits / lookups, 4) if lookups else 0.0,
+            "disk_bytes": {
+                model: vector_file.size_bytes() for model, vector_file in files.items()
+            },
+            "disk_entries": {
+                model: vector_file.entries() for model, vector_file in files.items()
+            },
+            "disk_compactions": sum(
+                vector_file.compactions for vector_file in files.values()
+            ),
+        }
+
+
+embedding_cache = EmbeddingCache(
+    max_size=EMBEDDING_CACHE_MAX_ENTRIES,
+    directory=EMBEDDING_CACHE_DIR,
+    max_disk_entries=EMBEDDING_CACHE_MAX_DISK_ENTRIES,
+)
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper that serves repeated texts from the shared embedding cache
+
+    Args:
+        embeddings (Embeddings): model to embed cache misses with
+        model_id (str): model name used in the cache key
+    """
+
+    def __init__(self, embeddings: Embeddings, model_id: str):
+        self.embeddings = embeddings
+        self.model_id = model_id
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return embedding_cache.embed(
+            self.model_id, texts, self.embeddings.embed_documents, DOCUMENT
+        )
+
+    def embed_query(self, text: str) -> List[float]:
+        return embedding_cache.embed(
+            self.model_id,
+            [text],
+            lambda texts: [self.embeddings.embed_query(text) for text in texts],
+            QUERY,
+        )[0]
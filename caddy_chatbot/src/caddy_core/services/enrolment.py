@@ -6,6 +6,8 @@ from datetime import datetime
 
 from boto3.dynamodb.conditions import Attr
 
+DEFAULT_SOURCES = ["citizensadvice", "govuk", "advisernet"]
+
 
 def check_domain_status(domain: str):
     """
@@ -171,6 +173,4 @@ def check_user_sources(user: str = None):
                 logger.debug(f"USER SOURCES: {user_specific_sources}")
                 return user_specific_sources
 
-    default_sources = ["citizensadvice", "govuk", "advisernet"]
-
-    return default_sources
+    return list(DEFAULT_SOURCES)
@@ -0,0 +1,429 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from langchain_core.embeddings import Embeddings
+from langchain_text_splitters import Language, RecursiveCharacterTextSplitter
+from opensearchpy import OpenSearch, helpers
+
+from caddy_core.models import IngestionReport, ScrapedPage
+from caddy_core.services.local_vector_store import LocalVectorStore, index_exists
+from caddy_core.services.retrieval_cache import retrieval_cache
+from caddy_core.services.search import METADATA_FIELD, TEXT_FIELD, VECTOR_FIELD
+from caddy_core.utils.monitoring import logger, metrics
+from caddy_core.utils.resilience import RetryPolicy
+
+INGESTION_CHUNK_SIZE = int(os.getenv("INGESTION_CHUNK_SIZE", 2000))
+INGESTION_CHUNK_OVERLAP = int(os.getenv("INGESTION_CHUNK_OVERLAP", 200))
+INGESTION_EMBED_BATCH_SIZE = int(os.getenv("INGESTION_EMBED_BATCH_SIZE", 96))
+INGESTION_EMBED_CONCURRENCY = int(os.getenv("INGESTION_EMBED_CONCURRENCY", 4))
+INGESTION_BULK_CHUNK_SIZE = int(os.getenv("INGESTION_BULK_CHUNK_SIZE", 200))
+INGESTION_BULK_MAX_BYTES = int(os.getenv("INGESTION_BULK_MAX_BYTES", 10 * 1024**2))
+
+# (source, content hash, existing document ids)
+ExistingPages = Dict[str, Tuple[str, List[str]]]
+
+
+class ChunkRecord:
+    """
+    A chunk ready to write, or with vector None the id of a document to delete
+    """
+
+    __slots__ = ("text", "vector", "metadata", "delete_id")
+
+    def __init__(
+        self,
+        text: str = "",
+        vector: Optional[List[float]] = None,
+        metadata: Optional[Dict[str, str]] = None,
+        delete_id: Optional[str] = None,
+    ):
+        self.text = text
+        self.vector = vector
+        self.metadata = metadata or {}
+        self.delete_id = delete_id
+
+
+def content_hash(page: ScrapedPage, model_id: str) -> str:
+    """
+    Hash of everything that determines a page's chunks and vectors, so a change of
+    chunking settings or embedding model re-ingests every page
+    """
+    key = "\0".join(
+        [
+            model_id,
+            str(INGESTION_CHUNK_SIZE),
+            str(INGESTION_CHUNK_OVERLAP),
+            page.markdown,
+        ]
+    )
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+class OpenSearchIndexWriter:
+    """
+    Writes chunks to an OpenSearch index through streaming_bulk, which only pulls
+    records from the pipeline as fast as the cluster accepts them and backs off on
+    429 rejections
+
+    Args:
+        client (OpenSearch): client for the cluster
+        index (str): index name
+    """
+
+    def __init__(self, client: OpenSearch, index: str):
+        self.client = client
+        self.index = index
+        self._index_exists: Optional[bool] = None
+
+    def _ensure_index(self, dimensions: int):
+        """
+        Creates the index with a kNN mapping on the first write to a new index
+        """
+        if self._index_exists:
+            return
+        if not self.client.indices.exists(index=self.index):
+            self.client.indices.create(
+                index=self.index,
+                body={
+                    "settings": {"index": {"knn": True}},
+                    "mappings": {
+                        "properties": {
+                            VECTOR_FIELD: {
+                                "type": "knn_vector",
+                                "dimension": dimensions,
+                            },
+                            TEXT_FIELD: {"type": "text"},
+                            METADATA_FIELD: {"type": "object"},
+                        }
+                    },
+                },
+            )
+            logger.info(f"Created index {self.index}")
+        self._index_exists = True
+
+    def existing(self) -> ExistingPages:
+        if not self.client.indices.exists(index=self.index):
+            return {}
+        pages: ExistingPages = {}
+        for hit in helpers.scan(
+            self.client,
+            index=self.index,
+            query={"query": {"match_all": {}}},
+            _source=[f"{METADATA_FIELD}.source", f"{METADATA_FIELD}.content_hash"],
+        ):
+            metadata = hit["_source"].get(METADATA_FIELD, {})
+            source = metadata.get("source")
+            if source is None:
+                continue
+            page_hash, ids = pages.get(source, ("", []))
+            ids.append(hit["_id"])
+            pages[source] = (metadata.get("content_hash", page_hash), ids)
+        return pages
+
+    def _actions(self, records: Iterable[ChunkRecord]) -> Iterator[Dict[str, Any]]:
+        for record in records:
+            if record.delete_id is not None:
+                yield {
+                    "_op_type": "delete",
+                    "_index": self.index,
+                    "_id": record.delete_id,
+                }
+            else:
+                self._ensure_index(len(record.vector))
+                yield {
+                    "_op_type": "index",
+                    "_index": self.index,
+                    "_source": {
+                        TEXT_FIELD: record.text,
+                        VECTOR_FIELD: record.vector,
+                        METADATA_FIELD: record.metadata,
+                    },
+                }
+
+    def write(self, records: Iterable[ChunkRecord], report: IngestionReport):
+        for ok, item in helpers.streaming_bulk(
+            self.client,
+            self._actions(records),
+            chunk_size=INGESTION_BULK_CHUNK_SIZE,
+            max_chunk_bytes=INGESTION_BULK_MAX_BYTES,
+            max_retries=5,
+            initial_backoff=1,
+            max_backoff=30,
+            raise_on_error=False,
+        ):
+            operation, result = next(iter(item.items()))
+            if not ok and not (operation == "delete" and result.get("status") == 404):
+                report.errors += 1
+                logger.warning(f"Bulk {operation} failed on {self.index}: {result}")
+            elif operation == "delete":
+                report.chunks_deleted += 1
+            else:
+                report.chunks_written += 1
+
+
+class LocalIndexWriter:
+    """
+    Writes chunks to a local vector store index, which is rebuilt once with the
+    unchanged rows and the new chunks after every record has been read
+
+    Args:
+        index_path (str): index directory
+        embeddings (Embeddings): embeddings the store is opened with
+    """
+
+    def __init__(self, index_path: str, embeddings: Embeddings):
+        self.index_path = index_path
+        self.embeddings = embeddings
+        self.index = os.path.basename(os.path.normpath(index_path))
+        self._store: Optional[LocalVectorStore] = None
+        if index_exists(index_path):
+            self._store = LocalVectorStore(index_path, embeddings)
+
+    def existing(self) -> ExistingPages:
+        pages: ExistingPages = {}
+        if self._store is None:
+            return pages
+        for row in range(len(self._store.vectors)):
+            metadata = self._store._metadata(row)
+            page_hash, ids = pages.get(metadata["source"], ("", []))
+            ids.append(str(row))
+            pages[metadata["source"]] = (metadata.get("content_hash", page_hash), ids)
+        return pages
+
+    def write(self, records: Iterable[ChunkRecord], report: IngestionReport):
+        deleted: Set[int] = set()
+        texts, vectors, metadatas = [], [], []
+        for record in records:
+            if record.delete_id is not None:
+                deleted.add(int(record.delete_id))
+                continue
+            texts.append(record.text)
+            vectors.append(record.vector)
+            metadatas.append(record.metadata)
+        if not texts and not deleted:
+            return
+
+        report.chunks_deleted += len(deleted)
+        report.chunks_written += len(texts)
+        nlist = None
+        if self._store is not None:
+            kept = [
+                row for i, row in enumerate(self._store._rows()) if i not in deleted
+            ]
+            texts = [row[0] for row in kept] + texts
+            vectors = [row[2] for row in kept] + vectors
+            metadatas = [row[1] for row in kept] + metadatas
+            nlist = self._store.config.get("nlist")
+        LocalVectorStore.build(self.index_path, texts, vectors, metadatas, nlist=nlist)
+        self._store = LocalVectorStore(self.index_path, self.embeddings)
+
+
+class IngestionPipeline:
+    """
+    Streams scraped pages into a {source}_scrape_db index.
+
+    Pages whose content hash matches the indexed copy are skipped. Changed pages
+    are chunked, their chunks embedded in batches on a bounded pool of threads,
+    and their previous chunks deleted. Records are produced lazily, so the number
+    of embedding batches in flight is capped at the concurrency and the writer's
+    pace throttles the whole pipeline.
+
+    Args:
+        writer: OpenSearchIndexWriter or LocalIndexWriter for the index
+        embeddings (Embeddings): document embeddings
+        model_id (str): embedding model, part of the content hash
+        batch_size (int): chunks per embedding call
+        concurrency (int): embedding calls in flight
+    """
+
+    def __init__(
+        self,
+        writer: Any,
+        embeddings: Embeddings,
+        model_id: str,
+        batch_size: int = INGESTION_EMBED_BATCH_SIZE,
+        concurrency: int = INGESTION_EMBED_CONCURRENCY,
+    ):
+        self.writer = writer
+        self.embeddings = embeddings
+        self.model_id = model_id
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.retry_policy = RetryPolicy("ingestion_embedding")
+        self.splitter = RecursiveCharacterTextSplitter.from_language(
+            Language.MARKDOWN,
+            chunk_size=INGESTION_CHUNK_SIZE,
+            chunk_overlap=INGESTION_CHUNK_OVERLAP,
+        )
+
+    def _embed(self, texts: List[str]) -> List[List[float]]:
+        delay = self.retry_policy.base_delay
+        for attempt in range(1, self.retry_policy.max_attempts + 1):
+            try:
+                return self.embeddings.embed_documents(texts)
+            except Exception as error:
+                if attempt == self.retry_policy.max_attempts:
+                    raise
+                delay = self.retry_policy.next_delay(delay)
+                logger.warning(
+                    f"Embedding batch failed with error: {error}, "
+                    f"retrying in {delay:.2f}s"
+                )
+                time.sleep(delay)
+
+    def _batches(
+        self,
+        pages: Iterable[ScrapedPage],
+        existing: ExistingPages,
+        seen: Set[str],
+        report: IngestionReport,
+    ) -> Iterator[Tuple[List[ChunkRecord], List[ChunkRecord]]]:
+        """
+        Yields (deletions, chunks to embed) batches for the changed pages
+        """
+        deletions: List[ChunkRecord] = []
+        chunks: List[ChunkRecord] = []
+        for page in pages:
+            report.pages += 1
+            seen.add(page.source)
+            page_hash = content_hash(page, self.model_id)
+            previous_hash, previous_ids = existing.get(page.source, (None, []))
+            if previous_hash == page_hash:
+                report.unchanged += 1
+                continue
+
+            deletions.extend(ChunkRecord(delete_id=i) for i in previous_ids)
+            for position, text in enumerate(self.splitter.split_text(page.markdown)):
+                chunks.append(
+                    ChunkRecord(
+                        text=text,
+                        metadata={
+                            "source": page.source,
+                            "raw_markdown": text,
+                            "content_hash": page_hash,
+                            "chunk": str(position),
+                        },
+                    )
+                )
+                if len(chunks) == self.batch_size:
+                    yield deletions, chunks
+                    deletions, chunks = [], []
+        if deletions or chunks:
+            yield deletions, chunks
+
+    def records(
+        self,
+        pages: Iterable[ScrapedPage],
+        existing: ExistingPages,
+        prune: bool,
+        report: IngestionReport,
+    ) -> Iterator[ChunkRecord]:
+        """
+        Yields the deletions and embedded chunks to write, in page order
+        """
+        seen: Set[str] = set()
+        pending: deque[Tuple[List[ChunkRecord], List[ChunkRecord], Future]] = deque()
+        with ThreadPoolExecutor(
+            max_workers=self.concurrency, thread_name_prefix="ingestion"
+        ) as executor:
+            for deletions, chunks in self._batches(pages, existing, seen, report):
+                future = executor.submit(self._embed, [c.text for c in chunks])
+                pending.append((deletions, chunks, future))
+                if len(pending) >= self.concurrency:
+                    yield from self._embedded(*pending.popleft())
+            while pending:
+                yield from self._embedded(*pending.popleft())
+
+        if prune:
+            for source in existing.keys() - seen:
+                report.removed += 1
+                for document_id in existing[source][1]:
+                    yield ChunkRecord(delete_id=document_id)
+
+    @staticmethod
+    def _embedded(
+        deletions: List[ChunkRecord], chunks: List[ChunkRecord], future: Future
+    ) -> Iterator[ChunkRecord]:
+        yield from deletions
+        for chunk, vector in zip(chunks, future.result() if chunks else []):
+            chunk.vector = vector
+            yield chunk
+
+    def run(self, pages: Iterable[ScrapedPage], prune: bool = False) -> IngestionReport:
+        """
+        Ingests pages into the writer's index
+
+        Args:
+            pages (Iterable[ScrapedPage]): scraped pages, read lazily
+            prune (bool): delete indexed pages missing from pages, for full refreshes
+
+        Returns:
+            IngestionReport: counts and duration of the run
+        """
+        started = time.perf_counter()
+        report = IngestionReport(index=self.writer.index)
+        existing = self.writer.existing()
+        self.writer.write(self.records(pages, existing, prune, report), report)
+
+        report.seconds = round(time.perf_counter() - started, 3)
+        if report.chunks_written or report.chunks_deleted:
+            if retrieval_cache.table is None:
+                logger.warning(
+                    "RETRIEVAL_GENERATIONS_TABLE_NAME is not set, serving retrieval "
+                    "caches keep results for this index until RETRIEVAL_CACHE_TTL"
+                )
+            retrieval_cache.invalidate_index(self.writer.index)
+        metrics.observe("ingestion_seconds", report.seconds)
+        logger.info(f"Ingestion finished: {report.model_dump()}")
+        return report
+
+
+def read_pages(path: str) -> Iterator[ScrapedPage]:
+    """
+    Reads scraped pages from a JSON lines file of {"source", "markdown"} objects
+    """
+    with open(path) as file:
+        for line in file:
+            if line.strip():
+                yield ScrapedPage(**json.loads(line))
+
+
+def main():
+    from caddy_core.services.llm import EMBEDDING_MODEL, get_batched_embeddings
+
+    parser = argparse.ArgumentParser(description="Ingest scraped pages into an index")
+    parser.add_argument("source", help="source name, e.g. govuk")
+    parser.add_argument("pages", help="JSON lines file of scraped pages")
+    parser.add_argument(
+        "--prune", action="store_true", help="delete pages missing from the file"
+    )
+    parser.add_argument("--local", help="local vector store root instead of OpenSearch")
+    args = parser.parse_args()
+
+    index = f"{args.source}_scrape_db"
+    # One InvokeModel call per batch of INGESTION_EMBED_BATCH_SIZE chunks
+    embeddings = get_batched_embeddings()
+    if args.local:
+        writer = LocalIndexWriter(os.path.join(args.local, index), embeddings)
+    else:
+        from caddy_core.services.retrieval_chain import auth, opensearch_https
+        from caddy_core.services.search import get_search_backend
+
+        writer = OpenSearchIndexWriter(
+            get_search_backend(opensearch_https, auth).client, index
+        )
+
+    report = IngestionPipeline(writer, embeddings, EMBEDDING_MODEL).run(
+        read_pages(args.pages), prune=args.prune
+    )
+    print(report.model_dump_json())
+
+
+if __name__ == "__main__":
+    main()
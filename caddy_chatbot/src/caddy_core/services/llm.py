@@ -0,0 +1,218 @@
+import json
+import os
+import threading
+from typing import Dict, List
+
+import boto3
+from botocore.config import Config
+from langchain_aws import ChatBedrock
+from langchain_community.embeddings import BedrockEmbeddings
+from langchain_core.embeddings import Embeddings
+
+from caddy_core.utils.monitoring import logger, metrics
+
+bedrock_region = os.getenv("BEDROCK_REGION", "eu-west-3")
+
+BEDROCK_MAX_POOL_CONNECTIONS = int(os.getenv("BEDROCK_MAX_POOL_CONNECTIONS", 64))
+BEDROCK_CONNECT_TIMEOUT = float(os.getenv("BEDROCK_CONNECT_TIMEOUT", 5))
+BEDROCK_READ_TIMEOUT = float(os.getenv("BEDROCK_READ_TIMEOUT", 120))
+
+# Model kwargs per call site, each role's model can be overridden with LLM_<ROLE>
+MODEL_ROLES = {
+    "generation": {"temperature": 0.3, "top_k": 5, "max_tokens": 2000},
+    "rewording": {"temperature": 0.3, "top_k": 5, "max_tokens": 2000},
+    "client_friendly": {"temperature": 0.3, "top_k": 5, "max_tokens": 2000},
+}
+
+EMBEDDING_MODEL = "cohere.embed-english-v3"
+# Most texts Cohere embed accepts in one request
+COHERE_MAX_BATCH = 96
+
+_lock = threading.Lock()
+_clients: Dict[str, object] = {}
+_chat_models: Dict[str, ChatBedrock] = {}
+_embedding_models: Dict[str, BedrockEmbeddings] = {}
+_in_flight: Dict[str, int] = {}
+
+
+def _adjust_in_flight(region: str, delta: int):
+    with _lock:
+        _in_flight[region] = _in_flight.get(region, 0) + delta
+
+
+def _track_calls(client, region: str):
+    """
+    Counts in-flight calls around every API call of the client. botocore skips
+    its after-call event when the send raises, so the count is kept in a
+    try/finally rather than in event hooks
+    """
+    make_api_call = client._make_api_call
+
+    def tracked_api_call(operation_name, api_params):
+        _adjust_in_flight(region, 1)
+        metrics.increment("bedrock_calls")
+        try:
+            return make_api_call(operation_name, api_params)
+        finally:
+            _adjust_in_flight(region, -1)
+
+    client._make_api_call = tracked_api_call
+
+
+def get_bedrock_client(region: str = bedrock_region):
+    """
+    Returns the long-lived bedrock-runtime client for a region, shared by every model
+    so calls reuse warm, kept-alive connections from one pool
+    """
+    with _lock:
+        client = _clients.get(region)
+        if client is not None:
+            return client
+
+        logger.info(f"Creating Bedrock runtime client for {region}")
+        client = boto3.Session().client(
+            "bedrock-runtime",
+            region_name=region,
+            config=Config(
+                max_pool_connections=BEDROCK_MAX_POOL_CONNECTIONS,
+                tcp_keepalive=True,
+                connect_timeout=BEDROCK_CONNECT_TIMEOUT,
+                read_timeout=BEDROCK_READ_TIMEOUT,
+                # Retries are left to retry_async, which applies the retry budget
+                retries={"mode": "standard", "max_attempts": 1},
+            ),
+        )
+        _track_calls(client, region)
+        _clients[region] = client
+        return client
+
+
+def get_chat_model(role: str = "generation") -> ChatBedrock:
+    """
+    Returns the configured chat model for a call site role
+
+    Args:
+        role (str): one of MODEL_ROLES
+
+    Returns:
+        ChatBedrock: model bound to the shared Bedrock client
+    """
+    if role not in MODEL_ROLES:
+        raise ValueError(f"Unknown LLM role: {role}")
+
+    with _lock:
+        model = _chat_models.get(role)
+    if model is not None:
+        return model
+
+    model = ChatBedrock(
+        client=get_bedrock_client(),
+        model_id=os.getenv(f"LLM_{role.upper()}", os.getenv("LLM")),
+        region_name=bedrock_region,
+        model_kwargs=MODEL_ROLES[role],
+    )
+    with _lock:
+        return _chat_models.setdefault(role, model)
+
+
+def get_embeddings(model_id: str = EMBEDDING_MODEL) -> BedrockEmbeddings:
+    """
+    Returns the Bedrock embeddings model bound to the shared Bedrock client
+    """
+    with _lock:
+        model = _embedding_models.get(model_id)
+    if model is not None:
+        return model
+
+    model = BedrockEmbeddings(
+        client=get_bedrock_client(), model_id=model_id, region_name=bedrock_region
+    )
+    with _lock:
+        return _embedding_models.setdefault(model_id, model)
+
+
+class BatchedCohereEmbeddings(Embeddings):
+    """
+    Cohere embeddings on Bedrock that send up to COHERE_MAX_BATCH texts per
+    InvokeModel call. BedrockEmbeddings makes one call per text, so bulk
+    embedding such as ingestion uses this instead
+
+    Args:
+        client: bedrock-runtime client
+        model_id (str): Cohere embedding model
+        batch_size (int): texts per call, capped at COHERE_MAX_BATCH
+    """
+
+    def __init__(
+        self,
+        client,
+        model_id: str = EMBEDDING_MODEL,
+        batch_size: int = COHERE_MAX_BATCH,
+    ):
+        self.client = client
+        self.model_id = model_id
+        self.batch_size = max(1, min(batch_size, COHERE_MAX_BATCH))
+
+    def _invoke(self, texts: List[str], input_type: str) -> List[List[float]]:
+        response = self.client.invoke_model(
+            modelId=self.model_id,
+            body=json.dumps(
+                {"texts": texts, "input_type": input_type, "truncate": "END"}
+            ),
+            accept="application/json",
+            contentType="application/json",
+        )
+        return json.loads(response["body"].read())["embeddings"]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors: List[List[float]] = []
+        for offset in range(0, len(texts), self.batch_size):
+            batch = texts[offset : offset + self.batch_size]
+            vectors.extend(self._invoke(batch, "search_document"))
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._invoke([text], "search_query")[0]
+
+
+def get_batched_embeddings(model_id: str = EMBEDDING_MODEL) -> BatchedCohereEmbeddings:
+    """
+    Returns batched Cohere embeddings bound to the shared Bedrock client
+    """
+    return BatchedCohereEmbeddings(get_bedrock_client(), model_id)
+
+
+def pool_stats() -> dict:
+    """
+    Reports connection pool utilisation for each Bedrock client
+    """
+    stats = {}
+    with _lock:
+        clients = dict(_clients)
+        in_flight = dict(_in_flight)
+
+    for region, client in clients.items():
+        pools = []
+        manager = getattr(client._endpoint.http_session, "_manager", None)
+        if manager is not None:
+            for key in list(manager.pools.keys()):
+                pool = manager.pools.get(key)
+                if pool is None:
+                    continue
+                pools.append(
+                    {
+                        "host": pool.host,
+                        "connections_opened": pool.num_connections,
+                        "requests": pool.num_requests,
+                        "idle": pool.pool.qsize() if pool.pool else 0,
+                    }
+                )
+        stats[region] = {
+            "max_pool_connections": BEDROCK_MAX_POOL_CONNECTIONS,
+            "in_flight": in_flight.get(region, 0),
+            "pools": pools,
+        }
+    return stats
+
+
+metrics.register_collector("bedrock_pools", pool_stats)
@@ -0,0 +1,451 @@
+import json
+import os
+import shutil
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from langchain_community.vectorstores.utils import maximal_marginal_relevance
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+from caddy_core.services.retrieval_cache import retrieval_cache
+from caddy_core.services.score_calibration import score_calibration
+from caddy_core.utils.monitoring import logger
+
+LOCAL_VECTOR_STORE_PATH = os.getenv("LOCAL_VECTOR_STORE_PATH", "vector_store")
+LOCAL_VECTOR_STORE_NPROBE = int(os.getenv("LOCAL_VECTOR_STORE_NPROBE", 8))
+
+TEXT_COLUMN = "text"
+METADATA_COLUMNS = ["source", "raw_markdown", "content_hash"]
+CURRENT_POINTER = "CURRENT"
+
+
+def current_version_path(index_path: str) -> Optional[str]:
+    """
+    Directory holding the current build of an index, None if it has never been
+    built. Indices written before builds were versioned are read in place
+    """
+    try:
+        with open(os.path.join(index_path, CURRENT_POINTER)) as file:
+            return os.path.join(index_path, file.read().strip())
+    except FileNotFoundError:
+        if os.path.exists(os.path.join(index_path, "index.json")):
+            return index_path
+        return None
+
+
+def index_exists(index_path: str) -> bool:
+    return current_version_path(index_path) is not None
+
+
+class StringColumn:
+    """
+    Column of strings stored as one UTF-8 blob with an offsets array, both memory
+    mapped, so a row is read without loading the column
+    """
+
+    def __init__(self, directory: str, name: str):
+        self.offsets = np.load(
+            os.path.join(directory, f"{name}.offsets.npy"), mmap_mode="r"
+        )
+        data_path = os.path.join(directory, f"{name}.data")
+        self.data = (
+            np.memmap(data_path, dtype=np.uint8, mode="r")
+            if os.path.getsize(data_path)
+            else np.zeros(0, dtype=np.uint8)
+        )
+
+    def __getitem__(self, row: int) -> str:
+        start, end = int(self.offsets[row]), int(self.offsets[row + 1])
+        return self.data[start:end].tobytes().decode("utf-8")
+
+    @staticmethod
+    def write(directory: str, name: str, values: Iterable[str]):
+        encoded = [(value or "").encode("utf-8") for value in values]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(value) for value in encoded])
+        np.save(os.path.join(directory, f"{name}.offsets.npy"), offsets)
+        with open(os.path.join(directory, f"{name}.data"), "wb") as file:
+            file.write(b"".join(encoded))
+
+
+def _kmeans(vectors: np.ndarray, clusters: int, iterations: int = 20) -> np.ndarray:
+    rng = np.random.default_rng(42)
+    centroids = vectors[rng.choice(len(vectors), clusters, replace=False)].copy()
+    for _ in range(iterations):
+        labels = np.argmax(vectors @ centroids.T, axis=1)
+        for i in range(clusters):
+            members = vectors[labels == i]
+            if len(members):
+                centroid = members.mean(axis=0)
+                centroids[i] = centroid / (np.linalg.norm(centroid) or 1.0)
+    return centroids
+
+
+class LocalVectorStore(VectorStore):
+    """
+    Vector store on local files, for running retrieval without OpenSearch.
+
+    An index build holds unit-normalised float32 vectors in vectors.npy, read
+    through a memory map, and the text and metadata as columnar string sidecars.
+    Each build is written to its own version directory inside the index directory
+    and published by atomically replacing the CURRENT pointer file, so a reader
+    always loads every file from the same build.
+    Search is exact (flat) by default. Indices built with nlist partitions also get
+    an IVF index and search the LOCAL_VECTOR_STORE_NPROBE nearest partitions.
+    Scores are cosine similarities.
+
+    Args:
+        index_path (str): index directory
+        embedding_function (Embeddings): embeddings for queries
+    """
+
+    def __init__(self, index_path: str, embedding_function: Embeddings):
+        self.index_path = index_path
+        self.index_name = os.path.basename(os.path.normpath(index_path))
+        self.embedding_function = embedding_function
+        self._lock = threading.Lock()
+        self._load()
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self.embedding_function
+
+    def _load(self):
+        version_path = current_version_path(self.index_path)
+        if version_path is None:
+            raise FileNotFoundError(f"No local index at {self.index_path}")
+        with open(os.path.join(version_path, "index.json")) as file:
+            self.config = json.load(file)
+        self.vectors = np.load(os.path.join(version_path, "vectors.npy"), mmap_mode="r")
+        self.columns = {
+            name: StringColumn(version_path, name)
+            for name in [TEXT_COLUMN] + self.config["metadata_columns"]
+        }
+
+        self.centroids = None
+        self.partitions = None
+        if self.config.get("nlist"):
+            self.centroids = np.load(os.path.join(version_path, "centroids.npy"))
+            assignments = np.load(os.path.join(version_path, "assignments.npy"))
+            order = np.argsort(assignments, kind="stable")
+            bounds = np.searchsorted(
+                assignments[order], np.arange(len(self.centroids) + 1)
+            )
+            self.partitions = [
+                order[bounds[i] : bounds[i + 1]] for i in range(len(self.centroids))
+            ]
+        logger.info(
+            f"Loaded local index {self.index_name} with {len(self.vectors)} vectors"
+        )
+
+    @classmethod
+    def build(
+        cls,
+        index_path: str,
+        texts: List[str],
+        vectors: List[List[float]],
+        metadatas: Optional[List[Dict[str, Any]]] = None,
+        nlist: Optional[int] = None,
+        centroids: Optional[np.ndarray] = None,
+    ):
+        """
+        Writes a new build of an index and makes it the current one
+
+        Args:
+            index_path (str): index directory, its current build is replaced
+            texts (List[str]): document texts
+            vectors (List[List[float]]): document embeddings
+            metadatas (List[dict]): document metadata, METADATA_COLUMNS are kept
+            nlist (int): IVF partitions, None for a flat index
+            centroids (np.ndarray): IVF centroids to reuse instead of running k-means
+        """
+        version = f"v{time.time_ns()}"
+        staging = os.path.join(index_path, version)
+        os.makedirs(staging)
+        metadatas = metadatas or [{} for _ in texts]
+
+        matrix = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix = matrix / np.where(norms == 0, 1.0, norms)
+        np.save(os.path.join(staging, "vectors.npy"), matrix)
+
+        StringColumn.write(staging, TEXT_COLUMN, texts)
+        for name in METADATA_COLUMNS:
+            StringColumn.write(
+                staging, name, (metadata.get(name, "") for metadata in metadatas)
+            )
+
+        nlist = min(nlist, len(matrix)) if nlist else None
+        if centroids is not None and len(matrix):
+            nlist = len(centroids)
+        elif nlist:
+            centroids = _kmeans(matrix, nlist)
+        if nlist:
+            np.save(os.path.join(staging, "centroids.npy"), centroids)
+            np.save(
+                os.path.join(staging, "assignments.npy"),
+                np.argmax(matrix @ centroids.T, axis=1).astype(np.int32),
+            )
+
+        with open(os.path.join(staging, "index.json"), "w") as file:
+            json.dump(
+                {
+                    "count": len(matrix),
+                    "dimensions": int(matrix.shape[1]) if len(matrix) else 0,
+                    "nlist": nlist,
+                    "metadata_columns": METADATA_COLUMNS,
+                },
+                file,
+            )
+
+        previous = current_version_path(index_path)
+        pointer = os.path.join(index_path, f"{CURRENT_POINTER}.{version}")
+        with open(pointer, "w") as file:
+            file.write(version)
+        os.replace(pointer, os.path.join(index_path, CURRENT_POINTER))
+        cls._remove_old_versions(index_path, keep={version, previous})
+
+    @staticmethod
+    def _remove_old_versions(index_path: str, keep: set):
+        """
+        Removes builds older than the previous one. Readers keep their memory maps
+        of removed files, and one that read the pointer just before the swap still
+        finds the previous build
+        """
+        keep = {os.path.basename(path) for path in keep if path}
+        for name in os.listdir(index_path):
+            path = os.path.join(index_path, name)
+            if name.startswith("v") and name not in keep and os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+
+    def _rows(self) -> Iterable[Tuple[str, Dict[str, str], np.ndarray]]:
+        for row in range(len(self.vectors)):
+            yield self._text(row), self._metadata(row), self.vectors[row]
+
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: Optional[List[dict]] = None,
+        **kwargs: Any,
+    ) -> List[str]:
+        """
+        Embeds and adds texts by writing a new build with the existing rows, reusing
+        the IVF centroids rather than repartitioning. Every call copies the whole
+        index, so this is meant for bulk additions, not one document at a time
+        """
+        texts = list(texts)
+        metadatas = metadatas or [{} for _ in texts]
+        vectors = self.embedding_function.embed_documents(texts)
+        with self._lock:
+            existing = list(self._rows())
+            start = len(existing)
+            self.build(
+                self.index_path,
+                [row[0] for row in existing] + texts,
+                [row[2] for row in existing] + list(vectors),
+                [row[1] for row in existing] + metadatas,
+                nlist=self.config.get("nlist"),
+                centroids=self.centroids,
+            )
+            self._load()
+        retrieval_cache.invalidate_index(self.index_name)
+        return [str(row) for row in range(start, start + len(texts))]
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: List[str],
+        embedding: Embeddings,
+        metadatas: Optional[List[dict]] = None,
+        index_path: str = LOCAL_VECTOR_STORE_PATH,
+        nlist: Optional[int] = None,
+        **kwargs: Any,
+    ) -> "LocalVectorStore":
+        cls.build(index_path, texts, embedding.embed_documents(texts), metadatas, nlist)
+        return cls(index_path, embedding)
+
+    def _text(self, row: int) -> str:
+        return self.columns[TEXT_COLUMN][row]
+
+    def _metadata(self, row: int) -> Dict[str, str]:
+        return {
+            name: self.columns[name][row] for name in self.config["metadata_columns"]
+        }
+
+    def search_vector(self, embedding: List[float], k: int) -> List[Tuple[int, float]]:
+        """
+        Returns the k nearest rows and their cosine similarity, best first
+        """
+        if not len(self.vectors) or k <= 0:
+            return []
+        query = np.asarray(embedding, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+
+        if self.partitions is not None:
+            probe = np.argsort(-(self.centroids @ query))[:LOCAL_VECTOR_STORE_NPROBE]
+            candidates = np.concatenate([self.partitions[i] for i in probe])
+            # k-means can leave the probed partitions empty
+            if not len(candidates):
+                return []
+        else:
+            candidates = None
+
+        vectors = self.vectors if candidates is None else self.vectors[candidates]
+        scores = np.asarray(vectors @ query)
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        rows = top if candidates is None else candidates[top]
+        return [(int(row), float(score)) for row, score in zip(rows, scores[top])]
+
+    def knn_hits(self, embedding: List[float], k: int):
+        """
+        Nearest rows as (text, metadata, vector, score), as the search backends return
+        """
+        return [
+            (self._text(row), self._metadata(row), self.vectors[row].tolist(), score)
+            for row, score in self.search_vector(embedding, k)
+        ]
+
+    def similarity_search_with_score_by_vector(
+        self, embedding: List[float], k: int = 4, **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        return [
+            (Document(page_content=text, metadata=metadata), score)
+            for text, metadata, _, score in self.knn_hits(embedding, k)
+        ]
+
+    def similarity_search_with_score(
+        self, query: str, k: int = 4, **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        return self.similarity_search_with_score_by_vector(
+            self.embedding_function.embed_query(query), k
+        )
+
+    def similarity_search_by_vector(
+        self, embedding: List[float], k: int = 4, **kwargs: Any
+    ) -> List[Document]:
+        return [
+            document
+            for document, _ in self.similarity_search_with_score_by_vector(embedding, k)
+        ]
+
+    def similarity_search(
+        self, query: str, k: int = 4, **kwargs: Any
+    ) -> List[Document]:
+        return [document for document, _ in self.similarity_search_with_score(query, k)]
+
+    def similarity_search_with_relevance_scores(
+        self,
+        query: str,
+        k: int = 5,
+        **kwargs: Any,
+    ) -> List[Tuple[Any, float]]:
+        """
+        Return docs and relevance scores, calibrated per index when
+        SCORE_CALIBRATION_PATH covers it and min-max scaled otherwise. Hits below
+        score_threshold are dropped
+        """
+        score_threshold = kwargs.pop("score_threshold", None)
+        results = self.similarity_search_with_score(query, k=k, **kwargs)
+        relevance = score_calibration.relevance_scores(
+            self.index_name, [score for _, score in results]
+        )
+        return [
+            (doc, score)
+            for (doc, _), score in zip(results, relevance)
+            if score_threshold is None or score >= score_threshold
+        ]
+
+    def max_marginal_relevance_search_by_vector(
+        self,
+        embedding: List[float],
+        k: int = 4,
+        fetch_k: int = 20,
+        lambda_mult: float = 0.5,
+        **kwargs: Any,
+    ) -> List[Document]:
+        hits = self.knn_hits(embedding, fetch_k)
+        if not hits:
+            return []
+        selected = maximal_marginal_relevance(
+            np.array(embedding), [hit[2] for hit in hits], k=k, lambda_mult=lambda_mult
+        )
+        return [
+            Document(page_content=hits[i][0], metadata=hits[i][1]) for i in selected
+        ]
+
+    def max_marginal_relevance_search(
+        self,
+        query: str,
+        k: int = 4,
+        fetch_k: int = 20,
+        lambda_mult: float = 0.5,
+        **kwargs: Any,
+    ) -> List[Document]:
+        return self.max_marginal_relevance_search_by_vector(
+            self.embedding_function.embed_query(query), k, fetch_k, lambda_mult
+        )
+
+
+class LocalSearchBackend:
+    """
+    Search backend over local indices in LOCAL_VECTOR_STORE_PATH, one directory
+    per index name, interchangeable with OpenSearchBackend
+
+    Args:
+        root (str): directory holding the index directories
+        embeddings (Embeddings): embeddings for queries and added texts
+    """
+
+    def __init__(self, root: str, embeddings: Embeddings):
+        self.root = root
+        self.embeddings = embeddings
+        self._stores: Dict[str, LocalVectorStore] = {}
+        self._lock = threading.Lock()
+        self._warned_lexical = False
+
+    def store(self, index: str) -> Optional[LocalVectorStore]:
+        with self._lock:
+            if index not in self._stores:
+                index_path = os.path.join(self.root, index)
+                if not index_exists(index_path):
+                    logger.warning(f"No local index for {index}")
+                    return None
+                self._stores[index] = LocalVectorStore(index_path, self.embeddings)
+            return self._stores[index]
+
+    def knn_search(self, vector: List[float], fetch_k: Dict[str, int]):
+        results = {}
+        for index, k in fetch_k.items():
+            store = self.store(index)
+            results[index] = store.knn_hits(vector, k) if store is not None else []
+        return results
+
+    def hybrid_search(self, query: str, vector: List[float], fetch_k: Dict[str, int]):
+        """
+        The local store has no lexical index, so hybrid retrieval runs as kNN only
+        """
+        if not self._warned_lexical:
+            logger.warning("Local vector store has no BM25 index, using kNN only")
+            self._warned_lexical = True
+        return self.knn_search(vector, fetch_k)
+
+
+_backend: Optional[LocalSearchBackend] = None
+_backend_lock = threading.Lock()
+
+
+def get_local_search_backend(root: str, embeddings: Embeddings) -> LocalSearchBackend:
+    """
+    Returns the process-wide local search backend, created on first use
+    """
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = LocalSearchBackend(root, embeddings)
+        return _backend
@@ -0,0 +1,152 @@
+import os
+import threading
+from typing import Any, Dict, Optional
+
+from opensearchpy import (
+    AsyncHttpConnection,
+    AsyncOpenSearch,
+    AWSV4SignerAsyncAuth,
+    OpenSearch,
+    RequestsHttpConnection,
+)
+
+from caddy_core.utils.monitoring import logger, metrics
+
+OPENSEARCH_CONNECT_TIMEOUT = float(os.getenv("OPENSEARCH_CONNECT_TIMEOUT", 3))
+OPENSEARCH_READ_TIMEOUT = float(os.getenv("OPENSEARCH_READ_TIMEOUT", 20))
+OPENSEARCH_POOL_MAXSIZE = int(os.getenv("OPENSEARCH_POOL_MAXSIZE", 20))
+OPENSEARCH_ASYNC = os.getenv("OPENSEARCH_ASYNC", "True").lower() == "true"
+
+
+class PooledRequestsHttpConnection(RequestsHttpConnection):
+    """
+    RequestsHttpConnection with separate connect and read deadlines, which requests
+    accepts as a (connect, read) tuple
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.timeout = (OPENSEARCH_CONNECT_TIMEOUT, OPENSEARCH_READ_TIMEOUT)
+
+
+_client: Optional[OpenSearch] = None
+_async_client: Optional[AsyncOpenSearch] = None
+_lock = threading.Lock()
+
+
+def get_opensearch_client(opensearch_url: str, http_auth: Any) -> OpenSearch:
+    """
+    Returns the process-wide OpenSearch client, created on first use. Its pooled
+    connections keep TLS sessions open, and the AWS4Auth signer refreshes
+    credentials in place, so every search and vector store should share it
+
+    Args:
+        opensearch_url (str): collection endpoint
+        http_auth (AWS4Auth): request signer
+
+    Returns:
+        OpenSearch: shared client
+    """
+    global _client
+    with _lock:
+        if _client is None:
+            _client = OpenSearch(
+                hosts=[opensearch_url],
+                http_auth=http_auth,
+                use_ssl=True,
+                verify_certs=True,
+                connection_class=PooledRequestsHttpConnection,
+                pool_maxsize=OPENSEARCH_POOL_MAXSIZE,
+                max_retries=1,
+                retry_on_timeout=False,
+            )
+            logger.info(
+                f"Created OpenSearch client with {OPENSEARCH_POOL_MAXSIZE} pooled "
+                "connections"
+            )
+        return _client
+
+
+def get_async_opensearch_client(
+    opensearch_url: str, http_auth: Any
+) -> Optional[AsyncOpenSearch]:
+    """
+    Returns the process-wide async OpenSearch client for the event loop, signing
+    with the same refreshable credentials as the AWS4Auth signer. None when
+    OPENSEARCH_ASYNC is off or the signer has no refreshable credentials
+
+    Args:
+        opensearch_url (str): collection endpoint
+        http_auth (AWS4Auth): request signer of the sync client
+
+    Returns:
+        Optional[AsyncOpenSearch]: shared async client
+    """
+    global _async_client
+    credentials = getattr(http_auth, "refreshable_credentials", None)
+    if not OPENSEARCH_ASYNC or credentials is None:
+        return None
+    with _lock:
+        if _async_client is None:
+            _async_client = AsyncOpenSearch(
+                hosts=[opensearch_url],
+                http_auth=AWSV4SignerAsyncAuth(
+                    credentials, http_auth.region, http_auth.service
+                ),
+                use_ssl=True,
+                verify_certs=True,
+                connection_class=AsyncHttpConnection,
+                maxsize=OPENSEARCH_POOL_MAXSIZE,
+                timeout=OPENSEARCH_CONNECT_TIMEOUT + OPENSEARCH_READ_TIMEOUT,
+                max_retries=1,
+                retry_on_timeout=False,
+            )
+        return _async_client
+
+
+async def close_opensearch_clients():
+    global _async_client
+    with _lock:
+        client, _async_client = _async_client, None
+    if client is not None:
+        await client.close()
+
+
+def _connections(client: Any):
+    connection_pool = getattr(client.transport, "connection_pool", None)
+    return getattr(connection_pool, "connections", ())
+
+
+def _sync_pool_stats(client: OpenSearch) -> Dict[str, Any]:
+    stats = {"open": 0, "idle": 0, "requests": 0, "maxsize": OPENSEARCH_POOL_MAXSIZE}
+    for connection in _connections(client):
+        adapter = connection.session.get_adapter(connection.host)
+        for key in adapter.poolmanager.pools.keys():
+            pool = adapter.poolmanager.pools[key]
+            stats["open"] += pool.num_connections
+            stats["requests"] += pool.num_requests
+            stats["idle"] += pool.pool.qsize() if pool.pool is not None else 0
+    return stats
+
+
+def _async_pool_stats(client: AsyncOpenSearch) -> Dict[str, Any]:
+    stats = {"in_use": 0, "maxsize": OPENSEARCH_POOL_MAXSIZE}
+    for connection in _connections(client):
+        session = getattr(connection, "session", None)
+        if session is not None:
+            stats["in_use"] += len(getattr(session.connector, "_acquired", ()))
+    return stats
+
+
+def pool_stats() -> dict:
+    with _lock:
+        client, async_client = _client, _async_client
+    stats = {}
+    if client is not None:
+        stats["sync"] = _sync_pool_stats(client)
+    if async_client is not None:
+        stats["async"] = _async_pool_stats(async_client)
+    return stats
+
+
+metrics.register_collector("opensearch_pool", pool_stats)
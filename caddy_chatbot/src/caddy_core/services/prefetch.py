@@ -0,0 +1,157 @@
+import asyncio
+import os
+import time
+from typing import Any, Callable, Dict
+
+from caddy_core.models import MessageContext, PrefetchTimeoutError, UserMessage
+from caddy_core.services import enrolment
+from caddy_core.utils.concurrency import run_blocking
+from caddy_core.utils.monitoring import logger, metrics
+from caddy_core.utils.prompt import get_prompt, get_route_name, get_route_prompt_name
+
+DEFAULT_LOOKUP_TIMEOUT = float(os.getenv("PREFETCH_TIMEOUT", 5))
+
+# Router embedding goes to Bedrock so gets longer than the DynamoDB reads
+LOOKUP_TIMEOUTS = {
+    "chat_history": DEFAULT_LOOKUP_TIMEOUT,
+    "route": DEFAULT_LOOKUP_TIMEOUT * 2,
+    "route_prompt": DEFAULT_LOOKUP_TIMEOUT,
+    "core_prompt": DEFAULT_LOOKUP_TIMEOUT,
+    "office": DEFAULT_LOOKUP_TIMEOUT,
+    "user_sources": DEFAULT_LOOKUP_TIMEOUT,
+    "supervisor_space": DEFAULT_LOOKUP_TIMEOUT,
+}
+
+_NO_FALLBACK = object()
+
+
+def get_lookup_timeout(name: str) -> float:
+    """
+    Timeout for a prefetch lookup, overridable with PREFETCH_TIMEOUT_<NAME>
+    """
+    override = os.getenv(f"PREFETCH_TIMEOUT_{name.upper()}")
+    if override:
+        return float(override)
+    return LOOKUP_TIMEOUTS.get(name, DEFAULT_LOOKUP_TIMEOUT)
+
+
+async def timed_lookup(
+    name: str,
+    func: Callable,
+    *args: Any,
+    timings: Dict[str, float],
+    fallback: Any = _NO_FALLBACK,
+) -> Any:
+    """
+    Runs a blocking lookup on the executor with a timeout, recording how long it took
+
+    Args:
+        name (str): lookup name used for timings, metrics and timeout overrides
+        func (Callable): blocking lookup to run
+        timings (dict): per-request timings the elapsed time is written to
+        fallback (Any): value returned on timeout, if not given the timeout is raised
+
+    Returns:
+        The lookup result, or the fallback on timeout
+    """
+    start = time.perf_counter()
+    try:
+        return await asyncio.wait_for(
+            run_blocking(func, *args), timeout=get_lookup_timeout(name)
+        )
+    except asyncio.TimeoutError:
+        metrics.increment(f"prefetch_{name}_timeouts")
+        if fallback is _NO_FALLBACK:
+            raise PrefetchTimeoutError(f"Prefetch lookup {name} timed out")
+        logger.warning(f"Prefetch lookup {name} timed out, using fallback")
+        return fallback
+    finally:
+        elapsed = time.perf_counter() - start
+        timings[name] = elapsed
+        metrics.observe(f"prefetch_{name}_seconds", elapsed)
+
+
+async def _route_augmentation(query: str, timings: Dict[str, float]):
+    # A slow router falls back to the unrouted prompt, as when no route matches
+    route = await timed_lookup(
+        "route", get_route_name, query, timings=timings, fallback=None
+    )
+    route_specific_augmentation = await timed_lookup(
+        "route_prompt", get_prompt, get_route_prompt_name(route), timings=timings
+    )
+    return route, route_specific_augmentation
+
+
+async def _office_regions(domain: str, timings: Dict[str, float]):
+    _, office = await timed_lookup(
+        "office", enrolment.check_domain_status, domain, timings=timings
+    )
+    return enrolment.get_office_coverage(office)
+
+
+async def prefetch_message_context(
+    caddy_query: UserMessage, history_lookup: Callable
+) -> MessageContext:
+    """
+    Runs the independent lookups needed before chain construction concurrently,
+    lookups that depend on another (route prompt on route, coverage on office) are
+    chained within their own branch
+
+    Args:
+        caddy_query (UserMessage): the adviser message
+        history_lookup (Callable): blocking chat history lookup for the message thread
+
+    Returns:
+        MessageContext: resolved lookups and their timings
+    """
+    timings = {}
+    start = time.perf_counter()
+    user = caddy_query.user_email
+    domain = user.split("@")[1]
+
+    (
+        chat_history,
+        (route, route_specific_augmentation),
+        core_prompt,
+        office_regions,
+        source_list,
+        supervisor_space,
+    ) = await asyncio.gather(
+        timed_lookup("chat_history", history_lookup, caddy_query, timings=timings),
+        _route_augmentation(caddy_query.message, timings),
+        timed_lookup("core_prompt", get_prompt, "CORE_PROMPT", timings=timings),
+        _office_regions(domain, timings),
+        timed_lookup(
+            "user_sources",
+            enrolment.check_user_sources,
+            user,
+            timings=timings,
+            fallback=enrolment.DEFAULT_SOURCES,
+        ),
+        timed_lookup(
+            "supervisor_space",
+            enrolment.get_designated_supervisor_space,
+            user,
+            timings=timings,
+        ),
+    )
+
+    timings["total"] = time.perf_counter() - start
+    metrics.observe("prefetch_total_seconds", timings["total"])
+    logger.info(
+        "Prefetch timings: "
+        + ", ".join(
+            f"{name}={elapsed * 1000:.0f}ms" for name, elapsed in timings.items()
+        )
+    )
+
+    return MessageContext(
+        chat_history=chat_history,
+        route=route,
+        route_specific_augmentation=route_specific_augmentation,
+        core_prompt=core_prompt,
+        office_regions=office_regions,
+        source_list=source_list,
+        supervisor_space=supervisor_space,
+        timings=timings,
+    )
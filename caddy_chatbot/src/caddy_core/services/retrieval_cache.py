@@ -0,0 +1,287 @@
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForRetrieverRun,
+    CallbackManagerForRetrieverRun,
+)
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+
+from caddy_core.utils.monitoring import logger, metrics
+from caddy_core.utils.tables import retrieval_generations_table
+
+RETRIEVAL_CACHE_ENABLED = os.getenv("RETRIEVAL_CACHE_ENABLED", "True").lower() == "true"
+RETRIEVAL_CACHE_THRESHOLD = float(os.getenv("RETRIEVAL_CACHE_THRESHOLD", 0.95))
+RETRIEVAL_CACHE_TTL = float(os.getenv("RETRIEVAL_CACHE_TTL", 3600))
+RETRIEVAL_CACHE_MAX_ENTRIES = int(os.getenv("RETRIEVAL_CACHE_MAX_ENTRIES", 512))
+RETRIEVAL_CACHE_SYNC_INTERVAL = float(os.getenv("RETRIEVAL_CACHE_SYNC_INTERVAL", 30))
+
+QUANTISATION_SCALE = 127
+
+
+def quantise(vector: List[float]) -> np.ndarray:
+    """
+    Unit-normalises a vector and quantises it to int8
+    """
+    array = np.asarray(vector, dtype=np.float32)
+    array = array / (np.linalg.norm(array) or 1.0)
+    return np.round(array * QUANTISATION_SCALE).astype(np.int8)
+
+
+class _Partition:
+    def __init__(self):
+        self.vectors: Optional[np.ndarray] = None
+        self.documents: List[List[Document]] = []
+        self.expires_at: List[float] = []
+        self.last_used: List[float] = []
+
+    def remove(self, keep: np.ndarray):
+        self.vectors = self.vectors[keep] if keep.any() else None
+        self.documents = [d for d, k in zip(self.documents, keep) if k]
+        self.expires_at = [e for e, k in zip(self.expires_at, keep) if k]
+        self.last_used = [u for u, k in zip(self.last_used, keep) if k]
+
+
+class SemanticRetrievalCache:
+    """
+    Caches retrieval results by query meaning. Each source set has its own
+    partition of int8 quantised query embeddings, and a query whose cosine
+    similarity to a cached one reaches the threshold reuses that query's documents.
+    Entries expire after the TTL, the least recently used go first once a partition
+    is full, and refreshing an index drops every partition that searches it.
+
+    Refreshes usually happen in the ingestion process, so with a shared table
+    (RETRIEVAL_GENERATIONS_TABLE_NAME) invalidating an index also bumps its
+    generation there, and serving caches poll the table every sync_interval and
+    drop the partitions of any index whose generation moved.
+
+    Args:
+        threshold (float): minimum cosine similarity for a hit
+        ttl (float): seconds an entry is served for
+        max_entries (int): entries kept per partition
+        table: optional DynamoDB table of index generations, keyed on indexName
+        sync_interval (float): seconds between polls of the table
+    """
+
+    def __init__(
+        self,
+        threshold: float,
+        ttl: float,
+        max_entries: int,
+        table=None,
+        sync_interval: float = RETRIEVAL_CACHE_SYNC_INTERVAL,
+    ):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.table = table
+        self.sync_interval = sync_interval
+        self.hits = 0
+        self.misses = 0
+        self._partitions: Dict[Tuple[str, ...], _Partition] = {}
+        self._generations: Dict[str, int] = {}
+        self._shared_generations: Dict[str, int] = {}
+        self._sync_thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        metrics.register_collector("retrieval_cache", self.stats)
+
+    def generation(self, indices: Tuple[str, ...]) -> Tuple[int, ...]:
+        with self._lock:
+            return tuple(self._generations.get(index, 0) for index in indices)
+
+    def get(
+        self, indices: Tuple[str, ...], vector: List[float]
+    ) -> Optional[List[Document]]:
+        self._start_sync()
+        query = quantise(vector).astype(np.int32)
+        now = time.monotonic()
+        with self._lock:
+            partition = self._partitions.get(indices)
+            if partition is None or partition.vectors is None:
+                self.misses += 1
+                return None
+
+            similarities = (
+                partition.vectors.astype(np.int32) @ query
+            ) / QUANTISATION_SCALE**2
+            similarities[np.asarray(partition.expires_at) <= now] = -1.0
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                self.misses += 1
+                return None
+
+            partition.last_used[best] = now
+            self.hits += 1
+            metrics.observe("retrieval_cache_hit_similarity", float(similarities[best]))
+            return [document.copy() for document in partition.documents[best]]
+
+    def set(
+        self,
+        indices: Tuple[str, ...],
+        vector: List[float],
+        documents: List[Document],
+        generation: Tuple[int, ...],
+    ):
+        """
+        Stores a result set unless one of its indices was refreshed since
+        generation was read, which would make the results stale
+        """
+        now = time.monotonic()
+        with self._lock:
+            if generation != tuple(self._generations.get(i, 0) for i in indices):
+                return
+
+            partition = self._partitions.setdefault(indices, _Partition())
+            if partition.vectors is not None:
+                partition.remove(np.asarray(partition.expires_at) > now)
+            if (
+                partition.vectors is not None
+                and len(partition.documents) >= self.max_entries
+            ):
+                keep = np.ones(len(partition.documents), dtype=bool)
+                keep[int(np.argmin(partition.last_used))] = False
+                partition.remove(keep)
+
+            row = quantise(vector)[None, :]
+            partition.vectors = (
+                row
+                if partition.vectors is None
+                else np.vstack([partition.vectors, row])
+            )
+            partition.documents.append(list(documents))
+            partition.expires_at.append(now + self.ttl)
+            partition.last_used.append(now)
+
+    def _drop_index(self, index: str):
+        with self._lock:
+            self._generations[index] = self._generations.get(index, 0) + 1
+            for indices in [key for key in self._partitions if index in key]:
+                del self._partitions[indices]
+        logger.info(f"Retrieval cache invalidated for {index}")
+
+    def invalidate_index(self, index: str):
+        """
+        Drops cached results for every source set that includes index, in this
+        process and, through the shared table, in every serving process
+        """
+        self._drop_index(index)
+        if self.table is None:
+            return
+        try:
+            self.table.update_item(
+                Key={"indexName": index},
+                UpdateExpression="ADD generation :one",
+                ExpressionAttributeValues={":one": 1},
+            )
+        except Exception as error:
+            logger.warning(f"Shared retrieval cache invalidation failed: {error}")
+
+    def _scan_generations(self) -> Dict[str, int]:
+        generations = {}
+        kwargs = {}
+        while True:
+            response = self.table.scan(**kwargs)
+            for item in response.get("Items", []):
+                generations[item["indexName"]] = int(item["generation"])
+            if "LastEvaluatedKey" not in response:
+                return generations
+            kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+    def sync(self):
+        """
+        Drops cached results for indices refreshed by another process since the
+        last sync
+        """
+        generations = self._scan_generations()
+        for index, generation in generations.items():
+            if generation > self._shared_generations.get(index, 0):
+                self._drop_index(index)
+        self._shared_generations = generations
+
+    def _sync_loop(self):
+        while True:
+            try:
+                self.sync()
+            except Exception as error:
+                logger.warning(f"Retrieval cache sync failed: {error}")
+            time.sleep(self.sync_interval)
+
+    def _start_sync(self):
+        if self.table is None or self._sync_thread is not None:
+            return
+        with self._lock:
+            if self._sync_thread is not None:
+                return
+            self._sync_thread = threading.Thread(
+                target=self._sync_loop, name="retrieval-cache-sync", daemon=True
+            )
+            self._sync_thread.start()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "partitions": len(self._partitions),
+                "entries": sum(len(p.documents) for p in self._partitions.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+retrieval_cache = SemanticRetrievalCache(
+    threshold=RETRIEVAL_CACHE_THRESHOLD,
+    ttl=RETRIEVAL_CACHE_TTL,
+    max_entries=RETRIEVAL_CACHE_MAX_ENTRIES,
+    table=retrieval_generations_table,
+)
+
+
+class SemanticCacheRetriever(BaseRetriever):
+    """Serves results for semantically repeated queries from the retrieval cache.
+
+    Misses fall through to the wrapped retriever and are stored for the source set."""
+
+    base_retriever: BaseRetriever
+    """Retriever run on a cache miss."""
+
+    embeddings: Embeddings
+    """Embeddings for the cache key, normally the retriever's cached embeddings."""
+
+    indices: Tuple[str, ...]
+    """Indices the wrapped retriever searches, the cache partition."""
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        vector = self.embeddings.embed_query(query)
+        cached = retrieval_cache.get(self.indices, vector)
+        if cached is not None:
+            return cached
+
+        generation = retrieval_cache.generation(self.indices)
+        documents = self.base_retriever.invoke(
+            query, config={"callbacks": run_manager.get_child()}
+        )
+        retrieval_cache.set(self.indices, vector, documents, generation)
+        return documents
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        vector = await self.embeddings.aembed_query(query)
+        cached = retrieval_cache.get(self.indices, vector)
+        if cached is not None:
+            return cached
+
+        generation = retrieval_cache.generation(self.indices)
+        documents = await self.base_retriever.ainvoke(
+            query, config={"callbacks": run_manager.get_child()}
+        )
+        retrieval_cache.set(self.indices, vector, documents, generation)
+        return documents
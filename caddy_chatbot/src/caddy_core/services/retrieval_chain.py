@@ -1,36 +1,107 @@
-from langchain_aws import ChatBedrock
-from langchain_community.embeddings import BedrockEmbeddings
-from langchain_community.vectorstores import OpenSearchVectorSearch
-from langchain_community.document_transformers import EmbeddingsClusteringFilter
-
 from langchain.prompts import PromptTemplate
 
 from langchain.chains import create_retrieval_chain
 from langchain.chains.combine_documents import create_stuff_documents_chain
 
 from langchain.retrievers import ContextualCompressionRetriever
-from langchain.retrievers.merger_retriever import MergerRetriever
 from langchain.retrievers.document_compressors import DocumentCompressorPipeline
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.runnables import RunnablePassthrough
 
 import boto3
 from botocore.exceptions import NoCredentialsError
-from opensearchpy import RequestsHttpConnection
 from requests_aws4auth import AWS4Auth
 
-from caddy_core.utils.monitoring import logger
+from caddy_core.models import RetrievalParameters
+from caddy_core.utils.cache import TTLCache
+from caddy_core.utils.monitoring import logger, metrics
+from caddy_core.utils.resilience import opensearch_breaker
 from caddy_core.services.enrolment import check_user_sources
+from caddy_core.services.embedding_cache import CachedEmbeddings
+from caddy_core.services.retrievers import (
+    AdaptiveSourceAllocator,
+    ContextPacker,
+    CrossEncoderRerankRetriever,
+    VectorClusteringFilter,
+    get_cross_encoder,
+)
+from caddy_core.services.local_vector_store import (
+    LOCAL_VECTOR_STORE_PATH,
+    get_local_search_backend,
+)
+from caddy_core.services.retrieval_cache import (
+    RETRIEVAL_CACHE_ENABLED,
+    SemanticCacheRetriever,
+)
+from caddy_core.services.score_calibration import (
+    RELEVANCE_CUTOFF,
+    score_calibration,
+)
+from caddy_core.services.search import MultiIndexRetriever, get_search_backend
+from caddy_core.services.llm import EMBEDDING_MODEL, get_chat_model, get_embeddings
 
+import asyncio
+import math
 import os
+import random
+import threading
+from collections import deque
 from datetime import datetime
-from typing import List, Tuple, Any
+from itertools import zip_longest
+from typing import Awaitable, List, Optional, Tuple, Any
+
+import numpy as np
 
 alternate_region = "eu-west-3"
 
 opensearch_https = os.environ.get("OPENSEARCH_HTTPS")
-embeddings = BedrockEmbeddings(
-    model_id="cohere.embed-english-v3", region_name=alternate_region
+
+VECTOR_STORE_BACKEND = os.getenv("VECTOR_STORE_BACKEND", "opensearch").lower()
+
+# "hybrid" fuses BM25 with kNN candidates, which keeps recall with fewer documents
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "vector").lower()
+HYBRID_TOTAL_SOURCE_DOCS = int(os.getenv("HYBRID_TOTAL_SOURCE_DOCS", 4))
+
+# Splits the document budget across sources by hit strength instead of evenly
+ADAPTIVE_ALLOCATION = os.getenv("ADAPTIVE_ALLOCATION", "True").lower() == "true"
+MIN_DOCS_PER_SOURCE = int(os.getenv("MIN_DOCS_PER_SOURCE", 1))
+MAX_DOCS_PER_SOURCE = int(os.getenv("MAX_DOCS_PER_SOURCE", 0)) or None
+ALLOCATION_THRESHOLD = float(os.getenv("ALLOCATION_THRESHOLD", 0.3))
+
+RERANKER_ENABLED = os.getenv("RERANKER_ENABLED", "False").lower() == "true"
+RERANKER_MODEL = os.getenv("RERANKER_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+RERANKER_BATCH_SIZE = int(os.getenv("RERANKER_BATCH_SIZE", 16))
+RERANKER_MAX_LATENCY = float(os.getenv("RERANKER_MAX_LATENCY", 1.0))
+
+context_packer = ContextPacker(
+    token_budget=int(os.getenv("CONTEXT_TOKEN_BUDGET", 6000)),
+    passage_tokens=int(os.getenv("CONTEXT_PASSAGE_TOKENS", 150)),
+)
+
+SPECULATIVE_RETRIEVAL = os.getenv("SPECULATIVE_RETRIEVAL", "True").lower() == "true"
+SPECULATIVE_RETRIEVAL_THRESHOLD = float(
+    os.getenv("SPECULATIVE_RETRIEVAL_THRESHOLD", 0.8)
+)
+SPECULATIVE_RETRIEVAL_MIN_OVERLAP = float(
+    os.getenv("SPECULATIVE_RETRIEVAL_MIN_OVERLAP", 0.8)
+)
+SPECULATIVE_RETRIEVAL_SAMPLE_RATE = float(
+    os.getenv("SPECULATIVE_RETRIEVAL_SAMPLE_RATE", 0.05)
 )
 
+# Retrievers hold OpenSearch clients and their connection pools, so are built once
+# per source list and reused until idle, only the prompt changes per request
+retriever_cache = TTLCache(
+    "retriever",
+    max_size=int(os.getenv("CHAIN_CACHE_MAX_ENTRIES", 32)),
+    ttl=float(os.getenv("CHAIN_CACHE_IDLE_SECONDS", 1800)),
+    sliding=True,
+)
+
+embeddings = CachedEmbeddings(get_embeddings(), EMBEDDING_MODEL)
+
 try:
     session = boto3.Session()
     credentials = session.get_credentials()
@@ -43,102 +114,391 @@ except NoCredentialsError:
     print("No credentials could be found")
 
 
-class CaddyOpenSearchVectorSearch(OpenSearchVectorSearch):
-    def similarity_search_with_relevance_scores(
-        self,
-        query: str,
-        k: int = 5,
-        **kwargs: Any,
-    ) -> List[Tuple[Any, float]]:
-        """
-        Return docs and relevance scores
-        """
-        results = self.similarity_search_with_score(query, k=k, **kwargs)
+def get_vector_store_backend():
+    """
+    Returns the search backend selected by VECTOR_STORE_BACKEND, "opensearch" for
+    the AOSS collection or "local" for indices under LOCAL_VECTOR_STORE_PATH
+    """
+    if VECTOR_STORE_BACKEND == "local":
+        return get_local_search_backend(LOCAL_VECTOR_STORE_PATH, embeddings)
+    return get_search_backend(opensearch_https, auth)
+
 
-        if not results:
-            return []
+def preload_reranker():
+    """
+    Loads the cross-encoder at startup when the reranker is enabled, so the first
+    request does not wait on downloading it from the Hugging Face Hub
+    """
+    if not RERANKER_ENABLED:
+        return
+    try:
+        get_cross_encoder(RERANKER_MODEL)
+    except Exception as error:
+        logger.error(f"Cross-encoder {RERANKER_MODEL} failed to load: {error}")
 
-        min_score = min(score for _, score in results)
-        max_score = max(score for _, score in results)
 
-        if max_score == min_score:
-            return [(doc, 1.0) for doc, _ in results]
+def default_retrieval_parameters() -> RetrievalParameters:
+    """
+    Retrieval parameters for the app, from the environment
+    """
+    hybrid = RETRIEVAL_MODE == "hybrid"
+    return RetrievalParameters(
+        total_source_docs=HYBRID_TOTAL_SOURCE_DOCS if hybrid else 6,
+        hybrid=hybrid,
+        reranker=RERANKER_ENABLED,
+        relevance_cutoff=RELEVANCE_CUTOFF,
+        adaptive_allocation=ADAPTIVE_ALLOCATION,
+        min_docs_per_source=MIN_DOCS_PER_SOURCE,
+        max_docs_per_source=MAX_DOCS_PER_SOURCE,
+        allocation_threshold=ALLOCATION_THRESHOLD,
+    )
 
-        return [
-            (doc, (score - min_score) / (max_score - min_score))
-            for doc, score in results
-        ]
 
+def build_retriever(
+    source_list: List[str],
+    parameters: Optional[RetrievalParameters] = None,
+    backend: Any = None,
+    retriever_embeddings: Optional[Embeddings] = None,
+    cache: bool = RETRIEVAL_CACHE_ENABLED,
+) -> BaseRetriever:
+    """
+    Builds the multi-index retriever, clustering filter and context packer for a
+    source list, behind the semantic retrieval cache when cache is set
 
-def build_chain(CADDY_PROMPT, user: str = None):
-    caddy_retrievers = []
+    Args:
+        source_list (List[str]): source names, one index each
+        parameters (RetrievalParameters): defaults to default_retrieval_parameters
+        backend: search backend, defaults to get_vector_store_backend
+        retriever_embeddings (Embeddings): defaults to the cached Bedrock embeddings
+        cache (bool): wrap the retriever in the semantic retrieval cache
 
-    source_list = check_user_sources(user)
+    Returns:
+        BaseRetriever: retriever for the source list
+    """
+    parameters = parameters or default_retrieval_parameters()
+    backend = backend or get_vector_store_backend()
+    retriever_embeddings = retriever_embeddings or embeddings
 
     sources = len(source_list)
-    total_source_docs = 6
-    input_docs_per_source = total_source_docs * 2
-    fetched_docs_per_source = total_source_docs * 3
-    filtered_docs_per_source = round(total_source_docs / sources)
+    total_source_docs = parameters.total_source_docs
+    input_docs_per_source = total_source_docs * parameters.input_docs_multiplier
+    fetched_docs_per_source = total_source_docs * parameters.fetched_docs_multiplier
+    filtered_docs_per_source = max(
+        1, round(total_source_docs / (sources * parameters.clusters_per_source))
+    )
+    logger.debug(f"Retrieval mode: {'hybrid' if parameters.hybrid else 'vector'}")
     logger.debug(f"Sources: {sources}")
     logger.debug(f"Total source docs: {total_source_docs}")
     logger.debug(f"Total input docs: {input_docs_per_source * sources}")
     logger.debug(f"Total fetched docs: {fetched_docs_per_source * sources}")
-    logger.debug(f"Total filtered docs: {filtered_docs_per_source * sources}")
-
-    for source in source_list:
-        vectorstore = CaddyOpenSearchVectorSearch(
-            index_name=f"{source}_scrape_db",
-            opensearch_url=opensearch_https,
-            embedding_function=embeddings,
-            http_auth=auth,
-            timeout=3000,
-            use_ssl=True,
-            verify_certs=True,
-            connection_class=RequestsHttpConnection,
-            attributes=["source", "raw_markdown"],
-        )
-        retriever = vectorstore.as_retriever(
-            search_type="mmr",
-            search_kwargs={
-                "k": input_docs_per_source,
-                "fetch_k": fetched_docs_per_source,
-                "lambda_mult": 0.2,
-            },
-        )
-        caddy_retrievers.append(retriever)
+    logger.debug(
+        f"Total filtered docs: {filtered_docs_per_source * sources * parameters.clusters_per_source}"
+    )
 
-    lotr = MergerRetriever(retrievers=caddy_retrievers)
+    indices = [f"{source}_scrape_db" for source in source_list]
+    lotr = MultiIndexRetriever(
+        backend=backend,
+        embeddings=retriever_embeddings,
+        indices=indices,
+        k=input_docs_per_source,
+        fetch_k=fetched_docs_per_source,
+        lambda_mult=parameters.lambda_mult,
+        hybrid=parameters.hybrid,
+        calibration=score_calibration,
+        relevance_cutoff=parameters.relevance_cutoff,
+    )
+    if parameters.reranker:
+        # Keeps the most relevant candidates across all sources, in relevance order,
+        # which the clustering filter and context packer preserve. The allocator
+        # splits the budget on the cross-encoder scores
+        lotr = CrossEncoderRerankRetriever(
+            base_retriever=lotr,
+            model_name=RERANKER_MODEL,
+            top_n=input_docs_per_source,
+            batch_size=RERANKER_BATCH_SIZE,
+            max_latency=RERANKER_MAX_LATENCY,
+        )
 
-    filter_ordered_by_retriever = EmbeddingsClusteringFilter(
-        embeddings=embeddings,
-        num_clusters=sources,
+    transformers = []
+    if parameters.adaptive_allocation:
+        # Clusters keep enough candidates for any source to reach its maximum,
+        # the allocator then trims them to the overall budget
+        max_docs_per_source = parameters.max_docs_per_source or total_source_docs
+        filtered_docs_per_source = math.ceil(
+            max_docs_per_source / parameters.clusters_per_source
+        )
+    filter_ordered_by_retriever = VectorClusteringFilter(
+        embeddings=retriever_embeddings,
+        num_clusters=sources * parameters.clusters_per_source,
         num_closest=filtered_docs_per_source,
         sorted=True,
     )
+    transformers.append(filter_ordered_by_retriever)
+    if parameters.adaptive_allocation:
+        transformers.append(
+            AdaptiveSourceAllocator(
+                total=total_source_docs,
+                min_per_source=parameters.min_docs_per_source,
+                max_per_source=parameters.max_docs_per_source,
+                relevance_threshold=parameters.allocation_threshold,
+            )
+        )
+
+    packer = context_packer
+    if parameters.context_token_budget is not None:
+        packer = ContextPacker(
+            token_budget=parameters.context_token_budget,
+            passage_tokens=context_packer.passage_tokens,
+        )
 
-    pipeline = DocumentCompressorPipeline(transformers=[filter_ordered_by_retriever])
-    compression_retriever = ContextualCompressionRetriever(
+    pipeline = DocumentCompressorPipeline(transformers=transformers + [packer])
+    retriever = ContextualCompressionRetriever(
         base_compressor=pipeline, base_retriever=lotr
     )
+    if not cache:
+        return retriever
+    return SemanticCacheRetriever(
+        base_retriever=retriever,
+        embeddings=retriever_embeddings,
+        indices=tuple(indices),
+    )
+
 
-    llm = ChatBedrock(
-        model_id=os.getenv("LLM"),
-        region_name=alternate_region,
-        model_kwargs={"temperature": 0.3, "top_k": 5, "max_tokens": 2000},
+def get_retriever(source_list: List[str]) -> BaseRetriever:
+    """
+    Returns the retriever for a source list from the process cache, building it on
+    first use. Entries idle for CHAIN_CACHE_IDLE_SECONDS are dropped
+    """
+    retriever_cache.evict_expired()
+    return retriever_cache.get_or_create(
+        tuple(source_list), lambda: build_retriever(source_list)
     )
 
+
+def build_document_chain(CADDY_PROMPT):
     document_formatter = PromptTemplate(
         input_variables=["raw_markdown", "source"],
         template="Content:{raw_markdown}\nSOURCE_URL:{source}",
     )
 
-    document_chain = create_stuff_documents_chain(
-        llm, prompt=CADDY_PROMPT, document_prompt=document_formatter
+    return create_stuff_documents_chain(
+        get_chat_model("generation"),
+        prompt=CADDY_PROMPT,
+        document_prompt=document_formatter,
     )
+
+
+def build_answer_chain(CADDY_PROMPT):
+    """
+    Answer-only chain for context retrieved up front, streams the same chunks as
+    the retrieval chain given input, chat_history and context
+    """
+    return RunnablePassthrough.assign(answer=build_document_chain(CADDY_PROMPT))
+
+
+def build_chain(CADDY_PROMPT, user: str = None, source_list: List[str] = None):
+    if source_list is None:
+        source_list = check_user_sources(user)
+
     chain = create_retrieval_chain(
-        retriever=compression_retriever, combine_docs_chain=document_chain
+        retriever=get_retriever(source_list),
+        combine_docs_chain=build_document_chain(CADDY_PROMPT),
     )
 
     ai_prompt_timestamp = datetime.now()
     return chain, ai_prompt_timestamp
+
+
+def merge_documents(
+    primary: List[Document], secondary: List[Document], limit: int
+) -> List[Document]:
+    """
+    Interleaves two result sets, primary first, dropping repeated documents
+    """
+    merged = []
+    seen = set()
+    for pair in zip_longest(primary, secondary):
+        for document in pair:
+            if document is None:
+                continue
+            key = document_key(document)
+            if key in seen:
+                continue
+            seen.add(key)
+            merged.append(document)
+    return merged[:limit]
+
+
+def document_key(document: Document) -> Tuple[Optional[str], str]:
+    return document.metadata.get("source"), document.page_content
+
+
+def result_overlap(reworded: List[Document], speculative: List[Document]) -> float:
+    """
+    Share of the reworded query's results that speculative retrieval also found
+    """
+    if not reworded:
+        return 1.0
+    speculative_keys = {document_key(document) for document in speculative}
+    return sum(document_key(d) in speculative_keys for d in reworded) / len(reworded)
+
+
+class SpeculationThreshold:
+    """
+    Similarity between the raw and reworded query above which speculative results
+    are kept, learned from how much the two result sets actually overlap.
+
+    Every merge, and a sample of kept requests whose reworded retrieval is left
+    to finish in the background, records (similarity, overlap). Once there are
+    enough samples the threshold is the lowest similarity at which the samples at
+    or above it overlap by at least min_overlap on average. Until then the
+    configured initial threshold applies.
+
+    Args:
+        initial (float): threshold used until enough samples are recorded
+        min_overlap (float): mean overlap the kept results must reach
+        window (int): most recent samples kept
+        min_samples (int): samples needed before the threshold is learned
+    """
+
+    def __init__(
+        self,
+        initial: float,
+        min_overlap: float,
+        window: int = 500,
+        min_samples: int = 50,
+    ):
+        self.initial = initial
+        self.min_overlap = min_overlap
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=window)
+        self._threshold = initial
+        self._lock = threading.Lock()
+        metrics.register_collector("speculative_retrieval", self.stats)
+
+    @property
+    def threshold(self) -> float:
+        return self._threshold
+
+    def observe(self, similarity: float, overlap: float):
+        metrics.observe("speculative_retrieval_overlap", overlap)
+        with self._lock:
+            self._samples.append((similarity, overlap))
+            if len(self._samples) < self.min_samples:
+                return
+            samples = sorted(self._samples, reverse=True)
+
+        similarities = np.array([sample[0] for sample in samples])
+        mean_overlap = np.cumsum([sample[1] for sample in samples]) / np.arange(
+            1, len(samples) + 1
+        )
+        passing = np.flatnonzero(mean_overlap >= self.min_overlap)
+        # With no similarity that keeps enough overlap, always merge
+        self._threshold = float(similarities[passing[-1]]) if len(passing) else math.inf
+
+    def stats(self) -> dict:
+        with self._lock:
+            samples = len(self._samples)
+        return {"threshold": self._threshold, "samples": samples}
+
+
+speculation_threshold = SpeculationThreshold(
+    initial=SPECULATIVE_RETRIEVAL_THRESHOLD,
+    min_overlap=SPECULATIVE_RETRIEVAL_MIN_OVERLAP,
+)
+
+
+def cosine_similarity(a: List[float], b: List[float]) -> float:
+    a, b = np.asarray(a), np.asarray(b)
+    return float(np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b)))
+
+
+async def retrieve(retriever: BaseRetriever, query: str) -> List[Document]:
+    """
+    Runs a retrieval through the OpenSearch circuit breaker
+    """
+    async with opensearch_breaker:
+        return await retriever.ainvoke(query)
+
+
+async def retrieve_for_query(
+    retriever: BaseRetriever, query: str, rewording: Awaitable[str]
+) -> Tuple[str, List[Document]]:
+    """
+    Retrieves context for an adviser query alongside rewording it.
+
+    With SPECULATIVE_RETRIEVAL on, retrieval against the raw query starts while
+    the rewording LLM calls run, and retrieval against the reworded query starts
+    as soon as the rewording arrives. If the reworded query lands close to the
+    raw one in embedding space the speculative results are kept and the second
+    retrieval is dropped, otherwise the two result sets are merged. The similarity
+    threshold is learned from observed result overlap (SpeculationThreshold).
+    With it off, retrieval waits for the reworded query as before.
+
+    Args:
+        retriever (BaseRetriever): retriever for the user's sources
+        query (str): raw adviser query
+        rewording (Awaitable[str]): pending rewording of the query
+
+    Returns:
+        Tuple[str, List[Document]]: reworded query and retrieved context
+    """
+    if not SPECULATIVE_RETRIEVAL:
+        reworded_query = await rewording
+        return reworded_query, await retrieve(retriever, reworded_query)
+
+    speculative_retrieval = asyncio.create_task(retrieve(retriever, query))
+    reworded_retrieval = None
+    try:
+        reworded_query = await rewording
+        # Embedding the reworded query is the retriever's first step, doing it here
+        # lets the similarity check and the retriever share the cached vector
+        reworded_vector = asyncio.create_task(embeddings.aembed_query(reworded_query))
+
+        async def retrieve_reworded() -> List[Document]:
+            await reworded_vector
+            return await retrieve(retriever, reworded_query)
+
+        reworded_retrieval = asyncio.create_task(retrieve_reworded())
+        query_vector = await embeddings.aembed_query(query)
+        similarity = cosine_similarity(query_vector, await reworded_vector)
+        metrics.observe("speculative_retrieval_similarity", similarity)
+        logger.debug(f"Raw and reworded query similarity: {similarity:.3f}")
+
+        if similarity >= speculation_threshold.threshold:
+            speculative_documents = await speculative_retrieval
+            metrics.increment("speculative_retrieval_kept")
+            if random.random() < SPECULATIVE_RETRIEVAL_SAMPLE_RATE:
+
+                def observe_overlap(task: asyncio.Task):
+                    if not task.cancelled() and task.exception() is None:
+                        speculation_threshold.observe(
+                            similarity,
+                            result_overlap(task.result(), speculative_documents),
+                        )
+
+                reworded_retrieval.add_done_callback(observe_overlap)
+            else:
+                reworded_retrieval.cancel()
+            return reworded_query, speculative_documents
+
+        reworded_documents, speculative_documents = await asyncio.gather(
+            reworded_retrieval, speculative_retrieval
+        )
+    except BaseException:
+        speculative_retrieval.cancel()
+        if reworded_retrieval is not None:
+            reworded_retrieval.cancel()
+        raise
+
+    metrics.increment("speculative_retrieval_merged")
+    speculation_threshold.observe(
+        similarity, result_overlap(reworded_documents, speculative_documents)
+    )
+    merged = merge_documents(
+        reworded_documents,
+        speculative_documents,
+        limit=max(len(reworded_documents), len(speculative_documents)),
+    )
+    # Both result sets were packed on their own, together they can overrun the budget
+    return reworded_query, context_packer.compress_documents(merged, reworded_query)
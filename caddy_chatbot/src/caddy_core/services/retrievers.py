@@ -1,55 +1,560 @@
 from langchain_core.retrievers import BaseRetriever
-from langchain_core.callbacks import CallbackManagerForRetrieverRun
-from langchain_core.documents import Document
-from typing import List
-from langchain.retrievers.merger_retriever import MergerRetriever
-from langchain_core.language_models.chat_models import BaseChatModel
-import ast
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForRetrieverRun,
+    CallbackManagerForRetrieverRun,
+    Callbacks,
+)
+from langchain_core.documents import (
+    BaseDocumentCompressor,
+    BaseDocumentTransformer,
+    Document,
+)
+from langchain_core.embeddings import Embeddings
+from langchain_core.pydantic_v1 import BaseModel
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import math
+import re
+import threading
+import time
+from collections import Counter
+from urllib.parse import urlparse
 
+import numpy as np
 
-class LLMPriorityRetriever(BaseRetriever):
-    """Retriever that merges the results of multiple retrievers."""
+from caddy_core.utils.concurrency import run_blocking
+from caddy_core.utils.monitoring import logger, metrics
+
+# Metadata key OpenSearch hits carry their stored vector under until it is stripped
+VECTOR_METADATA_KEY = "_vector"
+# Metadata keys of a hit's kNN score and its calibrated relevance, fused hybrid
+# scores only reflect rank so these are what relevance decisions use
+KNN_SCORE_KEY = "knn_score"
+RELEVANCE_KEY = "relevance"
+# Metadata key of a document's cross-encoder score, in [0, 1]
+RERANK_SCORE_KEY = "rerank_score"
+
+# Characters per token, close enough for Claude on English prose
+CHARS_PER_TOKEN = 4
+# Overhead of the "Content:...\nSOURCE_URL:..." document formatter
+DOCUMENT_TEMPLATE_CHARS = len("Content:\nSOURCE_URL:") + 2
+
+TERM_PATTERN = re.compile(r"[a-z0-9]+")
+PASSAGE_SEPARATOR = "\n\n"
+# Boundaries an oversized paragraph is split on, coarsest first, with the separator
+# pieces are rejoined with
+PARAGRAPH_SPLITS = [
+    (re.compile(r"\n"), "\n"),
+    (re.compile(r"(?<=[.!?])\s+"), " "),
+    (re.compile(r"\s+"), " "),
+]
+
+
+def estimate_tokens(text: str) -> int:
+    """Approximate token count of text."""
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def document_overhead_tokens(document: Document) -> int:
+    """Approximate tokens the document formatter adds around a document's content."""
+    return estimate_tokens(str(document.metadata.get("source", ""))) + math.ceil(
+        DOCUMENT_TEMPLATE_CHARS / CHARS_PER_TOKEN
+    )
+
+
+def context_tokens(
+    documents: Sequence[Document], content_key: str = "raw_markdown"
+) -> int:
+    """Approximate prompt tokens of documents once formatted into the context."""
+    return sum(
+        estimate_tokens(document.metadata.get(content_key) or document.page_content)
+        + document_overhead_tokens(document)
+        for document in documents
+    )
+
+
+_cross_encoders: Dict[str, Any] = {}
+_cross_encoder_lock = threading.Lock()
+
+
+def get_cross_encoder(model_name: str) -> Any:
+    """Returns the process-wide CPU cross-encoder for a model, loaded on first use."""
+    with _cross_encoder_lock:
+        model = _cross_encoders.get(model_name)
+        if model is None:
+            from sentence_transformers import CrossEncoder
+
+            started = time.perf_counter()
+            model = CrossEncoder(model_name, device="cpu")
+            logger.info(
+                f"Loaded cross-encoder {model_name} in "
+                f"{time.perf_counter() - started:.2f}s"
+            )
+            _cross_encoders[model_name] = model
+        return model
+
+
+class CrossEncoderRerankRetriever(BaseRetriever):
+    """Reranks another retriever's documents with a local CPU cross-encoder.
+
+    Query and document pairs are scored in batches, and once max_latency is spent
+    the remaining documents keep their retrieved order after the scored ones.
+    Each scored document records its score under RERANK_SCORE_KEY, and only the
+    top_n are passed on."""
+
+    base_retriever: BaseRetriever
+    """Retriever whose documents are reranked."""
+
+    model_name: str = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+    """Sentence-transformers cross-encoder model."""
+
+    top_n: Optional[int] = None
+    """Documents returned, None for all of them."""
+
+    batch_size: int = 16
+    """Pairs scored per forward pass."""
+
+    max_latency: float = 1.0
+    """Seconds of scoring before the rest are left unscored."""
 
-    retriever_list: List[BaseRetriever]
-    llm: BaseChatModel
-    alternative_retriever: BaseRetriever
     max_document_length: int = 500
-    max_retrieved_documents: int = 6
+    """Characters of each document passed to the model."""
+
+    def _scores(self, query: str, documents: List[Document]) -> List[float]:
+        model = get_cross_encoder(self.model_name)
+        started = time.perf_counter()
+        scores: List[float] = []
+        for offset in range(0, len(documents), self.batch_size):
+            if scores and time.perf_counter() - started > self.max_latency:
+                logger.warning(
+                    f"Reranking stopped after {len(scores)}/{len(documents)} "
+                    "documents at the latency cap"
+                )
+                metrics.increment("rerank_latency_cap_hit")
+                break
+            batch = documents[offset : offset + self.batch_size]
+            scores.extend(
+                float(score)
+                for score in model.predict(
+                    [
+                        (query, document.page_content[: self.max_document_length])
+                        for document in batch
+                    ],
+                    batch_size=self.batch_size,
+                    show_progress_bar=False,
+                )
+            )
+        metrics.observe("rerank_seconds", time.perf_counter() - started)
+        return scores
+
+    def _safe_scores(self, query: str, documents: List[Document]) -> List[float]:
+        try:
+            return self._scores(query, documents)
+        except Exception as error:
+            logger.error(f"Reranking failed, keeping retrieved order: {error}")
+            return []
+
+    def _rerank(self, documents: List[Document], scores: List[float]) -> List[Document]:
+        scored = [
+            Document(
+                page_content=document.page_content,
+                metadata={**document.metadata, RERANK_SCORE_KEY: score},
+            )
+            for document, score in zip(documents, scores)
+        ]
+        # Ties and unscored documents keep their retrieved order
+        order = sorted(range(len(scores)), key=lambda i: (-scores[i], i))
+        reranked = [scored[i] for i in order] + documents[len(scores) :]
+        return reranked if self.top_n is None else reranked[: self.top_n]
 
     def _get_relevant_documents(
         self, query: str, *, run_manager: CallbackManagerForRetrieverRun
     ) -> List[Document]:
-        lotr = MergerRetriever(retrievers=self.retriever_list)
-        all_relevant_docs = lotr.get_relevant_documents(query)
+        documents = self.base_retriever.invoke(
+            query, config={"callbacks": run_manager.get_child()}
+        )
+        if not documents:
+            return []
+        return self._rerank(documents, self._safe_scores(query, documents))
 
-        all_docs = [
-            (
-                (index, document.page_content[: self.max_document_length])
-                if len(document.page_content) > self.max_document_length
-                else (index, document.page_content)
-            )
-            for index, document in enumerate(all_relevant_docs)
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        documents = await self.base_retriever.ainvoke(
+            query, config={"callbacks": run_manager.get_child()}
+        )
+        if not documents:
+            return []
+        scores = await run_blocking(self._safe_scores, query, documents)
+        return self._rerank(documents, scores)
+
+
+class VectorClusteringFilter(BaseDocumentTransformer, BaseModel):
+    """Clusters documents on their stored vectors and keeps those closest to each centre.
+
+    A NumPy replacement for EmbeddingsClusteringFilter that reads the vectors
+    OpenSearch returned with each hit instead of embedding every document again.
+    Clusters start from one centroid per source, so the selection stays balanced
+    across sources, and are refined with a few vectorised k-means steps. Documents
+    without a stored vector are embedded, through the embedding cache."""
+
+    embeddings: Embeddings
+    """Embeddings for documents that arrive without a stored vector."""
+
+    num_clusters: int = 5
+    """Number of clusters, normally the number of sources."""
+
+    num_closest: int = 1
+    """The number of closest documents kept for each cluster centre."""
+
+    max_iterations: int = 10
+    """Maximum k-means refinement steps."""
+
+    sorted: bool = False
+    """Keep the retriever order rather than grouping results by cluster."""
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _vectors(self, documents: Sequence[Document]) -> np.ndarray:
+        vectors: List[Any] = [
+            document.metadata.get(VECTOR_METADATA_KEY) for document in documents
         ]
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            embedded = self.embeddings.embed_documents(
+                [documents[i].page_content for i in missing]
+            )
+            for i, vector in zip(missing, embedded):
+                vectors[i] = vector
+        return np.asarray(vectors, dtype=np.float32)
 
-        document_prioritisation_prompt = f"""Please read the documents below, and rank them in order of relevance to this query: '{query}'. Please rank them in order of relevance, with 1 being the most relevant, and 5 being the least relevant. Please separate your rankings with a comma, in the format of a Python list. For example, if you think document 1 is the most relevant, and document 5 is the least relevant, please enter: [1, 2, 3, 4, 5]. Return only the list with no other output.
+    def _initial_centres(
+        self, documents: Sequence[Document], vectors: np.ndarray, clusters: int
+    ) -> np.ndarray:
+        sources = np.array([document_source(document) for document in documents])
+        groups = list(dict.fromkeys(sources))
+        centres = [vectors[sources == group].mean(axis=0) for group in groups]
 
-            Documents: {all_docs}
+        # Top up with the documents furthest from the existing centres
+        while len(centres) < clusters:
+            distances = np.min(
+                np.linalg.norm(vectors[:, None, :] - np.array(centres)[None], axis=2),
+                axis=1,
+            )
+            centres.append(vectors[int(np.argmax(distances))])
+        return np.array(centres[:clusters])
 
-            Remember to return only your list, with no other output or context."""
+    def _cluster(
+        self, documents: Sequence[Document], vectors: np.ndarray
+    ) -> np.ndarray:
+        clusters = min(self.num_clusters, len(vectors))
+        centres = self._initial_centres(documents, vectors, clusters)
+        for _ in range(self.max_iterations):
+            distances = np.linalg.norm(
+                vectors[None, :, :] - centres[:, None, :], axis=2
+            )
+            labels = np.argmin(distances, axis=0)
+            updated = np.array(
+                [
+                    vectors[labels == i].mean(axis=0) if np.any(labels == i) else centre
+                    for i, centre in enumerate(centres)
+                ]
+            )
+            if np.allclose(updated, centres):
+                break
+            centres = updated
+        return np.linalg.norm(vectors[None, :, :] - centres[:, None, :], axis=2)
 
-        llm_priority = self.llm.predict(document_prioritisation_prompt)
+    def transform_documents(
+        self, documents: Sequence[Document], **kwargs: Any
+    ) -> Sequence[Document]:
+        """Filter down documents."""
+        if not documents:
+            return []
 
-        response_as_list = ast.literal_eval(llm_priority)
+        vectors = self._vectors(documents)
+        distances = self._cluster(documents, vectors)
+
+        selected: List[int] = []
+        chosen = np.zeros(len(documents), dtype=bool)
+        for row in distances:
+            order = np.argsort(row)
+            picks = order[~chosen[order]][: self.num_closest]
+            chosen[picks] = True
+            selected.extend(int(i) for i in picks)
+
+        results = sorted(selected) if self.sorted else selected
+        return [strip_vector(documents[i]) for i in results]
+
+
+def document_source(document: Document) -> str:
+    """The index a document came from, or its site for documents without one."""
+    return (
+        document.metadata.get("index_name")
+        or urlparse(document.metadata.get("source", "")).netloc
+    )
+
+
+def strip_vector(document: Document) -> Document:
+    """Returns the document without the stored vector in its metadata."""
+    if VECTOR_METADATA_KEY not in document.metadata:
+        return document
+    metadata = {
+        key: value
+        for key, value in document.metadata.items()
+        if key != VECTOR_METADATA_KEY
+    }
+    return Document(page_content=document.page_content, metadata=metadata)
+
+
+class AdaptiveSourceAllocator(BaseDocumentTransformer, BaseModel):
+    """Splits the document budget across sources by the strength of their hits.
+
+    Strength is the cross-encoder score of each document when every document was
+    reranked, otherwise the calibrated relevance of each hit when every document
+    has one, both already on an absolute scale. Otherwise the kNN scores are min-max
+    scaled over the hits of every source together, so a source whose best hits
+    trail the others ranks low instead of being scaled up to 1. Fused hybrid
+    scores are not used, they only reflect rank within each source.
+    Each source keeps its min_per_source best documents, then the remaining slots
+    go to the strongest documents overall reaching relevance_threshold, at
+    most max_per_source from one source. When only one source has strong hits the
+    weak ones keep their minimum and fewer documents are stuffed in total."""
+
+    total: int = 6
+    """Most documents kept across all sources."""
+
+    min_per_source: int = 1
+    """Documents every source keeps whatever their scores."""
+
+    max_per_source: Optional[int] = None
+    """Most documents from one source, None for no cap beyond total."""
+
+    relevance_threshold: float = 0.3
+    """Strength a document needs for a slot beyond the minimum."""
+
+    rerank_key: str = RERANK_SCORE_KEY
+    """Metadata key of the cross-encoder score, used when every document has one."""
+
+    relevance_key: str = RELEVANCE_KEY
+    """Metadata key of the calibrated relevance, used when every document has one."""
+
+    score_key: str = KNN_SCORE_KEY
+    """Metadata key of the kNN score, higher is better, scaled when uncalibrated."""
+
+    def _strengths(self, documents: Sequence[Document]) -> Optional[np.ndarray]:
+        for key, scale in (
+            (self.rerank_key, False),
+            (self.relevance_key, False),
+            (self.score_key, True),
+        ):
+            values = [d.metadata.get(key) for d in documents]
+            if any(value is None for value in values):
+                continue
+            scores = np.array([float(value) for value in values])
+            if not scale:
+                return scores
+            spread = scores.max() - scores.min()
+            return (scores - scores.min()) / spread if spread else np.ones_like(scores)
+        return None
+
+    def transform_documents(
+        self, documents: Sequence[Document], **kwargs: Any
+    ) -> Sequence[Document]:
+        """Keep each source's allocation, in the original order."""
+        if not documents:
+            return documents
+        scaled = self._strengths(documents)
+        if scaled is None:
+            # Nothing to allocate on from a retriever that does not record scores
+            return documents
+        order = sorted(range(len(documents)), key=lambda i: (-scaled[i], i))
+
+        maximum = self.max_per_source or self.total
+        counts: Dict[str, int] = {}
+        kept = set()
+        for i in order:
+            source = document_source(documents[i])
+            if counts.get(source, 0) < min(self.min_per_source, maximum):
+                counts[source] = counts.get(source, 0) + 1
+                kept.add(i)
+        for i in order:
+            if len(kept) >= self.total:
+                break
+            source = document_source(documents[i])
+            if (
+                i not in kept
+                and scaled[i] >= self.relevance_threshold
+                and counts.get(source, 0) < maximum
+            ):
+                counts[source] = counts.get(source, 0) + 1
+                kept.add(i)
+
+        logger.debug(f"Documents allocated per source: {counts}")
+        metrics.observe("allocated_documents", len(kept))
+        return [document for i, document in enumerate(documents) if i in kept]
 
-        try:
-            # get the top 5 documents
-            top_docs = [
-                all_relevant_docs[index]
-                for index in response_as_list[: self.max_retrieved_documents]
-            ]
 
-        except Exception:
-            # if it fails, return all the docs
-            top_docs = self.alternative_retriever.get_relevant_documents(query)
+class ContextPacker(BaseDocumentCompressor):
+    """Packs the retrieved documents into a prompt token budget.
+
+    Each document's raw_markdown is split into paragraph passages, paragraphs longer
+    than a passage being split on line or sentence boundaries, which are scored
+    against the query with BM25 over the passages of this request. Every
+    document first gets its best passage, in retrieval order, then the remaining
+    budget is filled greedily with the highest scoring passages that fit. Kept
+    passages stay in page order under the document's source URL, so citations
+    still resolve, and documents with nothing kept are dropped."""
+
+    token_budget: int = 6000
+    """Tokens of formatted context allowed in the prompt, 0 to disable packing."""
+
+    passage_tokens: int = 150
+    """Paragraphs are merged into passages of up to this many tokens."""
+
+    content_key: str = "raw_markdown"
+    """Metadata key holding the text stuffed into the prompt."""
+
+    k1: float = 1.2
+    """BM25 term frequency saturation."""
+
+    b: float = 0.75
+    """BM25 length normalisation."""
+
+    def _content(self, document: Document) -> str:
+        return document.metadata.get(self.content_key) or document.page_content
+
+    def _split(self, text: str, limit: int, level: int = 0) -> List[str]:
+        """Splits text into pieces of at most limit characters, on line, then
+        sentence, then word boundaries, cutting at the limit as a last resort."""
+        if len(text) <= limit:
+            return [text]
+        if level == len(PARAGRAPH_SPLITS):
+            return [text[i : i + limit] for i in range(0, len(text), limit)]
+
+        pattern, separator = PARAGRAPH_SPLITS[level]
+        pieces: List[str] = []
+        current = ""
+        for part in pattern.split(text):
+            part = part.strip()
+            if not part:
+                continue
+            for piece in self._split(part, limit, level + 1):
+                if current and len(current) + len(separator) + len(piece) > limit:
+                    pieces.append(current)
+                    current = ""
+                current = f"{current}{separator}{piece}" if current else piece
+        if current:
+            pieces.append(current)
+        return pieces
+
+    def _passages(self, text: str) -> List[str]:
+        passages: List[str] = []
+        current = ""
+        limit = self.passage_tokens * CHARS_PER_TOKEN
+        paragraphs = (
+            piece
+            for paragraph in re.split(r"\n\s*\n", text)
+            if paragraph.strip()
+            for piece in self._split(paragraph.strip(), limit)
+        )
+        for paragraph in paragraphs:
+            if current and len(current) + len(paragraph) > limit:
+                passages.append(current)
+                current = ""
+            current = (
+                f"{current}{PASSAGE_SEPARATOR}{paragraph}" if current else paragraph
+            )
+        if current:
+            passages.append(current)
+        return passages
+
+    def _scores(self, query: str, passages: List[str]) -> List[float]:
+        query_terms = set(TERM_PATTERN.findall(query.lower()))
+        term_counts = [Counter(TERM_PATTERN.findall(p.lower())) for p in passages]
+        if not query_terms or not passages:
+            return [0.0] * len(passages)
+
+        lengths = [sum(counts.values()) for counts in term_counts]
+        average_length = (sum(lengths) / len(lengths)) or 1.0
+        document_frequency = Counter(
+            term for counts in term_counts for term in query_terms if term in counts
+        )
+        idf = {
+            term: math.log(1 + (len(passages) - frequency + 0.5) / (frequency + 0.5))
+            for term, frequency in document_frequency.items()
+        }
+
+        scores = []
+        for counts, length in zip(term_counts, lengths):
+            norm = self.k1 * (1 - self.b + self.b * length / average_length)
+            scores.append(
+                sum(
+                    weight * counts[term] * (self.k1 + 1) / (counts[term] + norm)
+                    for term, weight in idf.items()
+                    if term in counts
+                )
+            )
+        return scores
+
+    def compress_documents(
+        self,
+        documents: Sequence[Document],
+        query: str,
+        callbacks: Optional[Callbacks] = None,
+    ) -> Sequence[Document]:
+        """Keep the best passages of each document within the token budget."""
+        if not documents or self.token_budget <= 0:
+            return documents
+
+        passages: List[Tuple[int, int, str]] = []
+        for doc_index, document in enumerate(documents):
+            for position, passage in enumerate(self._passages(self._content(document))):
+                passages.append((doc_index, position, passage))
+        scores = self._scores(query, [passage for _, _, passage in passages])
+
+        overhead = [document_overhead_tokens(document) for document in documents]
+        best: Dict[int, int] = {}
+        for i, (doc_index, _, _) in enumerate(passages):
+            if doc_index not in best or scores[i] > scores[best[doc_index]]:
+                best[doc_index] = i
+        firsts = [best[doc_index] for doc_index in sorted(best)]
+        first_set = set(firsts)
+        ranked = sorted(range(len(passages)), key=lambda i: scores[i], reverse=True)
+        order = firsts + [i for i in ranked if i not in first_set]
+
+        used = 0
+        kept: Dict[int, List[int]] = {}
+        for i in order:
+            doc_index, _, passage = passages[i]
+            cost = estimate_tokens(passage) + (
+                0 if doc_index in kept else overhead[doc_index]
+            )
+            if used + cost > self.token_budget:
+                continue
+            used += cost
+            kept.setdefault(doc_index, []).append(i)
+
+        packed = []
+        for doc_index, document in enumerate(documents):
+            if doc_index not in kept:
+                continue
+            content = PASSAGE_SEPARATOR.join(
+                passages[i][2] for i in sorted(kept[doc_index])
+            )
+            metadata = dict(document.metadata)
+            if self.content_key in metadata:
+                metadata[self.content_key] = content
+                page_content = document.page_content
+            else:
+                page_content = content
+            packed.append(Document(page_content=page_content, metadata=metadata))
 
-        return top_docs
+        original = context_tokens(documents, self.content_key)
+        logger.info(
+            f"Context packed: {len(packed)}/{len(documents)} documents, "
+            f"{original} -> {used} tokens (budget {self.token_budget})"
+        )
+        metrics.observe("context_tokens_unpacked", original)
+        metrics.observe("context_tokens", used)
+        return packed
@@ -0,0 +1,146 @@
+import asyncio
+import hashlib
+import os
+import re
+import time
+from typing import Awaitable, Callable, Dict
+
+from caddy_core.utils.cache import TTLCache
+from caddy_core.utils.concurrency import run_blocking
+from caddy_core.utils.monitoring import logger, metrics
+from caddy_core.utils.tables import rewrite_cache_table
+
+REWRITE_CACHE_TTL = float(os.getenv("REWRITE_CACHE_TTL", 86400))
+REWRITE_CACHE_MAX_ENTRIES = int(os.getenv("REWRITE_CACHE_MAX_ENTRIES", 2048))
+
+
+def normalise_message(message: str) -> str:
+    return re.sub(r"\s+", " ", message).strip().lower()
+
+
+def rewrite_namespace(model_id: str, *prompts: str) -> str:
+    """
+    Cache namespace for a rewriter, the model plus a hash of every prompt it uses,
+    so editing a prompt stops rewrites made with the old one being served
+    """
+    prompt_hash = hashlib.sha256("\0".join(prompts).encode("utf-8")).hexdigest()
+    return f"{model_id}:{prompt_hash[:16]}"
+
+
+def message_hash(message: str, namespace: str = "") -> str:
+    """
+    Hash of the normalised message, namespaced by whatever produced the rewrite
+    (see rewrite_namespace) so changing it does not serve stale rewrites
+    """
+    return hashlib.sha256(
+        f"{namespace}\0{normalise_message(message)}".encode("utf-8")
+    ).hexdigest()
+
+
+class RewriteCache:
+    """
+    Caches query rewrites by normalised message hash so a given adviser message is
+    reworded at most once, across retries, Proceed and edit flows.
+
+    Rewrites live in a size-bounded LRU with TTL, and optionally in a shared
+    DynamoDB table (REWRITE_CACHE_TABLE_NAME) so other workers reuse them.
+    Concurrent requests for the same message share one in-flight rewrite.
+    """
+
+    def __init__(self, ttl: float, max_size: int, table=None):
+        self.ttl = ttl
+        self.table = table
+        self.local = TTLCache("rewrite", max_size=max_size, ttl=ttl)
+        self._in_flight: Dict[str, asyncio.Future] = {}
+
+    def _read_shared(self, key: str):
+        response = self.table.get_item(Key={"messageHash": key})
+        item = response.get("Item")
+        if item and int(item["expiresAt"]) > time.time():
+            return item["rewrittenQuery"]
+        return None
+
+    def _write_shared(self, key: str, rewritten_query: str):
+        self.table.put_item(
+            Item={
+                "messageHash": key,
+                "rewrittenQuery": rewritten_query,
+                "expiresAt": int(time.time() + self.ttl),
+            }
+        )
+
+    async def get_or_rewrite(
+        self,
+        message: str,
+        rewrite: Callable[[str], Awaitable[str]],
+        namespace: str = "",
+    ) -> str:
+        """
+        Returns the cached rewrite for message, calling rewrite on a miss
+
+        Args:
+            message (str): adviser message
+            rewrite (Callable): coroutine function producing the rewrite
+            namespace (str): identifies the rewriter, part of the cache key
+
+        Returns:
+            str: rewritten query
+        """
+        key = message_hash(message, namespace)
+
+        cached = self.local.get(key)
+        if cached is not None:
+            return cached
+
+        pending = self._in_flight.get(key)
+        if pending is not None:
+            metrics.increment("rewrite_cache_coalesced")
+            return await asyncio.shield(pending)
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            rewritten_query = await self._lookup_or_rewrite(key, message, rewrite)
+            self.local.set(key, rewritten_query)
+            future.set_result(rewritten_query)
+            return rewritten_query
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as error:
+            future.set_exception(error)
+            # Retrieve the exception so an unawaited future does not warn
+            future.exception()
+            raise
+        finally:
+            self._in_flight.pop(key, None)
+
+    async def _lookup_or_rewrite(
+        self, key: str, message: str, rewrite: Callable[[str], Awaitable[str]]
+    ) -> str:
+        if self.table is not None:
+            try:
+                shared = await run_blocking(self._read_shared, key)
+                if shared is not None:
+                    metrics.increment("rewrite_cache_shared_hits")
+                    return shared
+                metrics.increment("rewrite_cache_shared_misses")
+            except Exception as error:
+                logger.warning(f"Shared rewrite cache read failed: {error}")
+
+        metrics.increment("rewrite_cache_rewrites")
+        rewritten_query = await rewrite(message)
+
+        if self.table is not None:
+            try:
+                await run_blocking(self._write_shared, key, rewritten_query)
+            except Exception as error:
+                logger.warning(f"Shared rewrite cache write failed: {error}")
+        return rewritten_query
+
+
+rewrite_cache = RewriteCache(
+    ttl=REWRITE_CACHE_TTL,
+    max_size=REWRITE_CACHE_MAX_ENTRIES,
+    table=rewrite_cache_table,
+)
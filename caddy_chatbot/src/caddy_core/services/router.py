@@ -1,11 +1,19 @@
+import fcntl
+import hashlib
+import json
 import os
+from typing import List, Optional
+
 import boto3
-from botocore.exceptions import ClientError
+import numpy as np
+from botocore.exceptions import ClientError, NoCredentialsError
 from datetime import datetime, timezone, timedelta
 
 from semantic_router import Route, RouteLayer
 from semantic_router.encoders import BedrockEncoder
+from semantic_router.utils.defaults import EncoderDefault
 from caddy_core.utils.monitoring import logger
+from caddy_core.services.embedding_cache import embedding_cache
 from caddy_core.routes import routes_data
 
 from semantic_router.index.postgres import PostgresIndex
@@ -16,6 +24,18 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+# Defaults to route_snapshot next to the caddy_core package, whatever the working
+# directory, which is where the image build writes it
+ROUTE_SNAPSHOT_DIR = os.getenv(
+    "ROUTE_SNAPSHOT_DIR",
+    os.path.join(
+        os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+        "route_snapshot",
+    ),
+)
+
+AMBIENT_CREDENTIALS_TTL = timedelta(minutes=15)
+
 
 class CachedRouteLayer(RouteLayer):
     """
@@ -32,6 +52,7 @@ class AutoRefreshBedrockEncoder:
         logger.info("Constructing encoder")
         self.region = region
         self.score_threshold = score_threshold
+        self.model_name = EncoderDefault.BEDROCK.value["embedding_model"]
         self.encoder = None
         self.expiration = datetime.now(
             timezone.utc
@@ -39,9 +60,12 @@ class AutoRefreshBedrockEncoder:
 
     def refresh_credentials(self):
         logger.info("Refreshing credentials")
+        role_arn = os.environ.get("TASK_ROLE_ARN")
+        if not role_arn:
+            self._use_ambient_credentials()
+            return
         try:
             sts_client = boto3.client("sts")
-            role_arn = os.environ.get("TASK_ROLE_ARN")
             response = sts_client.assume_role(
                 RoleArn=role_arn,
                 RoleSessionName="CaddyTaskSession",
@@ -63,7 +87,35 @@ class AutoRefreshBedrockEncoder:
             logger.error(f"Failed to refresh credentials: {e}")
             raise
 
-    def __call__(self, *args, **kwargs):
+    def _use_ambient_credentials(self):
+        """
+        Builds the encoder from the default credential chain, for the image build
+        and local runs where there is no task role to assume
+        """
+        credentials = boto3.Session().get_credentials()
+        if credentials is None:
+            raise NoCredentialsError()
+        credentials = credentials.get_frozen_credentials()
+        self.encoder = BedrockEncoder(
+            access_key_id=credentials.access_key,
+            secret_access_key=credentials.secret_key,
+            session_token=credentials.token,
+            region=self.region,
+            score_threshold=self.score_threshold,
+        )
+        # Frozen credentials may be temporary, so they are re-read from the
+        # chain rather than trusted for longer
+        self.expiration = datetime.now(timezone.utc) + AMBIENT_CREDENTIALS_TTL
+        logger.info("Using ambient credentials, no TASK_ROLE_ARN to assume")
+
+    def __call__(self, docs, *args, **kwargs):
+        return embedding_cache.embed(
+            f"route:{self.model_name}",
+            docs,
+            lambda texts: self._encode(texts, *args, **kwargs),
+        )
+
+    def _encode(self, *args, **kwargs):
         logger.info("Calling encoder")
         if datetime.now(timezone.utc) >= self.expiration - timedelta(minutes=5):
             logger.info("Credentials expiring soon, refreshing...")
@@ -77,6 +129,131 @@ class AutoRefreshBedrockEncoder:
         return getattr(self.encoder, name)
 
 
+def routes_hash(routes: List[Route], model_name: str) -> str:
+    """
+    Hash of the route definitions and the model embedding them, a snapshot is
+    only valid for the exact routes and model it was built from
+    """
+    definition = json.dumps(
+        {
+            "model": model_name,
+            "routes": [
+                {"name": route.name, "utterances": route.utterances} for route in routes
+            ],
+        },
+        sort_keys=True,
+    )
+    return hashlib.sha256(definition.encode("utf-8")).hexdigest()
+
+
+def _snapshot_paths(directory: str, version: str):
+    prefix = os.path.join(directory, f"routes-{version[:16]}")
+    return f"{prefix}.npy", f"{prefix}.json"
+
+
+def load_route_snapshot(directory: str, version: str) -> Optional[LocalIndex]:
+    """
+    Loads a route snapshot as a LocalIndex over memory mapped embeddings, None
+    if there is no snapshot for this version
+
+    Args:
+        directory (str): snapshot directory
+        version (str): routes_hash of the current routes
+
+    Returns:
+        Optional[LocalIndex]: index of every route utterance
+    """
+    vectors_path, manifest_path = _snapshot_paths(directory, version)
+    if not (os.path.exists(vectors_path) and os.path.exists(manifest_path)):
+        return None
+    with open(manifest_path) as file:
+        manifest = json.load(file)
+    vectors = np.load(vectors_path, mmap_mode="r")
+    if manifest["hash"] != version or len(vectors) != len(manifest["routes"]):
+        logger.warning(f"Ignoring route snapshot {vectors_path}, it does not match")
+        return None
+    return LocalIndex(
+        index=vectors,
+        routes=np.array(manifest["routes"]),
+        utterances=np.array(manifest["utterances"]),
+    )
+
+
+def save_route_snapshot(
+    directory: str, version: str, routes: List[Route], encoder
+) -> None:
+    """
+    Embeds every route utterance and writes the snapshot for this version,
+    removing snapshots of earlier versions. Files are written under temporary
+    names and renamed, so readers never see a partial snapshot
+
+    Args:
+        directory (str): snapshot directory
+        version (str): routes_hash of the routes
+        routes (List[Route]): routes to embed
+        encoder: route encoder
+    """
+    route_names = [route.name for route in routes for _ in route.utterances]
+    utterances = [utterance for route in routes for utterance in route.utterances]
+    vectors = np.asarray(encoder(utterances), dtype=np.float32)
+
+    vectors_path, manifest_path = _snapshot_paths(directory, version)
+    with open(f"{vectors_path}.tmp", "wb") as file:
+        np.save(file, vectors)
+    with open(f"{manifest_path}.tmp", "w") as file:
+        json.dump(
+            {
+                "hash": version,
+                "model": encoder.model_name,
+                "dimensions": int(vectors.shape[1]),
+                "routes": route_names,
+                "utterances": utterances,
+            },
+            file,
+        )
+    os.replace(f"{manifest_path}.tmp", manifest_path)
+    os.replace(f"{vectors_path}.tmp", vectors_path)
+
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if name.startswith("routes-") and path not in (vectors_path, manifest_path):
+            os.remove(path)
+    logger.info(f"Saved route snapshot of {len(utterances)} utterances to {directory}")
+
+
+def local_route_index(routes: List[Route], encoder) -> LocalIndex:
+    """
+    Returns the LocalIndex for the routes from the on-disk snapshot, building the
+    snapshot first if the routes or embedding model changed. Workers starting
+    together take a file lock, so only one of them embeds the utterances
+
+    Args:
+        routes (List[Route]): routes to index
+        encoder: route encoder, only called when the snapshot is rebuilt
+
+    Returns:
+        LocalIndex: index of every route utterance
+    """
+    version = routes_hash(routes, encoder.model_name)
+    index = load_route_snapshot(ROUTE_SNAPSHOT_DIR, version)
+    if index is not None:
+        logger.info(f"Loaded route snapshot {version[:16]}")
+        return index
+
+    os.makedirs(ROUTE_SNAPSHOT_DIR, exist_ok=True)
+    with open(os.path.join(ROUTE_SNAPSHOT_DIR, ".lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            index = load_route_snapshot(ROUTE_SNAPSHOT_DIR, version)
+            if index is None:
+                logger.info(f"Building route snapshot {version[:16]}")
+                save_route_snapshot(ROUTE_SNAPSHOT_DIR, version, routes, encoder)
+                index = load_route_snapshot(ROUTE_SNAPSHOT_DIR, version)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+    return index
+
+
 def load_semantic_router() -> RouteLayer:
     routes = []
     for route in routes_data:
@@ -84,20 +261,20 @@ def load_semantic_router() -> RouteLayer:
         route = Route(name=route["name"], utterances=utterances)
         routes.append(route)
 
+    embeddings = AutoRefreshBedrockEncoder(region="eu-west-3", score_threshold=0.5)
     if os.environ.get("POSTGRES_CONNECTION_STRING", False):
         logger.info(
             "POSTGRES_CONNECTION_STRING is set, looking for routes in postgres..."
         )
         index = PostgresIndex(dimensions=1024)
     else:
-        index = LocalIndex()
+        index = local_route_index(routes, embeddings)
 
     try:
         route_count_in_index = len(index.get_routes())
     except ValueError:
         route_count_in_index = 0
 
-    embeddings = AutoRefreshBedrockEncoder(region="eu-west-3", score_threshold=0.5)
     if route_count_in_index > 0:
         logger.info(f"Loading {route_count_in_index} routes from index...")
         return CachedRouteLayer(encoder=embeddings, routes=routes, index=index)
@@ -0,0 +1,138 @@
+import json
+import os
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from caddy_core.utils.monitoring import logger
+
+SCORE_CALIBRATION_PATH = os.getenv("SCORE_CALIBRATION_PATH")
+RELEVANCE_CUTOFF = float(os.getenv("RELEVANCE_CUTOFF", 0.0))
+
+CALIBRATION_QUANTILES = 101
+
+
+def calibration_key(index: str, mode: str = "vector") -> str:
+    """
+    Calibrations are kept per index and retrieval mode, as kNN and fused hybrid
+    scores sit on different scales
+    """
+    return index if mode == "vector" else f"{index}:{mode}"
+
+
+class ScoreCalibration:
+    """
+    Maps raw search scores onto an absolute 0 to 1 relevance scale per index.
+
+    Each index has the quantiles of the scores its top hits received for a sample
+    of representative queries, fitted offline with fit_calibration. A raw score is
+    calibrated to its position in that distribution, so 0.5 means a typical hit
+    and 0.05 a hit weaker than almost anything the index normally returns. Unlike
+    min-max scaling within a result set, this lets an entire tail be irrelevant.
+
+    Args:
+        quantiles (Dict[str, List[float]]): score quantiles per calibration key
+    """
+
+    def __init__(self, quantiles: Optional[Dict[str, List[float]]] = None):
+        self.quantiles = {
+            key: np.maximum.accumulate(np.asarray(values, dtype=np.float64))
+            for key, values in (quantiles or {}).items()
+        }
+
+    @classmethod
+    def load(cls, path: str) -> "ScoreCalibration":
+        with open(path) as file:
+            calibration = cls(json.load(file))
+        logger.info(
+            f"Loaded score calibration for {len(calibration.quantiles)} indices"
+        )
+        return calibration
+
+    def save(self, path: str):
+        with open(path, "w") as file:
+            json.dump(
+                {key: values.tolist() for key, values in self.quantiles.items()},
+                file,
+                indent=2,
+            )
+
+    def calibrate(self, key: str, score: float) -> Optional[float]:
+        """
+        Returns the calibrated relevance of a raw score, None if the key has no
+        calibration
+        """
+        quantiles = self.quantiles.get(key)
+        if quantiles is None:
+            return None
+        return float(np.interp(score, quantiles, np.linspace(0.0, 1.0, len(quantiles))))
+
+    def relevance_scores(self, key: str, scores: List[float]) -> List[float]:
+        """
+        Calibrated relevance for a result set, falling back to min-max scaling
+        within the set for uncalibrated indices
+        """
+        if not scores:
+            return []
+        if key in self.quantiles:
+            return [self.calibrate(key, score) for score in scores]
+
+        min_score = min(scores)
+        max_score = max(scores)
+        if max_score == min_score:
+            return [1.0 for _ in scores]
+        return [(score - min_score) / (max_score - min_score) for score in scores]
+
+
+def fit_calibration(
+    scores: Dict[str, List[float]], quantiles: int = CALIBRATION_QUANTILES
+) -> ScoreCalibration:
+    """
+    Fits a calibration from sampled raw scores
+
+    Args:
+        scores (Dict[str, List[float]]): raw hit scores per calibration key, from
+            running representative queries through the production search path
+        quantiles (int): points kept per key
+
+    Returns:
+        ScoreCalibration: calibration over the sampled distributions
+    """
+    return ScoreCalibration(
+        {
+            key: np.quantile(values, np.linspace(0.0, 1.0, quantiles)).tolist()
+            for key, values in scores.items()
+            if values
+        }
+    )
+
+
+def collect_scores(retriever: Any, queries: List[str]) -> Dict[str, List[float]]:
+    """
+    Runs sample queries through a MultiIndexRetriever's search and gathers the raw
+    kNN scores of the hits per calibration key, for fit_calibration. Fused hybrid
+    scores only reflect rank, so hybrid hits are calibrated on their kNN score too
+
+    Args:
+        retriever (MultiIndexRetriever): retriever configured as in production
+        queries (List[str]): representative adviser queries
+
+    Returns:
+        Dict[str, List[float]]: raw scores per calibration key
+    """
+    scores: Dict[str, List[float]] = {}
+    for query in queries:
+        hits = retriever.search(query, retriever.embeddings.embed_query(query))
+        for index, index_hits in hits.items():
+            knn_scores = [retriever.knn_score(hit) for hit in index_hits]
+            scores.setdefault(calibration_key(index), []).extend(
+                score for score in knn_scores if score is not None
+            )
+    return scores
+
+
+score_calibration = (
+    ScoreCalibration.load(SCORE_CALIBRATION_PATH)
+    if SCORE_CALIBRATION_PATH and os.path.exists(SCORE_CALIBRATION_PATH)
+    else ScoreCalibration()
+)
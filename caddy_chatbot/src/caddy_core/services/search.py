@@ -0,0 +1,456 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import zip_longest
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain_community.vectorstores.utils import maximal_marginal_relevance
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForRetrieverRun,
+    CallbackManagerForRetrieverRun,
+)
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+from opensearchpy import AsyncOpenSearch, OpenSearch
+
+from caddy_core.services.opensearch_client import (
+    get_async_opensearch_client,
+    get_opensearch_client,
+)
+from caddy_core.services.retrievers import (
+    KNN_SCORE_KEY,
+    RELEVANCE_KEY,
+    VECTOR_METADATA_KEY,
+)
+from caddy_core.services.score_calibration import ScoreCalibration, calibration_key
+from caddy_core.utils.monitoring import logger, metrics
+
+OPENSEARCH_MSEARCH = os.getenv("OPENSEARCH_MSEARCH", "True").lower() == "true"
+RRF_K = int(os.getenv("RRF_K", 60))
+
+VECTOR_FIELD = "vector_field"
+TEXT_FIELD = "text"
+METADATA_FIELD = "metadata"
+
+# Candidate hits returned for one index: (text, metadata, vector, score)
+Hit = Tuple[str, Dict[str, Any], List[float], float]
+
+
+class OpenSearchBackend:
+    """
+    Runs kNN, or hybrid BM25 and kNN, searches against several OpenSearch indices
+    in one round trip, as a single _msearch or, with OPENSEARCH_MSEARCH off,
+    concurrent per-index searches. The async variants use the async client when
+    there is one, so searches from the event loop do not hold a worker thread
+
+    Args:
+        client (OpenSearch): client for the cluster holding the indices
+        async_client (AsyncOpenSearch): async client for the same cluster
+    """
+
+    def __init__(
+        self, client: OpenSearch, async_client: Optional[AsyncOpenSearch] = None
+    ):
+        self.client = client
+        self.async_client = async_client
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def _knn_body(self, vector: List[float], k: int) -> Dict[str, Any]:
+        return {
+            "size": k,
+            "min_score": 0.0,
+            "query": {"knn": {VECTOR_FIELD: {"vector": vector, "k": k}}},
+        }
+
+    @staticmethod
+    def _hits(response: Dict[str, Any]) -> List[Hit]:
+        return [
+            (
+                hit["_source"][TEXT_FIELD],
+                hit["_source"].get(METADATA_FIELD, {}),
+                hit["_source"][VECTOR_FIELD],
+                hit.get("_score", 0.0),
+            )
+            for hit in response["hits"]["hits"]
+        ]
+
+    def _lexical_body(self, query: str, k: int) -> Dict[str, Any]:
+        return {"size": k, "query": {"match": {TEXT_FIELD: {"query": query}}}}
+
+    def _knn_searches(
+        self, vector: List[float], fetch_k: Dict[str, int]
+    ) -> List[Tuple[str, Dict[str, Any]]]:
+        return [(index, self._knn_body(vector, k)) for index, k in fetch_k.items()]
+
+    def _hybrid_searches(
+        self, query: str, vector: List[float], fetch_k: Dict[str, int]
+    ) -> List[Tuple[str, Dict[str, Any]]]:
+        searches = []
+        for index, k in fetch_k.items():
+            searches.append((index, self._knn_body(vector, k)))
+            searches.append((index, self._lexical_body(query, k)))
+        return searches
+
+    @staticmethod
+    def _fuse(fetch_k: Dict[str, int], hits: List[List[Hit]]) -> Dict[str, List[Hit]]:
+        return {
+            index: with_knn_scores(
+                reciprocal_rank_fusion([hits[2 * i], hits[2 * i + 1]])[:k],
+                hits[2 * i],
+            )
+            for i, (index, k) in enumerate(fetch_k.items())
+        }
+
+    def knn_search(
+        self, vector: List[float], fetch_k: Dict[str, int]
+    ) -> Dict[str, List[Hit]]:
+        """
+        Fetches kNN candidates from each index
+
+        Args:
+            vector (List[float]): query embedding
+            fetch_k (Dict[str, int]): candidates to fetch per index name
+
+        Returns:
+            Dict[str, List[Hit]]: candidates per index, empty for indices that errored
+        """
+        started = time.perf_counter()
+        hits = self._search(self._knn_searches(vector, fetch_k))
+        metrics.observe("opensearch_knn_search_seconds", time.perf_counter() - started)
+        return dict(zip(fetch_k, hits))
+
+    def hybrid_search(
+        self, query: str, vector: List[float], fetch_k: Dict[str, int]
+    ) -> Dict[str, List[Hit]]:
+        """
+        Fetches BM25 and kNN candidates from each index in the same round trip and
+        fuses each index's two rankings with reciprocal rank fusion
+
+        Args:
+            query (str): query text for BM25
+            vector (List[float]): query embedding for kNN
+            fetch_k (Dict[str, int]): candidates to fetch per index name
+
+        Returns:
+            Dict[str, List[Hit]]: fused candidates per index
+        """
+        started = time.perf_counter()
+        hits = self._search(self._hybrid_searches(query, vector, fetch_k))
+        metrics.observe(
+            "opensearch_hybrid_search_seconds", time.perf_counter() - started
+        )
+        return self._fuse(fetch_k, hits)
+
+    async def aknn_search(
+        self, vector: List[float], fetch_k: Dict[str, int]
+    ) -> Dict[str, List[Hit]]:
+        started = time.perf_counter()
+        hits = await self._asearch(self._knn_searches(vector, fetch_k))
+        metrics.observe("opensearch_knn_search_seconds", time.perf_counter() - started)
+        return dict(zip(fetch_k, hits))
+
+    async def ahybrid_search(
+        self, query: str, vector: List[float], fetch_k: Dict[str, int]
+    ) -> Dict[str, List[Hit]]:
+        started = time.perf_counter()
+        hits = await self._asearch(self._hybrid_searches(query, vector, fetch_k))
+        metrics.observe(
+            "opensearch_hybrid_search_seconds", time.perf_counter() - started
+        )
+        return self._fuse(fetch_k, hits)
+
+    def _search(self, searches: List[Tuple[str, Dict[str, Any]]]) -> List[List[Hit]]:
+        if OPENSEARCH_MSEARCH:
+            return self._msearch(searches)
+        return self._concurrent_search(searches)
+
+    async def _asearch(
+        self, searches: List[Tuple[str, Dict[str, Any]]]
+    ) -> List[List[Hit]]:
+        if self.async_client is None:
+            return await asyncio.to_thread(self._search, searches)
+        if OPENSEARCH_MSEARCH:
+            response = await self.async_client.msearch(
+                body=self._msearch_body(searches)
+            )
+            return self._collect_hits(searches, response["responses"])
+        responses = await asyncio.gather(
+            *(
+                self.async_client.search(index=index, body=search)
+                for index, search in searches
+            ),
+            return_exceptions=True,
+        )
+        return self._collect_hits(searches, responses)
+
+    @staticmethod
+    def _msearch_body(searches: List[Tuple[str, Dict[str, Any]]]) -> List[dict]:
+        body = []
+        for index, search in searches:
+            body.append({"index": index})
+            body.append(search)
+        return body
+
+    def _collect_hits(
+        self, searches: List[Tuple[str, Dict[str, Any]]], responses: List[Any]
+    ) -> List[List[Hit]]:
+        """
+        Hits per search, where each response is a search response, an _msearch
+        item carrying an error, or the exception its search raised. A failed
+        index contributes no hits, only failure on every index raises
+        """
+        results = []
+        failures = 0
+        for (index, _), response in zip(searches, responses):
+            if isinstance(response, Exception):
+                error = response
+            elif isinstance(response, BaseException):
+                raise response
+            else:
+                error = response.get("error")
+            if error is not None:
+                logger.warning(f"Search on {index} failed: {error}")
+                metrics.increment("opensearch_index_errors")
+                failures += 1
+                results.append([])
+            else:
+                results.append(self._hits(response))
+        if responses and failures == len(responses):
+            raise RuntimeError("Search failed on every index")
+        return results
+
+    def _msearch(self, searches: List[Tuple[str, Dict[str, Any]]]) -> List[List[Hit]]:
+        response = self.client.msearch(body=self._msearch_body(searches))
+        return self._collect_hits(searches, response["responses"])
+
+    def _concurrent_search(
+        self, searches: List[Tuple[str, Dict[str, Any]]]
+    ) -> List[List[Hit]]:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(thread_name_prefix="opensearch")
+        futures = [
+            self._executor.submit(self.client.search, index=index, body=search)
+            for index, search in searches
+        ]
+        responses = []
+        for future in futures:
+            try:
+                responses.append(future.result())
+            except Exception as error:
+                responses.append(error)
+        return self._collect_hits(searches, responses)
+
+
+def reciprocal_rank_fusion(rankings: List[List[Hit]], k: int = RRF_K) -> List[Hit]:
+    """
+    Fuses rankings of the same index, scoring each hit by the sum of 1 / (k + rank)
+    over the rankings it appears in. Hits are matched on their text
+
+    Args:
+        rankings (List[List[Hit]]): rankings, best first
+        k (int): rank constant, larger values flatten the contribution of top ranks
+
+    Returns:
+        List[Hit]: hits ordered by fused score, which replaces the hit score
+    """
+    scores: Dict[str, float] = {}
+    hits: Dict[str, Hit] = {}
+    for ranking in rankings:
+        for rank, hit in enumerate(ranking, start=1):
+            scores[hit[0]] = scores.get(hit[0], 0.0) + 1.0 / (k + rank)
+            hits.setdefault(hit[0], hit)
+    ordered = sorted(scores, key=scores.get, reverse=True)
+    return [(*hits[text][:3], scores[text]) for text in ordered]
+
+
+def with_knn_scores(fused: List[Hit], knn_hits: List[Hit]) -> List[Hit]:
+    """
+    Records each fused hit's kNN score in its metadata. Hits only BM25 found get
+    the lowest kNN score of the index, as they ranked below every kNN candidate,
+    and None when the kNN search returned nothing
+
+    Args:
+        fused (List[Hit]): hits ordered by fused score
+        knn_hits (List[Hit]): the kNN ranking that went into the fusion
+
+    Returns:
+        List[Hit]: the fused hits with KNN_SCORE_KEY set in their metadata
+    """
+    knn_scores = {hit[0]: hit[3] for hit in knn_hits}
+    floor = min(knn_scores.values()) if knn_scores else None
+    return [
+        (text, {**metadata, KNN_SCORE_KEY: knn_scores.get(text, floor)}, vector, score)
+        for text, metadata, vector, score in fused
+    ]
+
+
+class MultiIndexRetriever(BaseRetriever):
+    """Retrieves from all of a user's source indices with one query embedding and one search.
+
+    Candidates from each index go through MMR on the client, then the per-index
+    results are interleaved so every source is represented, as MergerRetriever did."""
+
+    backend: Any
+    """Search backend with a knn_search method."""
+
+    embeddings: Embeddings
+    """Embeddings used for the query."""
+
+    indices: List[str]
+    """Index names to search."""
+
+    k: int = 12
+    """Documents kept per index after MMR."""
+
+    fetch_k: int = 18
+    """Candidates fetched per index for MMR."""
+
+    lambda_mult: float = 0.2
+    """MMR diversity, 0 for most diverse and 1 for least."""
+
+    hybrid: bool = False
+    """Fuse BM25 with kNN candidates, needs a backend with hybrid_search."""
+
+    calibration: Optional[ScoreCalibration] = None
+    """Per-index score calibration, needed for the relevance cutoff."""
+
+    relevance_cutoff: float = 0.0
+    """Calibrated kNN relevance below which hits are dropped before MMR, 0 to keep all."""
+
+    def _select(self, query_vector: np.ndarray, index: str, hits: List[Hit]):
+        if not hits:
+            return []
+        selected = maximal_marginal_relevance(
+            query_vector,
+            [hit[2] for hit in hits],
+            k=self.k,
+            lambda_mult=self.lambda_mult,
+        )
+        return [
+            Document(
+                page_content=hits[i][0],
+                metadata={
+                    **hits[i][1],
+                    "index_name": index,
+                    "score": hits[i][3],
+                    KNN_SCORE_KEY: self.knn_score(hits[i]),
+                    RELEVANCE_KEY: self._relevance(index, hits[i]),
+                    VECTOR_METADATA_KEY: hits[i][2],
+                },
+            )
+            for i in selected
+        ]
+
+    def knn_score(self, hit: Hit) -> Optional[float]:
+        """
+        The hit's kNN score, which calibration and the cutoff apply to in both
+        modes. Backends without BM25 return kNN hits from hybrid searches too
+        """
+        if self.hybrid:
+            return hit[1].get(KNN_SCORE_KEY, hit[3])
+        return hit[3]
+
+    def _relevance(self, index: str, hit: Hit) -> Optional[float]:
+        """
+        The hit's calibrated kNN relevance, None without a calibration or a kNN score
+        """
+        score = self.knn_score(hit)
+        if self.calibration is None or score is None:
+            return None
+        return self.calibration.calibrate(calibration_key(index), score)
+
+    def search(self, query: str, query_vector: List[float]) -> Dict[str, List[Hit]]:
+        """
+        Fetches the raw candidates per index, before any cutoff or MMR
+        """
+        fetch_k = {index: self.fetch_k for index in self.indices}
+        if self.hybrid:
+            return self.backend.hybrid_search(query, query_vector, fetch_k)
+        return self.backend.knn_search(query_vector, fetch_k)
+
+    def _cutoff(self, index: str, hits: List[Hit]) -> List[Hit]:
+        if not self.relevance_cutoff or self.calibration is None:
+            return hits
+        kept = []
+        for hit in hits:
+            relevance = self._relevance(index, hit)
+            if relevance is None or relevance >= self.relevance_cutoff:
+                kept.append(hit)
+        return kept
+
+    async def asearch(
+        self, query: str, query_vector: List[float]
+    ) -> Dict[str, List[Hit]]:
+        """
+        Async search, through the backend's async client when it has one
+        """
+        fetch_k = {index: self.fetch_k for index in self.indices}
+        if self.hybrid and hasattr(self.backend, "ahybrid_search"):
+            return await self.backend.ahybrid_search(query, query_vector, fetch_k)
+        if not self.hybrid and hasattr(self.backend, "aknn_search"):
+            return await self.backend.aknn_search(query_vector, fetch_k)
+        return await asyncio.to_thread(self.search, query, query_vector)
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        query_vector = self.embeddings.embed_query(query)
+        return self._documents(query_vector, self.search(query, query_vector))
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        query_vector = await self.embeddings.aembed_query(query)
+        hits = await self.asearch(query, query_vector)
+        return self._documents(query_vector, hits)
+
+    def _documents(
+        self, query_vector: List[float], hits: Dict[str, List[Hit]]
+    ) -> List[Document]:
+        fetched = dropped = 0
+        per_index = []
+        for index in self.indices:
+            index_hits = hits.get(index, [])
+            kept = self._cutoff(index, index_hits)
+            fetched += len(index_hits)
+            dropped += len(index_hits) - len(kept)
+            per_index.append(self._select(np.array(query_vector), index, kept))
+        if self.relevance_cutoff:
+            logger.debug(f"Relevance cutoff dropped {dropped}/{fetched} hits")
+            metrics.observe("retrieval_docs_dropped", dropped)
+        return interleave(per_index)
+
+
+def interleave(document_lists: List[List[Document]]) -> List[Document]:
+    """
+    Round robin merge of per-source results, one document from each source in turn
+    """
+    return [
+        document
+        for documents in zip_longest(*document_lists)
+        for document in documents
+        if document is not None
+    ]
+
+
+_backend: Optional[OpenSearchBackend] = None
+_backend_lock = threading.Lock()
+
+
+def get_search_backend(opensearch_url: str, http_auth: Any) -> OpenSearchBackend:
+    """
+    Returns the process-wide OpenSearch search backend, created on first use over
+    the shared sync and async clients
+    """
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = OpenSearchBackend(
+                get_opensearch_client(opensearch_url, http_auth),
+                async_client=get_async_opensearch_client(opensearch_url, http_auth),
+            )
+        return _backend
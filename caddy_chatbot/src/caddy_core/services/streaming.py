@@ -0,0 +1,158 @@
+import asyncio
+import os
+import time
+from typing import Any, Awaitable, Callable, Optional
+
+from caddy_core.utils.monitoring import logger, metrics
+
+STREAM_UPDATE_MIN_INTERVAL = float(os.getenv("STREAM_UPDATE_MIN_INTERVAL", 1.5))
+STREAM_UPDATE_MIN_CHARS = int(os.getenv("STREAM_UPDATE_MIN_CHARS", 500))
+RATE_LIMIT_BACKOFF = float(os.getenv("STREAM_UPDATE_RATE_LIMIT_BACKOFF", 2))
+RATE_LIMIT_MAX_BACKOFF = float(os.getenv("STREAM_UPDATE_RATE_LIMIT_MAX_BACKOFF", 30))
+
+
+def is_rate_limited(error: Exception) -> bool:
+    """
+    Checks whether a chat API error is a 429, googleapiclient and aiohttp style
+    """
+    response = getattr(error, "resp", None)
+    status = getattr(response, "status", None) or getattr(error, "status", None)
+    return str(status) == "429"
+
+
+async def send_with_backoff(
+    send: Callable[[], Awaitable[Any]], attempts: int = 5
+) -> Any:
+    """
+    Sends a chat update, backing off exponentially while the API returns 429s
+    """
+    delay = RATE_LIMIT_BACKOFF
+    for attempt in range(attempts):
+        try:
+            return await send()
+        except Exception as error:
+            if not is_rate_limited(error) or attempt == attempts - 1:
+                raise
+            metrics.increment("chat_api_rate_limited")
+            logger.warning(f"Chat API rate limited, retrying in {delay}s")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, RATE_LIMIT_MAX_BACKOFF)
+
+
+class CardUpdateScheduler:
+    """
+    Coalesces streamed answer updates into chat card updates.
+
+    The token loop calls update() with the latest state, which only records it.
+    A background task flushes the latest state once STREAM_UPDATE_MIN_INTERVAL has
+    passed since the previous flush, or sooner once STREAM_UPDATE_MIN_CHARS of new
+    text has built up. Intermediate states are skipped rather than queued, and
+    flushing backs off when the chat API returns 429s.
+
+    Args:
+        flush (Callable): coroutine function sending a state to the chat API
+        min_interval (float): minimum seconds between flushes
+        min_chars (int): new characters that trigger a flush before the interval
+    """
+
+    def __init__(
+        self,
+        flush: Callable[[Any], Awaitable[Any]],
+        min_interval: float = STREAM_UPDATE_MIN_INTERVAL,
+        min_chars: int = STREAM_UPDATE_MIN_CHARS,
+    ):
+        self.flush = flush
+        self.min_interval = min_interval
+        self.min_chars = min_chars
+        self._latest = None
+        self._pending_chars = 0
+        self._last_flush = time.monotonic()
+        self._backoff = 0.0
+        self._dirty = asyncio.Event()
+        self._threshold = asyncio.Event()
+        self._closed = False
+        self._closing = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    def update(self, state: Any, new_chars: int):
+        """
+        Records the latest state without blocking, it is sent on the next flush
+        """
+        self._latest = state
+        self._pending_chars += new_chars
+        self._dirty.set()
+        if self._pending_chars >= self.min_chars:
+            self._threshold.set()
+
+    async def _run(self):
+        while not self._closed:
+            await self._dirty.wait()
+
+            wait = max(
+                self.min_interval - (time.monotonic() - self._last_flush),
+                self._backoff,
+            )
+            if wait > 0 and (self._backoff or self._pending_chars < self.min_chars):
+                try:
+                    await asyncio.wait_for(self._threshold.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                if self._backoff and not self._closed:
+                    # Stay backed off even if the character threshold is reached
+                    remaining = self._backoff - (time.monotonic() - self._last_flush)
+                    if remaining > 0:
+                        try:
+                            await asyncio.wait_for(
+                                self._closing.wait(), timeout=remaining
+                            )
+                        except asyncio.TimeoutError:
+                            pass
+
+            if self._closed:
+                return
+
+            state = self._latest
+            self._dirty.clear()
+            self._threshold.clear()
+            self._pending_chars = 0
+            self._last_flush = time.monotonic()
+            try:
+                await self.flush(state)
+                metrics.increment("stream_card_updates")
+                self._backoff = 0.0
+            except Exception as error:
+                if is_rate_limited(error):
+                    metrics.increment("chat_api_rate_limited")
+                    self._backoff = min(
+                        max(self._backoff * 2, RATE_LIMIT_BACKOFF),
+                        RATE_LIMIT_MAX_BACKOFF,
+                    )
+                    logger.warning(
+                        f"Streaming update rate limited, backing off {self._backoff}s"
+                    )
+                else:
+                    logger.warning(f"Streaming card update failed: {error}")
+
+    async def close(self, final_state: Optional[Any] = None):
+        """
+        Stops background flushing, waiting for an update already in flight, then
+        sends final_state if given
+
+        Args:
+            final_state (Any): state to send once streaming has finished
+
+        Returns:
+            Any: result of the final flush, None if no final state was given
+        """
+        self._closed = True
+        self._closing.set()
+        self._dirty.set()
+        self._threshold.set()
+        try:
+            await self._task
+        except Exception as error:
+            logger.warning(f"Streaming card update failed: {error}")
+
+        if final_state is not None:
+            return await send_with_backoff(lambda: self.flush(final_state))
+        return None
@@ -0,0 +1,113 @@
+import asyncio
+import os
+from typing import Dict, Iterable, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from caddy_core.utils.cache import TTLCache
+from caddy_core.utils.concurrency import run_blocking
+from caddy_core.utils.monitoring import logger, metrics
+
+URL_VALIDATION_TIMEOUT = float(os.getenv("URL_VALIDATION_TIMEOUT", 5))
+URL_VALIDATION_TTL = float(os.getenv("URL_VALIDATION_TTL", 3600))
+URL_VALIDATION_NEGATIVE_TTL = float(os.getenv("URL_VALIDATION_NEGATIVE_TTL", 300))
+URL_VALIDATION_MAX_ENTRIES = int(os.getenv("URL_VALIDATION_MAX_ENTRIES", 4096))
+
+VALID_STATUS_CODES = [200, 302, 403]
+
+url_cache = TTLCache("url_validation", max_size=URL_VALIDATION_MAX_ENTRIES)
+
+_session = requests.Session()
+_session.mount("https://", HTTPAdapter(pool_connections=32, pool_maxsize=32))
+_session.mount("http://", HTTPAdapter(pool_connections=32, pool_maxsize=32))
+
+_pending: Dict[str, asyncio.Future] = {}
+
+
+def check_url(url: str) -> bool:
+    """
+    Checks a cited URL resolves, with a HEAD request following redirects
+    """
+    try:
+        response = _session.head(
+            url, timeout=URL_VALIDATION_TIMEOUT, allow_redirects=True
+        )
+        if response.status_code in VALID_STATUS_CODES:
+            return True
+        logger.warning(f"URL {url} returned status code {response.status_code}")
+    except requests.RequestException as e:
+        logger.error(f"Error checking URL {url}: {str(e)}")
+    return False
+
+
+def cached_url_status(url: str) -> Optional[bool]:
+    """
+    Returns the cached validity of a URL without any network call, None if unknown
+    """
+    return url_cache.get(url)
+
+
+async def validate_url(url: str) -> bool:
+    """
+    Returns whether a URL is valid, from cache or by checking it. Concurrent
+    callers for the same URL share one check, and failures are cached for
+    URL_VALIDATION_NEGATIVE_TTL so dead links are not rechecked on every card.
+    """
+    cached = url_cache.get(url)
+    if cached is not None:
+        return cached
+
+    return await asyncio.shield(_start_check(url))
+
+
+def _start_check(url: str) -> asyncio.Future:
+    pending = _pending.get(url)
+    if pending is None:
+        pending = asyncio.ensure_future(_check_and_cache(url))
+        _pending[url] = pending
+        pending.add_done_callback(lambda _: _pending.pop(url, None))
+    return pending
+
+
+async def _check_and_cache(url: str) -> bool:
+    metrics.increment("url_validation_checks")
+    valid = await run_blocking(check_url, url)
+    url_cache.set(
+        url, valid, ttl=URL_VALIDATION_TTL if valid else URL_VALIDATION_NEGATIVE_TTL
+    )
+    return valid
+
+
+async def validate_urls(urls: Iterable[str]) -> Dict[str, bool]:
+    """
+    Validates URLs concurrently
+
+    Args:
+        urls (Iterable[str]): URLs to validate
+
+    Returns:
+        Dict[str, bool]: validity of each URL
+    """
+    urls = list(dict.fromkeys(urls))
+    results = await asyncio.gather(*(validate_url(url) for url in urls))
+    return dict(zip(urls, results))
+
+
+def request_validation(urls: Iterable[str]) -> Dict[str, Optional[bool]]:
+    """
+    Returns what is already known about each URL without waiting, starting
+    background checks for the rest. Must be called from the event loop.
+
+    Args:
+        urls (Iterable[str]): URLs to validate
+
+    Returns:
+        Dict[str, Optional[bool]]: validity of each URL, None while still pending
+    """
+    statuses = {}
+    for url in dict.fromkeys(urls):
+        statuses[url] = url_cache.get(url)
+        if statuses[url] is None:
+            _start_check(url)
+    return statuses
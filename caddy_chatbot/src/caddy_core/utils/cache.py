@@ -0,0 +1,131 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+from caddy_core.utils.monitoring import metrics
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache with per-entry expiry, reporting hits and misses on /metrics
+
+    Args:
+        name (str): cache name used in metrics
+        max_size (int): entries kept before the least recently used is evicted
+        ttl (float): seconds an entry lives, None for no expiry
+        sliding (bool): reset an entry's expiry whenever it is read, so only idle
+            entries expire
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_size: int = 1024,
+        ttl: Optional[float] = None,
+        sliding: bool = False,
+    ):
+        self.name = name
+        self.max_size = max_size
+        self.ttl = ttl
+        self.sliding = sliding
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        metrics.register_collector(f"{name}_cache", self.stats)
+
+    def _expiry(self, ttl: Optional[float]) -> Optional[float]:
+        ttl = self.ttl if ttl is None else ttl
+        return time.monotonic() + ttl if ttl is not None else None
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is not _MISSING:
+                value, expires_at, ttl = entry
+                if expires_at is not None and expires_at <= time.monotonic():
+                    del self._entries[key]
+                    self.evictions += 1
+                else:
+                    self._entries.move_to_end(key)
+                    if self.sliding:
+                        self._entries[key] = (value, self._expiry(ttl), ttl)
+                    self.hits += 1
+                    return value
+            self.misses += 1
+            return default
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        with self._lock:
+            self._entries[key] = (value, self._expiry(ttl), ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_create(self, key: Hashable, factory: Callable[[], Any]) -> Any:
+        """
+        Returns the cached value, building and storing it with factory on a miss.
+        The factory runs outside the lock, if two callers race the first stored wins
+        """
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+
+        value = factory()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                return entry[0]
+        self.set(key, value)
+        return value
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            return entry[0] if entry is not None else default
+
+    def evict_expired(self) -> int:
+        now = time.monotonic()
+        with self._lock:
+            expired = [
+                key
+                for key, (_, expires_at, _) in self._entries.items()
+                if expires_at is not None and expires_at <= now
+            ]
+            for key in expired:
+                del self._entries[key]
+            self.evictions += len(expired)
+        return len(expired)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def keys(self):
+        with self._lock:
+            return list(self._entries.keys())
+
+    def values(self):
+        with self._lock:
+            return [entry[0] for entry in self._entries.values()]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
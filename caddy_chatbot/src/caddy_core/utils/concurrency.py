@@ -0,0 +1,108 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Coroutine, Optional
+
+from caddy_core.utils.monitoring import logger, metrics
+
+BLOCKING_IO_WORKERS = int(os.getenv("BLOCKING_IO_WORKERS", 400))
+
+# Neither Bedrock nor DynamoDB has a native async client here, langchain's astream,
+# ainvoke and aembed_* run on the same default executor as run_blocking, holding a
+# thread for each chunk wait. A message holds one thread on its answer stream and
+# at most one more on retrieval or a DynamoDB or chat call alongside it, so
+# in-flight messages are capped at BLOCKING_IO_WORKERS / THREADS_PER_MESSAGE and
+# admitted messages never queue for a thread
+THREADS_PER_MESSAGE = 2
+MESSAGE_LIMIT = max(1, BLOCKING_IO_WORKERS // THREADS_PER_MESSAGE)
+MAX_CONCURRENT_MESSAGES = min(
+    int(os.getenv("MAX_CONCURRENT_MESSAGES", MESSAGE_LIMIT)), MESSAGE_LIMIT
+)
+
+message_slots = asyncio.Semaphore(MAX_CONCURRENT_MESSAGES)
+background_tasks = set()
+
+
+def configure_event_loop(loop: asyncio.AbstractEventLoop):
+    """
+    Sizes the default executor used by run_blocking and langchain's async Bedrock
+    calls, which together bound the messages in flight
+    """
+    loop.set_default_executor(
+        ThreadPoolExecutor(
+            max_workers=BLOCKING_IO_WORKERS, thread_name_prefix="caddy-blocking-io"
+        )
+    )
+    logger.info(
+        f"Message pipeline limited to {MAX_CONCURRENT_MESSAGES} concurrent messages, "
+        f"{BLOCKING_IO_WORKERS} blocking I/O workers"
+    )
+
+
+async def run_blocking(func: Callable, *args: Any, **kwargs: Any) -> Any:
+    """
+    Runs a blocking call (boto3, googleapiclient) on the executor without blocking the event loop
+    """
+    return await asyncio.to_thread(func, *args, **kwargs)
+
+
+async def _run_with_slot(
+    coroutine: Coroutine,
+    name: str,
+    on_failure: Optional[Callable[[], Awaitable[Any]]] = None,
+):
+    metrics.adjust_gauge("messages_queued", 1)
+    async with message_slots:
+        metrics.adjust_gauge("messages_queued", -1)
+        metrics.adjust_gauge("messages_in_flight", 1)
+        try:
+            await coroutine
+            metrics.increment("messages_completed")
+        except Exception as error:
+            metrics.increment("messages_failed")
+            logger.error(f"Message task {name} failed: {error}")
+            if on_failure is not None:
+                try:
+                    await on_failure()
+                except Exception as notify_error:
+                    logger.error(
+                        f"Message task {name} failure not reported: {notify_error}"
+                    )
+        finally:
+            metrics.adjust_gauge("messages_in_flight", -1)
+
+
+def schedule_message(
+    coroutine: Coroutine,
+    name: str = "message",
+    on_failure: Optional[Callable[[], Awaitable[Any]]] = None,
+) -> asyncio.Task:
+    """
+    Schedules a message pipeline coroutine on the running event loop, capped at
+    MAX_CONCURRENT_MESSAGES in flight with the remainder queued
+
+    Args:
+        coroutine (Coroutine): the pipeline coroutine to run
+        name (str): task name used in logs
+        on_failure (Callable): coroutine function called if the pipeline raises,
+            to tell the adviser their message failed
+
+    Returns:
+        asyncio.Task: the scheduled task
+    """
+    task = asyncio.create_task(_run_with_slot(coroutine, name, on_failure), name=name)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+
+async def drain_messages(timeout: float = 30):
+    """
+    Waits for in-flight message tasks to finish, used on shutdown
+    """
+    if not background_tasks:
+        return
+    logger.info(f"Waiting for {len(background_tasks)} in-flight messages")
+    _, pending = await asyncio.wait(list(background_tasks), timeout=timeout)
+    for task in pending:
+        task.cancel()
@@ -1,6 +1,8 @@
 import logging
 import sys
 import os
+import threading
+from collections import defaultdict
 
 debug_enabled = os.environ.get("DEBUG", False)
 logger_level = logging.INFO
@@ -53,3 +55,66 @@ def setup_logger(name, level=logger_level):
 
 
 logger = setup_logger("CADDY")
+
+
+class Metrics:
+    """
+    Thread-safe in-process counters, gauges and timings exposed on /metrics
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = defaultdict(float)
+        self._gauges = {}
+        self._timings = {}
+        self._collectors = {}
+
+    def increment(self, name: str, value: float = 1):
+        with self._lock:
+            self._counters[name] += value
+
+    def set_gauge(self, name: str, value: float):
+        with self._lock:
+            self._gauges[name] = value
+
+    def adjust_gauge(self, name: str, delta: float):
+        with self._lock:
+            self._gauges[name] = self._gauges.get(name, 0) + delta
+
+    def observe(self, name: str, value: float):
+        """
+        Records a timing (or any other sample) as count, total and max
+        """
+        with self._lock:
+            timing = self._timings.setdefault(
+                name, {"count": 0, "total": 0.0, "max": 0.0}
+            )
+            timing["count"] += 1
+            timing["total"] += value
+            timing["max"] = max(timing["max"], value)
+
+    def register_collector(self, name: str, collector):
+        """
+        Registers a callable evaluated on every snapshot, for stats owned elsewhere
+        """
+        with self._lock:
+            self._collectors[name] = collector
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            snapshot = {
+                "counters": dict(self._counters),
+                "gauges": dict(self._gauges),
+                "timings": {name: dict(t) for name, t in self._timings.items()},
+            }
+            collectors = dict(self._collectors)
+
+        for name, collector in collectors.items():
+            try:
+                snapshot[name] = collector()
+            except Exception as error:
+                snapshot[name] = {"error": str(error)}
+        return snapshot
+
+
+metrics = Metrics()
@@ -4,26 +4,29 @@ import boto3
 from caddy_core.utils.monitoring import logger
 from caddy_core.services.router import get_route
 
+prompts_table = boto3.resource("dynamodb").Table(os.getenv("PROMPTS_TABLE_NAME"))
 
-def get_prompt(prompt_name):
-    dynamodb = boto3.resource("dynamodb")
-    table = dynamodb.Table(os.getenv("PROMPTS_TABLE_NAME"))
 
-    response = table.get_item(Key={"PromptName": prompt_name})
+def get_prompt(prompt_name):
+    response = prompts_table.get_item(Key={"PromptName": prompt_name})
     logger.info(f"Fetched prompt: {prompt_name}")
     return response["Item"]["Prompt"] if "Item" in response else None
 
 
-def retrieve_route_specific_augmentation(query):
+def get_route_name(query):
     route = get_route(query).name
     logger.info(f"Route returned: {route}")
+    return route
 
-    if route:
-        prompt_name = f"{route.upper()}_PROMPT"
-        route_specific_augmentation = get_prompt(prompt_name)
 
+def get_route_prompt_name(route):
     if route is None:
         logger.info("Route not found, using fallback prompt")
-        route_specific_augmentation = get_prompt("FALLBACK_PROMPT")
+        return "FALLBACK_PROMPT"
+    return f"{route.upper()}_PROMPT"
 
+
+def retrieve_route_specific_augmentation(query):
+    route = get_route_name(query)
+    route_specific_augmentation = get_prompt(get_route_prompt_name(route))
     return route_specific_augmentation, route
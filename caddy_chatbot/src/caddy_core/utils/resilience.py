@@ -0,0 +1,304 @@
+import asyncio
+import os
+import random
+import threading
+import time
+from collections import deque
+from typing import (
+    Any,
+    AsyncIterable,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    Optional,
+)
+
+from caddy_core.models import CircuitOpenError
+from caddy_core.utils.monitoring import logger, metrics
+
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", 5))
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", 30))
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", 4))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", 0.5))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", 10))
+RETRY_BUDGET_RATIO = float(os.getenv("RETRY_BUDGET_RATIO", 0.2))
+RETRY_BUDGET_MIN_RETRIES = int(os.getenv("RETRY_BUDGET_MIN_RETRIES", 10))
+RETRY_BUDGET_WINDOW = float(os.getenv("RETRY_BUDGET_WINDOW", 60))
+
+_breakers: Dict[str, "CircuitBreaker"] = {}
+
+
+class CircuitBreaker:
+    """
+    Fails calls fast once a dependency keeps failing.
+
+    After failure_threshold consecutive failures the breaker opens and every call
+    raises CircuitOpenError without touching the dependency. Once reset_timeout has
+    passed a single probe call is let through (half open), closing the breaker on
+    success or reopening it on failure. Use as an async context manager around
+    each call.
+
+    Args:
+        name (str): dependency name used in logs and metrics
+        failure_threshold (int): consecutive failures that open the breaker
+        reset_timeout (float): seconds the breaker stays open before probing
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+        reset_timeout: float = BREAKER_RESET_TIMEOUT,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+        _breakers[name] = self
+
+    def _transition(self, state: str):
+        if state != self.state:
+            logger.warning(f"Circuit breaker {self.name} {self.state} -> {state}")
+            metrics.increment(f"{self.name}_breaker_{state}")
+            self.state = state
+
+    def before_call(self):
+        """
+        Raises CircuitOpenError if the call should not reach the dependency
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+            if (
+                self.state == self.OPEN
+                and time.monotonic() - self.opened_at >= self.reset_timeout
+            ):
+                self._transition(self.HALF_OPEN)
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return
+        metrics.increment(f"{self.name}_breaker_rejected")
+        raise CircuitOpenError(f"{self.name} circuit breaker is open")
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._probing = False
+            self._transition(self.CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                self._transition(self.OPEN)
+            self._probing = False
+
+    def release(self):
+        """
+        Releases a probe slot without recording an outcome, for cancelled calls
+        """
+        with self._lock:
+            self._probing = False
+
+    async def __aenter__(self):
+        self.before_call()
+        return self
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.record_success()
+        elif issubclass(exc_type, Exception):
+            self.record_failure()
+        else:
+            self.release()
+        return False
+
+    async def guard_stream(self, stream: AsyncIterable) -> AsyncIterator:
+        """
+        Yields from stream as a single call, only errors raised by the stream
+        itself count as failures, not errors raised by the consumer between chunks.
+        Close it with contextlib.aclosing so an early exit closes the stream.
+
+        Args:
+            stream (AsyncIterable): the dependency's response stream
+
+        Yields:
+            Any: each chunk of the stream
+        """
+        self.before_call()
+        iterator = stream.__aiter__()
+        received = False
+        recorded = False
+        try:
+            while True:
+                try:
+                    chunk = await iterator.__anext__()
+                except StopAsyncIteration:
+                    break
+                except Exception:
+                    recorded = True
+                    self.record_failure()
+                    raise
+                received = True
+                yield chunk
+            recorded = True
+            self.record_success()
+        finally:
+            if not recorded and received:
+                # The consumer stopped early after the dependency had answered
+                self.record_success()
+            elif not recorded:
+                self.release()
+            aclose = getattr(iterator, "aclose", None)
+            if aclose is not None:
+                await aclose()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.failures,
+                "failure_threshold": self.failure_threshold,
+            }
+
+
+class RetryBudget:
+    """
+    Caps retries to a fraction of recent requests, so retries cannot multiply load
+    on a dependency that is already struggling
+
+    Args:
+        ratio (float): retries allowed per request in the window
+        min_retries (int): retries always allowed in the window, for low traffic
+        window (float): seconds of history considered
+    """
+
+    def __init__(
+        self,
+        ratio: float = RETRY_BUDGET_RATIO,
+        min_retries: int = RETRY_BUDGET_MIN_RETRIES,
+        window: float = RETRY_BUDGET_WINDOW,
+    ):
+        self.ratio = ratio
+        self.min_retries = min_retries
+        self.window = window
+        self._requests = deque()
+        self._retries = deque()
+        self._lock = threading.Lock()
+
+    def _trim(self, now: float):
+        for events in (self._requests, self._retries):
+            while events and events[0] <= now - self.window:
+                events.popleft()
+
+    def record_request(self):
+        with self._lock:
+            now = time.monotonic()
+            self._trim(now)
+            self._requests.append(now)
+
+    def try_spend(self) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            self._trim(now)
+            allowed = self.min_retries + self.ratio * len(self._requests)
+            if len(self._retries) >= allowed:
+                return False
+            self._retries.append(now)
+            return True
+
+
+class RetryPolicy:
+    """
+    Retry attempts with decorrelated jitter backoff, drawing on a retry budget
+
+    Args:
+        name (str): operation name used in metrics
+        max_attempts (int): attempts including the first
+        base_delay (float): minimum delay between attempts in seconds
+        max_delay (float): maximum delay between attempts in seconds
+        budget (RetryBudget): budget retries are drawn from
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_attempts: int = RETRY_MAX_ATTEMPTS,
+        base_delay: float = RETRY_BASE_DELAY,
+        max_delay: float = RETRY_MAX_DELAY,
+        budget: Optional[RetryBudget] = None,
+    ):
+        self.name = name
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget or RetryBudget()
+
+    def next_delay(self, previous: float) -> float:
+        return min(
+            self.max_delay, random.uniform(self.base_delay, max(previous, 0) * 3)
+        )
+
+
+async def retry_async(
+    operation: Callable[[], Awaitable[Any]],
+    policy: RetryPolicy,
+    on_retry: Optional[Callable[[int, Exception, float], Awaitable[None]]] = None,
+) -> Any:
+    """
+    Awaits operation, retrying failures with backoff while the policy and its budget
+    allow. CircuitOpenError is never retried so an open breaker fails fast.
+
+    Args:
+        operation (Callable): coroutine function making one attempt
+        policy (RetryPolicy): retry policy to follow
+        on_retry (Callable): coroutine function called with the attempt number,
+            error and delay before each retry
+
+    Returns:
+        Any: result of the first successful attempt
+    """
+    policy.budget.record_request()
+    delay = policy.base_delay
+    for attempt in range(1, policy.max_attempts + 1):
+        try:
+            return await operation()
+        except CircuitOpenError:
+            raise
+        except Exception as error:
+            if attempt == policy.max_attempts:
+                metrics.increment(f"{policy.name}_retries_exhausted")
+                raise
+            if not policy.budget.try_spend():
+                metrics.increment(f"{policy.name}_retry_budget_exhausted")
+                logger.warning(f"{policy.name} retry budget exhausted")
+                raise
+            delay = policy.next_delay(delay)
+            metrics.increment(f"{policy.name}_retries")
+            logger.warning(
+                f"{policy.name} attempt {attempt} failed with error: {error}, "
+                f"retrying in {delay:.2f}s"
+            )
+            if on_retry is not None:
+                await on_retry(attempt, error, delay)
+            await asyncio.sleep(delay)
+
+
+def breaker_stats() -> dict:
+    return {name: breaker.stats() for name, breaker in list(_breakers.items())}
+
+
+metrics.register_collector("circuit_breakers", breaker_stats)
+
+bedrock_breaker = CircuitBreaker("bedrock")
+opensearch_breaker = CircuitBreaker("opensearch")
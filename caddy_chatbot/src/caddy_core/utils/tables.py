@@ -14,3 +14,18 @@ users_table = dynamodb.Table(os.getenv("USERS_TABLE_NAME"))
 responses_table = dynamodb.Table(os.getenv("RESPONSES_TABLE_NAME"))
 offices_table = dynamodb.Table(os.getenv("OFFICES_TABLE_NAME"))
 evaluation_table = dynamodb.Table(os.getenv("EVALUATION_TABLE_NAME"))
+
+# Optional shared query rewrite cache, rows expire through DynamoDB TTL on expiresAt
+rewrite_cache_table = (
+    dynamodb.Table(os.getenv("REWRITE_CACHE_TABLE_NAME"))
+    if os.getenv("REWRITE_CACHE_TABLE_NAME")
+    else None
+)
+
+# Optional index refresh counters, bumped by ingestion and polled by the serving
+# retrieval caches
+retrieval_generations_table = (
+    dynamodb.Table(os.getenv("RETRIEVAL_GENERATIONS_TABLE_NAME"))
+    if os.getenv("RETRIEVAL_GENERATIONS_TABLE_NAME")
+    else None
+)
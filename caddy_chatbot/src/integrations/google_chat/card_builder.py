@@ -0,0 +1,192 @@
+import re
+from typing import Any, Dict, List, Optional, Union
+from urllib.parse import urlparse, urlunparse
+
+from thefuzz import fuzz
+
+from caddy_core.utils.monitoring import logger
+
+REF_PATTERN = re.compile(r"<ref>((?:SOURCE_URL:)?(http[s]?://[^\s>]+))</ref>")
+REF_OPEN = "<ref>"
+REF_CLOSE = "</ref>"
+
+
+class Citation:
+    """
+    A cited URL resolved against the context sources, with its validity once known
+    """
+
+    __slots__ = ("full_url", "use_url", "full_use_url", "resource", "valid")
+
+    def __init__(self, full_url: str, context_sources: List[str]):
+        self.full_url = full_url
+        url_to_check = full_url.replace("SOURCE_URL:", "")
+
+        url_parts = urlparse(url_to_check)
+        base_url = urlunparse(url_parts._replace(fragment=""))
+        fragment = url_parts.fragment
+
+        self.use_url = base_url
+        if context_sources:
+            best_match = max(context_sources, key=lambda x: fuzz.ratio(base_url, x))
+            match_score = fuzz.ratio(base_url, best_match)
+
+            logger.debug(f"Cited: {url_to_check}")
+            logger.debug(f"Best match: {best_match}")
+            logger.debug(f"Match score: {match_score}")
+
+            if match_score > 95:
+                self.use_url = best_match
+
+        self.full_use_url = f"{self.use_url}#{fragment}" if fragment else self.use_url
+
+        domain = urlparse(self.use_url).netloc
+        if domain.startswith("www."):
+            domain = domain[4:]
+        if "advisernet" in self.use_url:
+            domain = "advisernet"
+        self.resource = domain
+
+        self.valid: Optional[bool] = True if self.use_url in context_sources else None
+
+
+class ResponseCardBuilder:
+    """
+    Builds the response card for a streamed answer incrementally.
+
+    Each update only parses the text added since the last one. Complete citations
+    are resolved against the context sources once and kept, while a citation still
+    being streamed is held back until its closing tag arrives. If the answer is
+    rewritten rather than extended (a role played reply cut off) the builder starts
+    over from the new text.
+
+    Args:
+        context_sources (List[str]): source URLs of the retrieved context
+    """
+
+    def __init__(self, context_sources: List[str]):
+        self.context_sources = context_sources
+        self._reset()
+
+    def _reset(self):
+        self._parsed = ""
+        self._segments: List[Union[str, Citation]] = []
+        self._citations: Dict[str, Citation] = {}
+
+    def update(self, llm_response: str, final: bool = False):
+        """
+        Parses whatever the answer gained since the previous update
+
+        Args:
+            llm_response (str): answer so far
+            final (bool): the answer is complete, so nothing is held back
+        """
+        if not llm_response.startswith(self._parsed):
+            self._reset()
+
+        new_text = llm_response[len(self._parsed) :]
+        consumed = self._parse(new_text, final)
+        self._parsed += new_text[:consumed]
+
+    def _parse(self, text: str, final: bool) -> int:
+        position = 0
+        for match in REF_PATTERN.finditer(text):
+            if match.start() > position:
+                self._segments.append(text[position : match.start()])
+            full_url = match.group(1)
+            citation = self._citations.get(full_url)
+            if citation is None:
+                citation = Citation(full_url, self.context_sources)
+                self._citations[full_url] = citation
+            self._segments.append(citation)
+            position = match.end()
+
+        remainder = text[position:]
+        safe = len(remainder) if final else self._safe_length(remainder)
+        if safe:
+            self._segments.append(remainder[:safe])
+        return position + safe
+
+    @staticmethod
+    def _safe_length(remainder: str) -> int:
+        """
+        Length of remainder that can be committed, holding back a citation that
+        is still open and trailing whitespace, which the answer may later strip
+        """
+        safe = len(remainder.rstrip())
+
+        open_index = remainder.rfind(REF_OPEN)
+        if open_index != -1:
+            opened = remainder[open_index + len(REF_OPEN) :]
+            if REF_CLOSE not in opened and not any(c.isspace() for c in opened):
+                safe = min(safe, open_index)
+
+        for length in range(len(REF_OPEN) - 1, 0, -1):
+            if remainder.endswith(REF_OPEN[:length]):
+                safe = min(safe, len(remainder) - length)
+                break
+        return safe
+
+    def pending_urls(self) -> List[str]:
+        """
+        URLs of citations whose validity is not known yet
+        """
+        return list(
+            dict.fromkeys(
+                citation.use_url
+                for citation in self._citations.values()
+                if citation.valid is None
+            )
+        )
+
+    def set_validity(self, url_validity: Dict[str, Optional[bool]]):
+        for citation in self._citations.values():
+            if citation.valid is None:
+                citation.valid = url_validity.get(citation.use_url)
+
+    def card(self) -> Dict[str, Any]:
+        """
+        Renders the Google Chat card. Citations not known to be valid are left out
+
+        Returns:
+            Google Chat Card
+        """
+        text_parts = []
+        reference_widgets = []
+        refs: Dict[str, int] = {}
+
+        for segment in self._segments:
+            if isinstance(segment, str):
+                text_parts.append(segment)
+                continue
+            if not segment.valid:
+                continue
+
+            ref = refs.get(segment.full_url)
+            if ref is None:
+                ref = refs[segment.full_url] = len(refs) + 1
+                reference_widgets.append(
+                    {
+                        "textParagraph": {
+                            "text": f'<a href="{segment.full_use_url}">[{ref}- {segment.resource}] {segment.full_use_url}</a>'
+                        }
+                    }
+                )
+            text_parts.append(
+                f'<a href="{segment.full_use_url}">[{ref} - {segment.resource}]</a>'
+            )
+
+        sections = [{"widgets": [{"textParagraph": {"text": "".join(text_parts)}}]}]
+        if reference_widgets:
+            sections.append({"header": "Reference links", "widgets": reference_widgets})
+
+        return {
+            "cardsV2": [
+                {
+                    "cardId": "aiResponseCard",
+                    "card": {
+                        "sections": sections,
+                    },
+                },
+            ],
+        }
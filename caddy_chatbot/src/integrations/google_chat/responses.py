@@ -474,6 +474,138 @@ def approval_json_widget(approver: str, supervisor_notes: str) -> dict:
     return widget
 
 
+def approved_answer_offer(approved_answer, message_query) -> dict:
+    """
+    Offers an adviser the approved answer to a similar question before Caddy
+    generates a new one
+
+    Args:
+        approved_answer (ApprovedAnswer): the matched approved answer
+        message_query (UserMessage): the adviser message
+
+    Returns:
+        card (dict)
+    """
+    similarity = f"{approved_answer.similarity:.4f}"
+    approved_thread_id = approved_answer.thread_id
+    card = {
+        "cardsV2": [
+            {
+                "cardId": "approvedAnswerOffer",
+                "card": {
+                    "sections": [
+                        {
+                            "widgets": [
+                                {
+                                    "decoratedText": {
+                                        "icon": {"materialIcon": {"name": "history"}},
+                                        "topLabel": "Similar question already approved",
+                                        "text": '<font color="#004f88"><b>Approved answer available</b></font>',
+                                        "wrapText": True,
+                                    }
+                                },
+                                {
+                                    "textParagraph": {
+                                        "text": f"A supervisor in your office approved an answer to a {round(approved_answer.similarity * 100)}% similar question. Use that answer now, or ask Caddy for a new one."
+                                    }
+                                },
+                                {
+                                    "buttonList": {
+                                        "buttons": [
+                                            {
+                                                "text": "View approved answer",
+                                                "onClick": {
+                                                    "action": {
+                                                        "function": "view_approved_answer",
+                                                        "interaction": "OPEN_DIALOG",
+                                                        "parameters": [
+                                                            {
+                                                                "key": "approved_thread_id",
+                                                                "value": approved_thread_id,
+                                                            },
+                                                            {
+                                                                "key": "similarity",
+                                                                "value": similarity,
+                                                            },
+                                                        ],
+                                                    }
+                                                },
+                                            },
+                                            {
+                                                "text": "Use approved answer",
+                                                "onClick": {
+                                                    "action": {
+                                                        "function": "use_approved_answer",
+                                                        "parameters": [
+                                                            {
+                                                                "key": "approved_thread_id",
+                                                                "value": approved_thread_id,
+                                                            },
+                                                            {
+                                                                "key": "similarity",
+                                                                "value": similarity,
+                                                            },
+                                                            {
+                                                                "key": "message_query",
+                                                                "value": message_query.model_dump_json(),
+                                                            },
+                                                        ],
+                                                    }
+                                                },
+                                            },
+                                            {
+                                                "text": "Ask Caddy",
+                                                "onClick": {
+                                                    "action": {
+                                                        "function": "ask_caddy",
+                                                        "parameters": [
+                                                            {
+                                                                "key": "message_query",
+                                                                "value": message_query.model_dump_json(),
+                                                            },
+                                                        ],
+                                                    }
+                                                },
+                                            },
+                                        ]
+                                    }
+                                },
+                            ]
+                        }
+                    ]
+                },
+            },
+        ],
+    }
+    return card
+
+
+def approved_answer_widget(approved_answer) -> dict:
+    """
+    Heads a reused approved answer, without the question it was approved for as
+    that may carry another adviser's client details
+
+    Args:
+        approved_answer (ApprovedAnswer): the accepted approved answer
+
+    Response:
+        widget (dict)
+    """
+    approver = approved_answer.approver_email or "a supervisor"
+    return {
+        "widgets": [
+            {
+                "decoratedText": {
+                    "icon": {"materialIcon": {"name": "verified"}},
+                    "text": '<font color="#00ba01"><b>Previously approved answer</b></font>',
+                    "bottomLabel": f"Approved by {approver}",
+                    "wrapText": True,
+                },
+            }
+        ]
+    }
+
+
 def supervisor_request_rejected(user: str, initial_query: str) -> dict:
     """
     Creates a supervisor request rejected card
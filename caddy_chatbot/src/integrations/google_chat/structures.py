@@ -1,28 +1,27 @@
 import os
 import json
-import re
-import requests
+from functools import partial
 from typing import Dict, Any, List, Tuple, Optional
 from datetime import datetime
-from threading import Thread
 from caddy_core.models import (
     CaddyMessageEvent,
+    UserMessage,
     UserNotEnrolledException,
     ApprovalEvent,
+    ApprovedAnswer,
 )
-from caddy_core.services import enrolment
-from caddy_core.utils.monitoring import logger
+from caddy_core.services import enrolment, url_validation
+from caddy_core.utils.monitoring import logger, metrics
 from caddy_core import components as caddy
 from caddy_core.services.anonymise import analyse
+from caddy_core.services.approved_answers import approved_answers
+from caddy_core.services.llm import get_chat_model
 from caddy_core.services.survey import get_survey, check_if_survey_required
+from caddy_core.utils.concurrency import run_blocking, schedule_message
 from integrations.google_chat import content, responses
+from integrations.google_chat.card_builder import ResponseCardBuilder
 from googleapiclient.discovery import build
 from integrations.google_chat.auth import get_google_creds
-from langchain_aws import ChatBedrock
-
-from urllib.parse import urlparse, urlunparse
-
-from thefuzz import fuzz
 
 
 class GoogleChat:
@@ -92,15 +91,20 @@ class GoogleChat:
         if included_in_rct and await self.check_existing_call(event, user_record):
             return self.responses.NO_CONTENT
 
-        caddy_message = self.format_message(event)
+        caddy_message = await run_blocking(self.format_message, event)
         if caddy_message == "PII Detected":
             return self.responses.NO_CONTENT
 
-        process_message_thread = Thread(
-            target=caddy.handle_message,
-            kwargs={"caddy_message": caddy_message, "chat_client": self},
+        schedule_message(
+            caddy.handle_message(caddy_message=caddy_message, chat_client=self),
+            name=f"message-{caddy_message.message_id}",
+            on_failure=partial(
+                caddy.notify_message_failed,
+                self,
+                caddy_message.space_id,
+                caddy_message.message_id,
+            ),
         )
-        process_message_thread.start()
         return self.responses.ACCEPTED
 
     async def handle_card_clicked(self, event: Dict[str, Any]) -> Dict[str, Any]:
@@ -127,6 +131,12 @@ class GoogleChat:
                 return await self.finalise_caddy_call(event)
             case "convert_to_client_friendly":
                 return await self.convert_to_client_friendly(event)
+            case "view_approved_answer":
+                return await self.view_approved_answer(event)
+            case "use_approved_answer":
+                return await self.handle_use_approved_answer(event)
+            case "ask_caddy":
+                return await self.handle_ask_caddy(event)
             case _:
                 logger.warning(f"Unhandled card action: {action_name}")
                 return self.responses.NO_CONTENT
@@ -414,12 +424,17 @@ class GoogleChat:
         """
         event = json.loads(event["common"]["parameters"]["message_event"])
         event["proceed"] = True
-        caddy_message = self.format_message(event)
-        process_message_thread = Thread(
-            target=caddy.handle_message,
-            kwargs={"caddy_message": caddy_message, "chat_client": self},
+        caddy_message = await run_blocking(self.format_message, event)
+        schedule_message(
+            caddy.handle_message(caddy_message=caddy_message, chat_client=self),
+            name=f"message-{caddy_message.message_id}",
+            on_failure=partial(
+                caddy.notify_message_failed,
+                self,
+                caddy_message.space_id,
+                caddy_message.message_id,
+            ),
         )
-        process_message_thread.start()
         return self.responses.ACCEPTED
 
     async def handle_control_group_forward(
@@ -479,12 +494,17 @@ class GoogleChat:
         event = json.loads(event["common"]["parameters"]["message_event"])
         event["message"]["text"] = edited_message
         event["proceed"] = True
-        caddy_message = self.format_message(event)
-        process_message_thread = Thread(
-            target=caddy.handle_message,
-            kwargs={"caddy_message": caddy_message, "chat_client": self},
+        caddy_message = await run_blocking(self.format_message, event)
+        schedule_message(
+            caddy.handle_message(caddy_message=caddy_message, chat_client=self),
+            name=f"message-{caddy_message.message_id}",
+            on_failure=partial(
+                caddy.notify_message_failed,
+                self,
+                caddy_message.space_id,
+                caddy_message.message_id,
+            ),
         )
-        process_message_thread.start()
         return self.responses.ACCEPTED
 
     async def continue_existing_interaction(
@@ -498,7 +518,7 @@ class GoogleChat:
             message_id=event["message"]["name"].split("/")[3],
             card=self.messages.CONTINUE_EXISTING_INTERACTION,
         )
-        return self.handle_proceed_query(event)
+        return await self.handle_proceed_query(event)
 
     async def end_existing_interaction(self, event: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -842,32 +862,7 @@ class GoogleChat:
         ]["value"][0]
 
         approved_card = self.create_approved_card(card, approver, supervisor_notes)
-
-        client_friendly_button = {
-            "buttonList": {
-                "buttons": [
-                    {
-                        "text": "Convert to Client Friendly",
-                        "onClick": {
-                            "action": {
-                                "function": "convert_to_client_friendly",
-                                "interaction": "OPEN_DIALOG",
-                                "parameters": [
-                                    {
-                                        "key": "card_content",
-                                        "value": json.dumps(approved_card),
-                                    },
-                                ],
-                            }
-                        },
-                    }
-                ]
-            }
-        }
-
-        approved_card["cardsV2"][0]["card"]["sections"].append(
-            {"widgets": [client_friendly_button]}
-        )
+        approved_card = self.append_client_friendly_button(approved_card)
 
         domain = user_email.split("@")[1]
         _, office = enrolment.check_domain_status(domain)
@@ -993,6 +988,55 @@ class GoogleChat:
         )
         return card
 
+    def append_client_friendly_button(self, card: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Adds the convert to client friendly button to an approved card
+        """
+        client_friendly_button = {
+            "buttonList": {
+                "buttons": [
+                    {
+                        "text": "Convert to Client Friendly",
+                        "onClick": {
+                            "action": {
+                                "function": "convert_to_client_friendly",
+                                "interaction": "OPEN_DIALOG",
+                                "parameters": [
+                                    {
+                                        "key": "card_content",
+                                        "value": json.dumps(card),
+                                    },
+                                ],
+                            }
+                        },
+                    }
+                ]
+            }
+        }
+
+        card["cardsV2"][0]["card"]["sections"].append(
+            {"widgets": [client_friendly_button]}
+        )
+        return card
+
+    def create_approved_answer_card(
+        self, approved_answer: ApprovedAnswer
+    ) -> Dict[str, Any]:
+        """
+        Renders a previously approved answer for an adviser who accepted it
+
+        Args:
+            approved_answer (ApprovedAnswer): the accepted approved answer
+
+        Returns:
+            Google Chat Card
+        """
+        card = self.create_card(approved_answer.answer, approved_answer.context)
+        card["cardsV2"][0]["card"]["sections"].insert(
+            0, self.responses.approved_answer_widget(approved_answer)
+        )
+        return self.append_client_friendly_button(card)
+
     def create_updated_supervision_card(
         self,
         supervision_card: Dict[str, Any],
@@ -1100,119 +1144,74 @@ class GoogleChat:
             }
         }
 
-    def create_card(
-        self, llm_response: str, context_sources: List[str]
-    ) -> Dict[str, Any]:
+    def create_card_builder(self, context_sources: List[str]) -> ResponseCardBuilder:
         """
-        Takes in the LLM response and context sources, extracts citations, fuzzy matches them
-        with actual context sources, and adds them as reference links in the Google Chat card
+        Starts an incremental response card for a streamed answer
 
         Args:
-            llm_response: Response from LLM
             context_sources: List of actual source URLs from the context
 
         Returns:
-            Google Chat Card
+            Card builder to pass to build_response_card as the answer grows
         """
-        card = {
-            "cardsV2": [
-                {
-                    "cardId": "aiResponseCard",
-                    "card": {
-                        "sections": [],
-                    },
-                },
-            ],
-        }
-
-        reference_links_section = {"header": "Reference links", "widgets": []}
-
-        urls = re.findall(
-            r"<ref>((?:SOURCE_URL:)?(http[s]?://[^\s>]+))</ref>", llm_response
-        )
-
-        processed_urls = []
-        ref = 0
-
-        for i, (full_url, base_url) in enumerate(urls):
-            if full_url in processed_urls:
-                continue
-
-            url_to_check = full_url.replace("SOURCE_URL:", "")
-
-            url_parts = urlparse(url_to_check)
-            base_url = urlunparse(url_parts._replace(fragment=""))
-            fragment = url_parts.fragment
-
-            best_match = max(context_sources, key=lambda x: fuzz.ratio(base_url, x))
-            match_score = fuzz.ratio(base_url, best_match)
-
-            logger.debug(f"Cited: {url_to_check}")
-            logger.debug(f"Best match: {best_match}")
-            logger.debug(f"Match score: {match_score}")
+        return ResponseCardBuilder(context_sources)
 
-            use_url = best_match if match_score > 95 else base_url
-
-            url_valid = False
-            if use_url in context_sources:
-                url_valid = True
-            else:
-                try:
-                    response = requests.head(use_url, timeout=5, allow_redirects=True)
-                    if response.status_code in [200, 302, 403] or (
-                        "advisernet" in use_url and response.status_code == 302
-                    ):
-                        url_valid = True
-                    else:
-                        logger.warning(
-                            f"URL {use_url} returned status code {response.status_code}"
-                        )
-                except requests.RequestException as e:
-                    logger.error(f"Error checking URL {use_url}: {str(e)}")
-
-            if url_valid:
-                ref += 1
-                parsed_url = urlparse(use_url)
-                domain = parsed_url.netloc
-
-                if domain.startswith("www."):
-                    domain = domain[4:]
-
-                if "advisernet" in use_url:
-                    domain = "advisernet"
-
-                resource = domain
-
-                full_use_url = f"{use_url}#{fragment}" if fragment else use_url
-
-                llm_response = llm_response.replace(
-                    f"<ref>{full_url}</ref>",
-                    f'<a href="{full_use_url}">[{ref} - {resource}]</a>',
-                )
+    async def build_response_card(
+        self,
+        llm_response: str,
+        card_builder: ResponseCardBuilder,
+        streaming: bool = False,
+    ) -> Dict[str, Any]:
+        """
+        Updates the card builder with the answer so far and renders the card, only
+        new text is parsed. Cited URLs are validated concurrently, while streaming
+        it never waits on the network and citations still being checked are left
+        out until a later update
 
-                reference_link = {
-                    "textParagraph": {
-                        "text": f'<a href="{full_use_url}">[{ref}- {resource}] {full_use_url}</a>'
-                    }
-                }
-                reference_links_section["widgets"].append(reference_link)
+        Args:
+            llm_response: Response from LLM so far
+            card_builder: builder from create_card_builder
+            streaming: whether the response is still being generated
 
-                processed_urls.append(full_url)
+        Returns:
+            Google Chat Card
+        """
+        card_builder.update(llm_response, final=not streaming)
+        urls = card_builder.pending_urls()
+        if urls:
+            if streaming:
+                url_validity = url_validation.request_validation(urls)
             else:
-                llm_response = llm_response.replace(f"<ref>{full_url}</ref>", "")
+                url_validity = await url_validation.validate_urls(urls)
+            card_builder.set_validity(url_validity)
+        return card_builder.card()
 
-        llm_response_section = {
-            "widgets": [
-                {"textParagraph": {"text": llm_response}},
-            ],
-        }
-
-        card["cardsV2"][0]["card"]["sections"].append(llm_response_section)
+    def create_card(
+        self,
+        llm_response: str,
+        context_sources: List[str],
+        url_validity: Optional[Dict[str, Optional[bool]]] = None,
+    ) -> Dict[str, Any]:
+        """
+        Takes in the LLM response and context sources, extracts citations, fuzzy matches them
+        with actual context sources, and adds them as reference links in the Google Chat card
 
-        if reference_links_section["widgets"]:
-            card["cardsV2"][0]["card"]["sections"].append(reference_links_section)
+        Args:
+            llm_response: Response from LLM
+            context_sources: List of actual source URLs from the context
+            url_validity: Known validity of cited URLs, URLs missing from it are checked
 
-        return card
+        Returns:
+            Google Chat Card
+        """
+        card_builder = ResponseCardBuilder(context_sources)
+        card_builder.update(llm_response, final=True)
+        url_validity = dict(url_validity or {})
+        for url in card_builder.pending_urls():
+            if url_validity.get(url) is None:
+                url_validity[url] = url_validation.check_url(url)
+        card_builder.set_validity(url_validity)
+        return card_builder.card()
 
     def create_supervision_request_card(
         self, user: str, initial_query: str
@@ -1432,6 +1431,93 @@ class GoogleChat:
             }
         }
 
+    async def view_approved_answer(self, event: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Opens the approved answer offered for an adviser message in a dialog
+        """
+        parameters = event["common"]["parameters"]
+        approved_answer = await run_blocking(
+            approved_answers.get,
+            parameters["approved_thread_id"],
+            event["user"]["email"],
+        )
+        if approved_answer is None:
+            return self.responses.NO_CONTENT
+
+        card = await run_blocking(
+            self.create_card, approved_answer.answer, approved_answer.context
+        )
+        question_answer = "<br><br>".join(
+            widget["textParagraph"]["text"]
+            for section in card["cardsV2"][0]["card"]["sections"]
+            for widget in section["widgets"]
+        )
+        # The original question may carry another adviser's client details
+        return self.similar_question_dialog(
+            similar_question="Previously approved answer",
+            question_answer=question_answer,
+            similarity=round(float(parameters["similarity"]) * 100),
+        )
+
+    async def handle_use_approved_answer(self, event: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Answers the adviser message with the approved answer they accepted
+        """
+        parameters = event["common"]["parameters"]
+        message_query = UserMessage.model_validate_json(parameters["message_query"])
+        approved_answer = await run_blocking(
+            approved_answers.get,
+            parameters["approved_thread_id"],
+            event["user"]["email"],
+        )
+        if approved_answer is None:
+            logger.warning("Accepted approved answer no longer available")
+            schedule_message(
+                caddy.compose_answer(message_query, self),
+                name=f"message-{message_query.message_id}",
+                on_failure=partial(
+                    caddy.notify_message_failed,
+                    self,
+                    message_query.conversation_id,
+                    message_query.message_id,
+                ),
+            )
+            return self.responses.ACCEPTED
+
+        approved_answer.similarity = float(parameters["similarity"])
+        schedule_message(
+            caddy.use_approved_answer(message_query, approved_answer, self),
+            name=f"approved-answer-{message_query.message_id}",
+            on_failure=partial(
+                caddy.notify_message_failed,
+                self,
+                message_query.conversation_id,
+                message_query.message_id,
+            ),
+        )
+        return self.responses.ACCEPTED
+
+    async def handle_ask_caddy(self, event: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Generates a new answer for an adviser message that was offered an
+        approved answer
+        """
+        metrics.increment("approved_answer_declined")
+        message_query = UserMessage.model_validate_json(
+            event["common"]["parameters"]["message_query"]
+        )
+        schedule_message(
+            caddy.compose_answer(message_query, self),
+            name=f"message-{message_query.message_id}",
+            on_failure=partial(
+                caddy.notify_message_failed,
+                self,
+                message_query.conversation_id,
+                message_query.message_id,
+            ),
+        )
+        return self.responses.ACCEPTED
+
     def call_complete_confirmation(self, user: str, user_space: str, thread_id: str):
         """
         Send a call complete confirmation
@@ -1482,11 +1568,7 @@ class GoogleChat:
         """
         card_content = json.loads(event["common"]["parameters"]["card_content"])
 
-        llm = ChatBedrock(
-            model_id=os.getenv("LLM"),
-            region_name="eu-west-3",
-            model_kwargs={"temperature": 0.3, "top_k": 5, "max_tokens": 2000},
-        )
+        llm = get_chat_model("client_friendly")
 
         prompt = f"""
         You are an AI assistant tasked with converting a technical response into a client-friendly letter style version
@@ -1512,7 +1594,7 @@ class GoogleChat:
         Please provide the client-friendly version:
         """
 
-        response = llm.invoke(prompt)
+        response = await llm.ainvoke(prompt)
         client_friendly_content = response.content
 
         return self.client_friendly_dialog(client_friendly_content)
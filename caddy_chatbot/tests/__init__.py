@@ -0,0 +1,5 @@
+import os
+
+# boto3 resources for the DynamoDB tables are created at import, the tests make
+# no AWS requests but boto3 needs a region to create them
+os.environ.setdefault("AWS_DEFAULT_REGION", "eu-west-2")
@@ -0,0 +1,156 @@
+import unittest
+from datetime import datetime, timedelta
+
+from langchain_core.embeddings import Embeddings
+
+from caddy_core.services import approved_answers as module
+from caddy_core.services.approved_answers import ApprovedAnswerIndex
+
+QUESTIONS = {
+    "Can my client claim universal credit?": [1.0, 0.0, 0.0],
+    "Is my client eligible for universal credit?": [0.99, 0.14, 0.0],
+    "How do I appeal a parking fine?": [0.0, 1.0, 0.0],
+    "What is the notice period for eviction?": [0.0, 0.0, 1.0],
+}
+
+
+class FakeEmbeddings(Embeddings):
+    def __init__(self):
+        self.batches = []
+
+    def embed_documents(self, texts):
+        self.batches.append(list(texts))
+        return [QUESTIONS[text] for text in texts]
+
+    def embed_query(self, text):
+        return QUESTIONS[text]
+
+
+class FakeTable:
+    def __init__(self, rows):
+        self.rows = {row["threadId"]: row for row in rows}
+
+    def scan(self, **kwargs):
+        return {"Items": list(self.rows.values())}
+
+    def get_item(self, Key):
+        row = self.rows.get(Key["threadId"])
+        return {"Item": row} if row else {}
+
+
+def approved_row(thread_id, question, user_email="adviser@office-a.org", **extra):
+    return {
+        "threadId": thread_id,
+        "userEmail": user_email,
+        "llmPrompt": question,
+        "llmAnswer": f"answer to {question}",
+        "approved": True,
+        "approvalTimestamp": datetime.now().isoformat(),
+        **extra,
+    }
+
+
+def office_scope(user_email):
+    domain = user_email.split("@")[1]
+    if domain == "unenrolled.org":
+        return None
+    return domain, ("citizensadvice",)
+
+
+class ApprovedAnswerIndexTests(unittest.IsolatedAsyncioTestCase):
+    def index(self, rows, threshold=0.9, max_age_days=0):
+        embeddings = FakeEmbeddings()
+        index = ApprovedAnswerIndex(
+            threshold=threshold,
+            max_age_days=max_age_days,
+            embeddings=embeddings,
+            table=FakeTable(rows),
+        )
+        index._load_scope = office_scope
+        self.addCleanup(index._worker.shutdown)
+        return index, embeddings
+
+    def drain(self, index):
+        index.load()
+        index._worker.submit(lambda: None).result()
+
+    async def test_similar_question_matches_within_scope(self):
+        index, _ = self.index(
+            [approved_row("t1", "Can my client claim universal credit?")]
+        )
+        self.drain(index)
+
+        match = await index.find(
+            "Is my client eligible for universal credit?", "other@office-a.org"
+        )
+        self.assertEqual(match.thread_id, "t1")
+        self.assertGreater(match.similarity, 0.9)
+
+    async def test_answers_are_not_shared_across_offices(self):
+        index, _ = self.index(
+            [approved_row("t1", "Can my client claim universal credit?")]
+        )
+        self.drain(index)
+
+        question = "Is my client eligible for universal credit?"
+        self.assertIsNone(await index.find(question, "adviser@office-b.org"))
+        self.assertIsNone(await index.find(question, "adviser@unenrolled.org"))
+        self.assertIsNone(index.get("t1", "adviser@office-b.org"))
+        self.assertEqual(index.get("t1", "other@office-a.org").thread_id, "t1")
+
+    async def test_dissimilar_question_misses(self):
+        index, _ = self.index(
+            [approved_row("t1", "Can my client claim universal credit?")]
+        )
+        self.drain(index)
+
+        self.assertIsNone(
+            await index.find("How do I appeal a parking fine?", "adviser@office-a.org")
+        )
+
+    async def test_expired_approvals_are_not_offered(self):
+        approved_at = (datetime.now() - timedelta(days=30)).isoformat()
+        index, _ = self.index(
+            [
+                approved_row(
+                    "t1",
+                    "Can my client claim universal credit?",
+                    approvalTimestamp=approved_at,
+                )
+            ],
+            max_age_days=7,
+        )
+        self.drain(index)
+
+        self.assertIsNone(
+            await index.find(
+                "Can my client claim universal credit?", "adviser@office-a.org"
+            )
+        )
+
+    async def test_rejection_removes_answer(self):
+        question = "Can my client claim universal credit?"
+        index, _ = self.index([approved_row("t1", question)])
+        self.drain(index)
+
+        index.record(approved_row("t1", question, approved=False))
+        self.assertIsNone(await index.find(question, "adviser@office-a.org"))
+        self.assertEqual(index.stats()["answers"], 0)
+
+    def test_backfill_embeds_in_batches(self):
+        rows = [
+            approved_row(f"t{i}", question)
+            for i, question in enumerate(list(QUESTIONS) * 40)
+        ]
+        index, embeddings = self.index(rows)
+        self.drain(index)
+
+        self.assertEqual(
+            [len(batch) for batch in embeddings.batches],
+            [module.EMBEDDING_BATCH_SIZE] + [len(rows) - module.EMBEDDING_BATCH_SIZE],
+        )
+        self.assertEqual(index.stats(), {"partitions": 1, "answers": len(rows)})
+
+
+if __name__ == "__main__":
+    unittest.main()
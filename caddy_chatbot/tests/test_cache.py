@@ -0,0 +1,73 @@
+import unittest
+from unittest import mock
+
+from caddy_core.utils.cache import TTLCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TTLCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        patcher = mock.patch("caddy_core.utils.cache.time.monotonic", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_evicts_least_recently_used(self):
+        cache = TTLCache("test_lru", max_size=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+
+        self.assertEqual(cache.keys(), ["a", "c"])
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_entries_expire(self):
+        cache = TTLCache("test_expiry", ttl=10)
+        cache.set("a", 1)
+        cache.set("b", 2, ttl=30)
+        self.clock.now += 20
+
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.get("b"), 2)
+
+    def test_sliding_expiry_keeps_used_entries(self):
+        cache = TTLCache("test_sliding", ttl=10, sliding=True)
+        cache.set("used", 1)
+        cache.set("idle", 2)
+        for _ in range(3):
+            self.clock.now += 6
+            self.assertEqual(cache.get("used"), 1)
+
+        self.assertEqual(cache.evict_expired(), 1)
+        self.assertEqual(cache.keys(), ["used"])
+
+    def test_get_or_create_builds_once(self):
+        cache = TTLCache("test_factory")
+        factory = mock.Mock(return_value="retriever")
+
+        self.assertEqual(cache.get_or_create(("citizensadvice",), factory), "retriever")
+        self.assertEqual(cache.get_or_create(("citizensadvice",), factory), "retriever")
+        factory.assert_called_once()
+        self.assertEqual(cache.stats()["hit_rate"], 0.5)
+
+    def test_get_or_create_keeps_first_stored_value(self):
+        cache = TTLCache("test_race")
+
+        def racing_factory():
+            cache.set("key", "first")
+            return "second"
+
+        self.assertEqual(cache.get_or_create("key", racing_factory), "first")
+        self.assertEqual(cache.get("key"), "first")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+import unittest
+
+from integrations.google_chat.card_builder import ResponseCardBuilder
+
+SOURCE = "https://www.citizensadvice.org.uk/benefits/universal-credit/"
+OTHER = "https://www.gov.uk/universal-credit"
+
+
+def card_text(builder: ResponseCardBuilder) -> str:
+    sections = builder.card()["cardsV2"][0]["card"]["sections"]
+    return sections[0]["widgets"][0]["textParagraph"]["text"]
+
+
+def reference_links(builder: ResponseCardBuilder) -> list:
+    sections = builder.card()["cardsV2"][0]["card"]["sections"]
+    if len(sections) < 2:
+        return []
+    return [widget["textParagraph"]["text"] for widget in sections[1]["widgets"]]
+
+
+class ResponseCardBuilderTests(unittest.TestCase):
+    def test_context_citation_is_linked(self):
+        builder = ResponseCardBuilder([SOURCE])
+        builder.update(f"Your client can claim <ref>SOURCE_URL:{SOURCE}</ref>.", True)
+
+        self.assertEqual(
+            card_text(builder),
+            f'Your client can claim <a href="{SOURCE}">'
+            "[1 - citizensadvice.org.uk]</a>.",
+        )
+        self.assertEqual(builder.pending_urls(), [])
+        self.assertEqual(len(reference_links(builder)), 1)
+
+    def test_partial_citation_is_held_back(self):
+        builder = ResponseCardBuilder([SOURCE])
+        builder.update(f"Your client can claim <ref>SOURCE_URL:{SOURCE[:20]}")
+        self.assertEqual(card_text(builder), "Your client can claim ")
+
+        builder.update(f"Your client can claim <ref>SOURCE_URL:{SOURCE}</ref>")
+        self.assertIn(f'href="{SOURCE}"', card_text(builder))
+
+    def test_partial_open_tag_is_held_back(self):
+        builder = ResponseCardBuilder([SOURCE])
+        builder.update("Your client can claim <re")
+        self.assertEqual(card_text(builder), "Your client can claim ")
+
+    def test_unverified_citations_wait_for_validation(self):
+        builder = ResponseCardBuilder([SOURCE])
+        builder.update(f"See <ref>{OTHER}</ref> and <ref>https://dead.org</ref>", True)
+
+        self.assertEqual(builder.pending_urls(), [OTHER, "https://dead.org"])
+        self.assertEqual(card_text(builder), "See  and ")
+
+        builder.set_validity({OTHER: True, "https://dead.org": False})
+        self.assertEqual(
+            card_text(builder), f'See <a href="{OTHER}">[1 - gov.uk]</a> and '
+        )
+        self.assertEqual(builder.pending_urls(), [])
+
+    def test_repeated_citation_keeps_its_number(self):
+        builder = ResponseCardBuilder([SOURCE, OTHER])
+        builder.update(
+            f"A <ref>{OTHER}</ref> B <ref>{SOURCE}</ref> C <ref>{OTHER}</ref>", True
+        )
+
+        self.assertEqual(card_text(builder).count("[1 - gov.uk]"), 2)
+        self.assertEqual(len(reference_links(builder)), 2)
+
+    def test_near_match_resolves_to_the_context_source(self):
+        builder = ResponseCardBuilder([SOURCE])
+        builder.update(f"See <ref>{SOURCE.rstrip('/')}#eligibility</ref>", True)
+
+        self.assertIn(f'href="{SOURCE}#eligibility"', card_text(builder))
+
+    def test_rewritten_answer_starts_over(self):
+        builder = ResponseCardBuilder([SOURCE])
+        builder.update("Your client can")
+        builder.update("Ask the client")
+
+        self.assertEqual(card_text(builder), "Ask the client")
+
+    def test_incremental_updates_match_a_single_parse(self):
+        answer = (
+            f"Universal credit <ref>SOURCE_URL:{SOURCE}</ref> replaces "
+            f"older benefits <ref>{OTHER}</ref>."
+        )
+        incremental = ResponseCardBuilder([SOURCE, OTHER])
+        for end in range(1, len(answer) + 1, 7):
+            incremental.update(answer[:end])
+        incremental.update(answer, final=True)
+        whole = ResponseCardBuilder([SOURCE, OTHER])
+        whole.update(answer, final=True)
+
+        self.assertEqual(incremental.card(), whole.card())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,49 @@
+import asyncio
+import unittest
+
+from caddy_core.utils import concurrency
+
+
+class ScheduleMessageTests(unittest.IsolatedAsyncioTestCase):
+    async def test_failure_notifies_adviser(self):
+        notified = []
+
+        async def pipeline():
+            raise RuntimeError("chain failed")
+
+        async def on_failure():
+            notified.append(True)
+
+        await concurrency.schedule_message(pipeline(), "failing", on_failure)
+        self.assertEqual(notified, [True])
+
+    async def test_success_does_not_notify(self):
+        notified = []
+
+        async def pipeline():
+            await asyncio.sleep(0)
+
+        async def on_failure():
+            notified.append(True)
+
+        await concurrency.schedule_message(pipeline(), "ok", on_failure)
+        self.assertEqual(notified, [])
+
+    async def test_failed_notification_is_contained(self):
+        async def pipeline():
+            raise RuntimeError("chain failed")
+
+        async def on_failure():
+            raise RuntimeError("chat API down")
+
+        await concurrency.schedule_message(pipeline(), "failing", on_failure)
+
+    def test_admission_fits_the_blocking_pool(self):
+        self.assertLessEqual(
+            concurrency.MAX_CONCURRENT_MESSAGES * concurrency.THREADS_PER_MESSAGE,
+            concurrency.BLOCKING_IO_WORKERS,
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from caddy_core.services.embedding_cache import (
+    DOCUMENT,
+    QUERY,
+    EmbeddingCache,
+    VectorFile,
+    text_digest,
+)
+
+
+class CountingEmbedder:
+    def __init__(self, offset: float = 0.0):
+        self.offset = offset
+        self.calls = []
+
+    def __call__(self, texts):
+        self.calls.append(list(texts))
+        return [[float(len(text)) + self.offset, 1.0, 0.0] for text in texts]
+
+
+class EmbeddingCacheTests(unittest.TestCase):
+    def test_distinct_misses_embedded_once(self):
+        cache = EmbeddingCache(max_size=100)
+        embedder = CountingEmbedder()
+        cache.embed("model", ["a", "bb", "a"], embedder)
+        vectors = cache.embed("model", ["bb", "a"], embedder)
+        self.assertEqual(embedder.calls, [["a", "bb"]])
+        self.assertEqual(vectors, [[2.0, 1.0, 0.0], [1.0, 1.0, 0.0]])
+
+    def test_queries_and_documents_cached_separately(self):
+        cache = EmbeddingCache(max_size=100)
+        query_embedder = CountingEmbedder(offset=100.0)
+        document_embedder = CountingEmbedder()
+        query = cache.embed("model", ["text"], query_embedder, QUERY)
+        document = cache.embed("model", ["text"], document_embedder, DOCUMENT)
+        self.assertNotEqual(query, document)
+        self.assertEqual(len(query_embedder.calls), 1)
+        self.assertEqual(len(document_embedder.calls), 1)
+
+    def test_disk_tier_shared_between_caches(self):
+        with tempfile.TemporaryDirectory() as directory:
+            first = EmbeddingCache(max_size=100, directory=directory)
+            first.embed("cohere.embed", ["shared"], CountingEmbedder())
+            second = EmbeddingCache(max_size=100, directory=directory)
+            embedder = CountingEmbedder()
+            vectors = second.embed("cohere.embed", ["shared"], embedder)
+            self.assertEqual(embedder.calls, [])
+            self.assertEqual(vectors, [[6.0, 1.0, 0.0]])
+            self.assertEqual(second.stats()["disk_hits"], 1)
+
+
+class VectorFileTests(unittest.TestCase):
+    def test_compaction_bounds_the_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "model.3.f32")
+            writer = VectorFile(path, dimensions=3, max_entries=10)
+            reader = VectorFile(path, dimensions=3, max_entries=10)
+            digests = [text_digest("model", DOCUMENT, str(i)) for i in range(25)]
+            for i, digest in enumerate(digests):
+                writer.append([digest], [np.array([i, 0, 0], dtype=np.float32)])
+                if i == 5:
+                    np.testing.assert_array_equal(reader.get(digest), [5, 0, 0])
+
+            self.assertLessEqual(writer.size_bytes() // writer.dtype.itemsize, 10)
+            self.assertGreater(writer.compactions, 0)
+            self.assertIsNone(writer.get(digests[0]))
+            # The reader indexed the file before it was swapped and must not read
+            # stale positions from the replaced file
+            np.testing.assert_array_equal(reader.get(digests[-1]), [24, 0, 0])
+            self.assertIsNone(reader.get(digests[0]))
+            self.assertLessEqual(reader.entries(), 10)
+
+
+if __name__ == "__main__":
+    unittest.main()
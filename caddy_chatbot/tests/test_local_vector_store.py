@@ -0,0 +1,63 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from caddy_core.services import local_vector_store
+from caddy_core.services.local_vector_store import LocalVectorStore
+
+
+class FixedEmbeddings:
+    def embed_documents(self, texts):
+        return [[1.0, 0.0] for _ in texts]
+
+    def embed_query(self, text):
+        return [1.0, 0.0]
+
+
+VECTORS = [[1.0, 0.0], [0.9, 0.1], [0.0, 1.0], [0.1, 0.9]]
+TEXTS = ["a", "b", "c", "d"]
+
+
+class LocalVectorStoreTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.index_path = os.path.join(self.directory.name, "index")
+        self.addCleanup(self.directory.cleanup)
+
+    def test_flat_search_orders_by_similarity(self):
+        LocalVectorStore.build(
+            self.index_path, TEXTS, VECTORS, [{"source": t} for t in TEXTS]
+        )
+        store = LocalVectorStore(self.index_path, FixedEmbeddings())
+        hits = store.knn_hits([1.0, 0.0], k=2)
+        self.assertEqual([hit[0] for hit in hits], ["a", "b"])
+        self.assertEqual(hits[0][1]["source"], "a")
+        self.assertAlmostEqual(hits[0][3], 1.0, places=5)
+
+    def test_rebuild_publishes_new_version(self):
+        LocalVectorStore.build(self.index_path, TEXTS, VECTORS)
+        first = LocalVectorStore(self.index_path, FixedEmbeddings())
+        LocalVectorStore.build(self.index_path, ["e"], [[1.0, 0.0]])
+        LocalVectorStore.build(self.index_path, ["f"], [[1.0, 0.0]])
+        versions = [name for name in os.listdir(self.index_path) if name[0] == "v"]
+        self.assertEqual(len(versions), 2)
+        # An open store keeps reading its own build
+        self.assertEqual(len(first.search_vector([1.0, 0.0], k=10)), 4)
+        latest = LocalVectorStore(self.index_path, FixedEmbeddings())
+        self.assertEqual(latest.knn_hits([1.0, 0.0], k=10)[0][0], "f")
+
+    def test_empty_probed_partitions_return_nothing(self):
+        LocalVectorStore.build(self.index_path, TEXTS, VECTORS, nlist=2)
+        store = LocalVectorStore(self.index_path, FixedEmbeddings())
+        store.centroids = np.array([[1.0, 0.0], [0.0, 1.0]], dtype=np.float32)
+        store.partitions = [np.array([], dtype=np.int64), np.array([2, 3])]
+        with mock.patch.object(local_vector_store, "LOCAL_VECTOR_STORE_NPROBE", 1):
+            self.assertEqual(store.search_vector([1.0, 0.0], k=3), [])
+            self.assertEqual(len(store.search_vector([0.0, 1.0], k=3)), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
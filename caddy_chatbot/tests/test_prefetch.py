@@ -0,0 +1,96 @@
+import importlib
+import sys
+import time
+import types
+import unittest
+from datetime import datetime
+from unittest import mock
+
+from caddy_core import services, utils
+from caddy_core.models import UserMessage
+
+# The prompt and enrolment lookups read DynamoDB and the router calls Bedrock at
+# import, so prefetch is imported against fakes of both
+enrolment = types.SimpleNamespace(
+    DEFAULT_SOURCES=["citizensadvice"],
+    check_domain_status=lambda domain: (True, {"officeName": domain}),
+    get_office_coverage=lambda office: ["England"],
+    check_user_sources=lambda user: ["citizensadvice"],
+    get_designated_supervisor_space=lambda user: "spaces/supervisor",
+)
+prompt = types.ModuleType("caddy_core.utils.prompt")
+prompt.get_prompt = lambda name: f"prompt for {name}"
+prompt.get_route_name = lambda query: "benefits"
+prompt.get_route_prompt_name = lambda route: (
+    "FALLBACK_PROMPT" if route is None else f"{route.upper()}_PROMPT"
+)
+
+# Patched on the packages too, `from package import module` prefers an attribute
+# left by an earlier real import over sys.modules
+with (
+    mock.patch.dict(
+        sys.modules,
+        {
+            "caddy_core.services.enrolment": enrolment,
+            "caddy_core.utils.prompt": prompt,
+        },
+    ),
+    mock.patch.object(services, "enrolment", enrolment, create=True),
+    mock.patch.object(utils, "prompt", prompt, create=True),
+):
+    sys.modules.pop("caddy_core.services.prefetch", None)
+    prefetch = importlib.import_module("caddy_core.services.prefetch")
+    sys.modules.pop("caddy_core.services.prefetch", None)
+
+
+def adviser_message():
+    return UserMessage(
+        client="Google Chat",
+        user_email="adviser@example.org",
+        message="Can my client claim universal credit?",
+        message_sent_timestamp="0",
+        message_received_timestamp=datetime.now(),
+    )
+
+
+class PrefetchTests(unittest.IsolatedAsyncioTestCase):
+    async def test_lookups_resolve(self):
+        context = await prefetch.prefetch_message_context(
+            adviser_message(), lambda message: []
+        )
+        self.assertEqual(context.route, "benefits")
+        self.assertEqual(
+            context.route_specific_augmentation, "prompt for BENEFITS_PROMPT"
+        )
+        self.assertEqual(context.supervisor_space, "spaces/supervisor")
+        self.assertIn("total", context.timings)
+
+    async def test_route_timeout_falls_back_to_unrouted_prompt(self):
+        def slow_route(query):
+            time.sleep(0.2)
+            return "benefits"
+
+        with (
+            mock.patch.object(prefetch, "get_route_name", slow_route),
+            mock.patch.dict("os.environ", {"PREFETCH_TIMEOUT_ROUTE": "0.01"}),
+        ):
+            context = await prefetch.prefetch_message_context(
+                adviser_message(), lambda message: []
+            )
+        self.assertIsNone(context.route)
+        self.assertEqual(
+            context.route_specific_augmentation, "prompt for FALLBACK_PROMPT"
+        )
+
+    async def test_timeout_without_fallback_raises(self):
+        def slow_history(message):
+            time.sleep(0.2)
+            return []
+
+        with mock.patch.dict("os.environ", {"PREFETCH_TIMEOUT_CHAT_HISTORY": "0.01"}):
+            with self.assertRaises(prefetch.PrefetchTimeoutError):
+                await prefetch.prefetch_message_context(adviser_message(), slow_history)
+
+
+if __name__ == "__main__":
+    unittest.main()
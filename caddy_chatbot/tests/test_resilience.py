@@ -0,0 +1,145 @@
+import contextlib
+import unittest
+from unittest import mock
+
+from caddy_core.models import CircuitOpenError
+from caddy_core.utils.resilience import (
+    CircuitBreaker,
+    RetryBudget,
+    RetryPolicy,
+    retry_async,
+)
+
+
+async def failing_call(breaker):
+    async with breaker:
+        raise RuntimeError("dependency failed")
+
+
+async def chunks(*items, error=None):
+    for item in items:
+        yield item
+    if error is not None:
+        raise error
+
+
+class CircuitBreakerTests(unittest.IsolatedAsyncioTestCase):
+    async def test_opens_after_consecutive_failures(self):
+        breaker = CircuitBreaker("test_opens", failure_threshold=2, reset_timeout=60)
+        for _ in range(2):
+            with self.assertRaises(RuntimeError):
+                await failing_call(breaker)
+
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        with self.assertRaises(CircuitOpenError):
+            async with breaker:
+                pass
+
+    async def test_success_resets_failure_count(self):
+        breaker = CircuitBreaker("test_resets", failure_threshold=2, reset_timeout=60)
+        with self.assertRaises(RuntimeError):
+            await failing_call(breaker)
+        async with breaker:
+            pass
+        with self.assertRaises(RuntimeError):
+            await failing_call(breaker)
+
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    async def test_half_open_lets_one_probe_through(self):
+        breaker = CircuitBreaker("test_probe", failure_threshold=1, reset_timeout=0)
+        with self.assertRaises(RuntimeError):
+            await failing_call(breaker)
+
+        async with breaker:
+            self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+            with self.assertRaises(CircuitOpenError):
+                breaker.before_call()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    async def test_failed_probe_reopens(self):
+        breaker = CircuitBreaker("test_reopen", failure_threshold=3, reset_timeout=0)
+        breaker.failures = 3
+        breaker._transition(CircuitBreaker.OPEN)
+
+        with self.assertRaises(RuntimeError):
+            await failing_call(breaker)
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+    async def test_stream_errors_count_as_failures(self):
+        breaker = CircuitBreaker("test_stream", failure_threshold=1, reset_timeout=60)
+        received = []
+        with self.assertRaises(RuntimeError):
+            async for chunk in breaker.guard_stream(
+                chunks("a", "b", error=RuntimeError("stream dropped"))
+            ):
+                received.append(chunk)
+
+        self.assertEqual(received, ["a", "b"])
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+    async def test_consumer_errors_do_not_count(self):
+        breaker = CircuitBreaker("test_consumer", failure_threshold=1, reset_timeout=60)
+        with self.assertRaises(ValueError):
+            async with contextlib.aclosing(
+                breaker.guard_stream(chunks("a", "b"))
+            ) as stream:
+                async for _ in stream:
+                    raise ValueError("card update failed")
+
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+
+class RetryTests(unittest.IsolatedAsyncioTestCase):
+    def policy(self, **kwargs):
+        options = {"max_attempts": 3, "base_delay": 0, "max_delay": 0}
+        return RetryPolicy("test", **{**options, **kwargs})
+
+    async def test_retries_until_success(self):
+        attempts = []
+        retries = []
+
+        async def operation():
+            attempts.append(True)
+            if len(attempts) < 3:
+                raise RuntimeError("throttled")
+            return "answer"
+
+        async def on_retry(attempt, error, delay):
+            retries.append(attempt)
+
+        self.assertEqual(
+            await retry_async(operation, self.policy(), on_retry=on_retry), "answer"
+        )
+        self.assertEqual(retries, [1, 2])
+
+    async def test_gives_up_after_max_attempts(self):
+        operation = mock.AsyncMock(side_effect=RuntimeError("throttled"))
+        with self.assertRaises(RuntimeError):
+            await retry_async(operation, self.policy())
+        self.assertEqual(operation.await_count, 3)
+
+    async def test_open_breaker_is_not_retried(self):
+        operation = mock.AsyncMock(side_effect=CircuitOpenError("open"))
+        with self.assertRaises(CircuitOpenError):
+            await retry_async(operation, self.policy())
+        self.assertEqual(operation.await_count, 1)
+
+    async def test_exhausted_budget_stops_retries(self):
+        budget = RetryBudget(ratio=0, min_retries=1, window=60)
+        operation = mock.AsyncMock(side_effect=RuntimeError("throttled"))
+        with self.assertRaises(RuntimeError):
+            await retry_async(operation, self.policy(budget=budget))
+        self.assertEqual(operation.await_count, 2)
+
+    def test_delay_stays_within_bounds(self):
+        policy = RetryPolicy("test", base_delay=0.5, max_delay=2)
+        delay = policy.base_delay
+        for _ in range(20):
+            delay = policy.next_delay(delay)
+            self.assertGreaterEqual(delay, 0.5)
+            self.assertLessEqual(delay, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+import unittest
+
+from langchain_core.documents import Document
+
+from caddy_core.services.retrieval_cache import SemanticRetrievalCache
+
+INDICES = ("citizensadvice", "govuk")
+
+
+class FakeGenerationsTable:
+    def __init__(self):
+        self.generations = {}
+
+    def update_item(self, Key, **kwargs):
+        index = Key["indexName"]
+        self.generations[index] = self.generations.get(index, 0) + 1
+
+    def scan(self, **kwargs):
+        return {
+            "Items": [
+                {"indexName": index, "generation": generation}
+                for index, generation in self.generations.items()
+            ]
+        }
+
+
+def documents(name):
+    return [Document(page_content=name, metadata={"source": name})]
+
+
+class SemanticRetrievalCacheTests(unittest.TestCase):
+    def cache(self, **kwargs):
+        options = {"threshold": 0.95, "ttl": 60, "max_entries": 4}
+        return SemanticRetrievalCache(**{**options, **kwargs})
+
+    def store(self, cache, vector, name, indices=INDICES):
+        cache.set(indices, vector, documents(name), cache.generation(indices))
+
+    def test_similar_query_hits(self):
+        cache = self.cache()
+        self.store(cache, [1.0, 0.0, 0.0], "pip")
+
+        hit = cache.get(INDICES, [0.99, 0.05, 0.0])
+        self.assertEqual(hit[0].page_content, "pip")
+        self.assertIsNone(cache.get(INDICES, [0.0, 1.0, 0.0]))
+        self.assertEqual(cache.stats()["hits"], 1)
+
+    def test_source_sets_are_partitioned(self):
+        cache = self.cache()
+        self.store(cache, [1.0, 0.0, 0.0], "pip")
+
+        self.assertIsNone(cache.get(("citizensadvice",), [1.0, 0.0, 0.0]))
+
+    def test_expired_entries_miss(self):
+        cache = self.cache(ttl=0)
+        self.store(cache, [1.0, 0.0, 0.0], "pip")
+
+        self.assertIsNone(cache.get(INDICES, [1.0, 0.0, 0.0]))
+
+    def test_full_partition_evicts_least_recently_used(self):
+        cache = self.cache(max_entries=2)
+        self.store(cache, [1.0, 0.0, 0.0], "pip")
+        self.store(cache, [0.0, 1.0, 0.0], "housing")
+        cache.get(INDICES, [1.0, 0.0, 0.0])
+        self.store(cache, [0.0, 0.0, 1.0], "debt")
+
+        self.assertIsNotNone(cache.get(INDICES, [1.0, 0.0, 0.0]))
+        self.assertIsNone(cache.get(INDICES, [0.0, 1.0, 0.0]))
+
+    def test_invalidation_drops_partitions_searching_the_index(self):
+        cache = self.cache()
+        self.store(cache, [1.0, 0.0, 0.0], "pip")
+        self.store(cache, [1.0, 0.0, 0.0], "pip", indices=("advisernet",))
+
+        cache.invalidate_index("govuk")
+        self.assertIsNone(cache.get(INDICES, [1.0, 0.0, 0.0]))
+        self.assertIsNotNone(cache.get(("advisernet",), [1.0, 0.0, 0.0]))
+
+    def test_results_read_before_invalidation_are_not_stored(self):
+        cache = self.cache()
+        generation = cache.generation(INDICES)
+        cache.invalidate_index("govuk")
+        cache.set(INDICES, [1.0, 0.0, 0.0], documents("pip"), generation)
+
+        self.assertIsNone(cache.get(INDICES, [1.0, 0.0, 0.0]))
+
+    def test_sync_drops_indices_refreshed_elsewhere(self):
+        table = FakeGenerationsTable()
+        serving = self.cache(table=table, sync_interval=3600)
+        ingestion = self.cache(table=table)
+        self.store(serving, [1.0, 0.0, 0.0], "pip")
+
+        ingestion.invalidate_index("govuk")
+        serving.sync()
+        self.assertIsNone(serving.get(INDICES, [1.0, 0.0, 0.0]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,194 @@
+import asyncio
+import unittest
+from typing import Dict, List
+from unittest import mock
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+
+from caddy_core.models import RetrievalParameters
+from caddy_core.services import retrieval_chain
+from caddy_core.services.retrieval_chain import (
+    SpeculationThreshold,
+    build_retriever,
+    merge_documents,
+    result_overlap,
+    retrieve_for_query,
+)
+from caddy_core.services.retrievers import KNN_SCORE_KEY, VECTOR_METADATA_KEY
+
+VECTORS = {
+    "Can my client claim universal credit?": [1.0, 0.0, 0.0],
+    "Universal credit eligibility for a client": [0.98, 0.2, 0.0],
+    "Is my client eligible for benefits?": [0.0, 1.0, 0.0],
+}
+
+
+class FixedEmbeddings(Embeddings):
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [VECTORS.get(text, [0.0, 0.0, 1.0]) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return VECTORS.get(text, [0.0, 0.0, 1.0])
+
+
+def hit(index: str, rank: int, vector: List[float]):
+    text = f"{index} passage {rank}"
+    metadata = {
+        "source": f"https://{index}.org/{rank}",
+        "raw_markdown": f"Universal credit advice from {index}, passage {rank}.",
+    }
+    return text, metadata, vector, 0.9 - rank / 10
+
+
+class FakeBackend:
+    def __init__(self, hits: Dict[str, list]):
+        self.hits = hits
+
+    def knn_search(self, query_vector, fetch_k):
+        return {index: self.hits.get(index, [])[:k] for index, k in fetch_k.items()}
+
+
+class QueryRetriever(BaseRetriever):
+    """Returns a document naming the query and one every query finds"""
+
+    queries: List[str] = []
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        self.queries.append(query)
+        return [document(f"result for {query}"), document("shared passage")]
+
+
+def document(text: str) -> Document:
+    return Document(page_content=text, metadata={"source": f"https://{len(text)}"})
+
+
+class BuildRetrieverTests(unittest.TestCase):
+    def test_pipeline_allocates_packs_and_strips_vectors(self):
+        backend = FakeBackend(
+            {
+                "citizensadvice_scrape_db": [
+                    hit("citizensadvice", rank, [1.0, rank / 10, 0.0])
+                    for rank in range(6)
+                ],
+                "govuk_scrape_db": [
+                    hit("govuk", rank, [rank / 10, 1.0, 0.0]) for rank in range(6)
+                ],
+            }
+        )
+        parameters = RetrievalParameters(
+            total_source_docs=3, adaptive_allocation=True, context_token_budget=1000
+        )
+        retriever = build_retriever(
+            ["citizensadvice", "govuk"],
+            parameters=parameters,
+            backend=backend,
+            retriever_embeddings=FixedEmbeddings(),
+            cache=False,
+        )
+
+        documents = retriever.invoke("Can my client claim universal credit?")
+
+        self.assertLessEqual(len(documents), 3)
+        self.assertEqual(
+            {d.metadata["index_name"] for d in documents},
+            {"citizensadvice_scrape_db", "govuk_scrape_db"},
+        )
+        for result in documents:
+            self.assertNotIn(VECTOR_METADATA_KEY, result.metadata)
+            self.assertIsNotNone(result.metadata[KNN_SCORE_KEY])
+            self.assertIn("Universal credit advice", result.metadata["raw_markdown"])
+
+
+class MergeDocumentsTests(unittest.TestCase):
+    def test_interleaves_and_drops_repeats(self):
+        merged = merge_documents(
+            [document("a"), document("bb")],
+            [document("bb"), document("ccc"), document("dddd")],
+            limit=3,
+        )
+        self.assertEqual([d.page_content for d in merged], ["a", "bb", "ccc"])
+
+    def test_result_overlap(self):
+        reworded = [document("a"), document("bb")]
+        self.assertEqual(result_overlap(reworded, [document("bb")]), 0.5)
+        self.assertEqual(result_overlap([], [document("bb")]), 1.0)
+
+
+class SpeculationThresholdTests(unittest.TestCase):
+    def test_initial_threshold_until_enough_samples(self):
+        threshold = SpeculationThreshold(initial=0.8, min_overlap=0.8, min_samples=3)
+        threshold.observe(0.5, 1.0)
+        self.assertEqual(threshold.threshold, 0.8)
+
+    def test_learns_lowest_similarity_keeping_overlap(self):
+        threshold = SpeculationThreshold(initial=0.8, min_overlap=0.8, min_samples=4)
+        for similarity, overlap in [(0.95, 1.0), (0.9, 0.9), (0.7, 0.5), (0.6, 0.1)]:
+            threshold.observe(similarity, overlap)
+        self.assertEqual(threshold.threshold, 0.9)
+
+    def test_always_merges_without_enough_overlap(self):
+        threshold = SpeculationThreshold(initial=0.8, min_overlap=0.8, min_samples=2)
+        threshold.observe(0.99, 0.2)
+        threshold.observe(0.98, 0.1)
+        self.assertEqual(threshold.threshold, float("inf"))
+
+
+class RetrieveForQueryTests(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        patches = [
+            mock.patch.object(retrieval_chain, "SPECULATIVE_RETRIEVAL", True),
+            mock.patch.object(retrieval_chain, "SPECULATIVE_RETRIEVAL_SAMPLE_RATE", 0),
+            mock.patch.object(retrieval_chain, "embeddings", FixedEmbeddings()),
+            mock.patch.object(
+                retrieval_chain,
+                "speculation_threshold",
+                SpeculationThreshold(initial=0.9, min_overlap=0.8),
+            ),
+        ]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    async def rewording(self, reworded_query: str) -> str:
+        await asyncio.sleep(0.01)
+        return reworded_query
+
+    async def test_similar_rewording_keeps_speculative_results(self):
+        retriever = QueryRetriever(queries=[])
+        query, documents = await retrieve_for_query(
+            retriever,
+            "Can my client claim universal credit?",
+            self.rewording("Universal credit eligibility for a client"),
+        )
+
+        self.assertEqual(query, "Universal credit eligibility for a client")
+        self.assertEqual(
+            [d.page_content for d in documents],
+            ["result for Can my client claim universal credit?", "shared passage"],
+        )
+
+    async def test_different_rewording_merges_both_results(self):
+        retriever = QueryRetriever(queries=[])
+        _, documents = await retrieve_for_query(
+            retriever,
+            "Can my client claim universal credit?",
+            self.rewording("Is my client eligible for benefits?"),
+        )
+
+        self.assertEqual(
+            [d.page_content for d in documents],
+            [
+                "result for Is my client eligible for benefits?",
+                "result for Can my client claim universal credit?",
+            ],
+        )
+        self.assertEqual(len(retriever.queries), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
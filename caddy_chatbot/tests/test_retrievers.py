@@ -0,0 +1,232 @@
+import unittest
+from typing import List
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+
+from caddy_core.services import retrievers
+from caddy_core.services.retrievers import (
+    KNN_SCORE_KEY,
+    RERANK_SCORE_KEY,
+    VECTOR_METADATA_KEY,
+    AdaptiveSourceAllocator,
+    ContextPacker,
+    CrossEncoderRerankRetriever,
+    VectorClusteringFilter,
+)
+
+
+def document(text: str, index: str = "a_scrape_db", **metadata) -> Document:
+    return Document(page_content=text, metadata={"index_name": index, **metadata})
+
+
+class FixedRetriever(BaseRetriever):
+    documents: List[Document]
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        return self.documents
+
+
+class LengthCrossEncoder:
+    """Scores longer documents higher"""
+
+    def predict(self, pairs, batch_size, show_progress_bar):
+        return [min(len(text) / 10, 1.0) for _, text in pairs]
+
+
+class FailingCrossEncoder:
+    def predict(self, pairs, batch_size, show_progress_bar):
+        raise RuntimeError("model failed")
+
+
+class CrossEncoderRerankRetrieverTests(unittest.IsolatedAsyncioTestCase):
+    def reranker(self, model, top_n=None) -> CrossEncoderRerankRetriever:
+        retrievers._cross_encoders[model.__class__.__name__] = model
+        self.addCleanup(retrievers._cross_encoders.pop, model.__class__.__name__)
+        return CrossEncoderRerankRetriever(
+            base_retriever=FixedRetriever(
+                documents=[document("a"), document("ccc"), document("bb")]
+            ),
+            model_name=model.__class__.__name__,
+            top_n=top_n,
+        )
+
+    def test_reranks_keeps_top_n_and_records_scores(self):
+        reranked = self.reranker(LengthCrossEncoder(), top_n=2).invoke("query")
+        self.assertEqual([d.page_content for d in reranked], ["ccc", "bb"])
+        self.assertAlmostEqual(reranked[0].metadata[RERANK_SCORE_KEY], 0.3)
+
+    async def test_async_path_reranks(self):
+        reranked = await self.reranker(LengthCrossEncoder()).ainvoke("query")
+        self.assertEqual([d.page_content for d in reranked], ["ccc", "bb", "a"])
+
+    def test_failure_keeps_retrieved_order(self):
+        reranked = self.reranker(FailingCrossEncoder(), top_n=2).invoke("query")
+        self.assertEqual([d.page_content for d in reranked], ["a", "ccc"])
+        self.assertNotIn(RERANK_SCORE_KEY, reranked[0].metadata)
+
+
+class AdaptiveSourceAllocatorTests(unittest.TestCase):
+    def test_weak_source_keeps_only_its_minimum(self):
+        documents = [
+            document("a1", "a", **{KNN_SCORE_KEY: 0.9}),
+            document("b1", "b", **{KNN_SCORE_KEY: 0.5}),
+            document("a2", "a", **{KNN_SCORE_KEY: 0.88}),
+            document("b2", "b", **{KNN_SCORE_KEY: 0.45}),
+            document("a3", "a", **{KNN_SCORE_KEY: 0.85}),
+        ]
+        allocator = AdaptiveSourceAllocator(total=4, relevance_threshold=0.5)
+        kept = allocator.transform_documents(documents)
+        self.assertEqual([d.page_content for d in kept], ["a1", "b1", "a2", "a3"])
+
+    def test_rerank_scores_take_precedence(self):
+        documents = [
+            document("a1", "a", **{KNN_SCORE_KEY: 0.9, RERANK_SCORE_KEY: 0.1}),
+            document("b1", "b", **{KNN_SCORE_KEY: 0.2, RERANK_SCORE_KEY: 0.9}),
+            document("b2", "b", **{KNN_SCORE_KEY: 0.1, RERANK_SCORE_KEY: 0.8}),
+        ]
+        allocator = AdaptiveSourceAllocator(total=3, relevance_threshold=0.5)
+        kept = allocator.transform_documents(documents)
+        self.assertEqual([d.page_content for d in kept], ["a1", "b1", "b2"])
+        allocator = AdaptiveSourceAllocator(total=2, relevance_threshold=0.5)
+        kept = allocator.transform_documents(documents)
+        self.assertEqual([d.page_content for d in kept], ["a1", "b1"])
+
+    def test_documents_without_scores_pass_through(self):
+        documents = [document("a1", "a"), document("b1", "b")]
+        allocator = AdaptiveSourceAllocator(total=1)
+        self.assertEqual(allocator.transform_documents(documents), documents)
+
+
+class RecordingEmbeddings(Embeddings):
+    def __init__(self):
+        self.embedded = []
+
+    def embed_documents(self, texts):
+        self.embedded.extend(texts)
+        return [[0.0, 1.0] for _ in texts]
+
+    def embed_query(self, text):
+        raise NotImplementedError
+
+
+class VectorClusteringFilterTests(unittest.TestCase):
+    def setUp(self):
+        self.documents = [
+            document("a1", "a", **{VECTOR_METADATA_KEY: [1.0, 0.0]}),
+            document("a2", "a", **{VECTOR_METADATA_KEY: [0.9, 0.1]}),
+            document("b1", "b", **{VECTOR_METADATA_KEY: [0.0, 1.0]}),
+            document("b2", "b", **{VECTOR_METADATA_KEY: [0.1, 0.9]}),
+            document("a3", "a", **{VECTOR_METADATA_KEY: [0.95, 0.0]}),
+        ]
+        self.embeddings = RecordingEmbeddings()
+
+    def test_keeps_the_closest_document_of_each_cluster(self):
+        clustering = VectorClusteringFilter(
+            embeddings=self.embeddings, num_clusters=2, sorted=True
+        )
+        kept = clustering.transform_documents(self.documents)
+
+        self.assertEqual([d.page_content for d in kept], ["b2", "a3"])
+        self.assertEqual(self.embeddings.embedded, [])
+        self.assertNotIn(VECTOR_METADATA_KEY, kept[0].metadata)
+
+    def test_num_closest_keeps_distinct_documents(self):
+        clustering = VectorClusteringFilter(
+            embeddings=self.embeddings, num_clusters=2, num_closest=2
+        )
+        kept = clustering.transform_documents(self.documents)
+
+        self.assertEqual(len({d.page_content for d in kept}), 4)
+
+    def test_documents_without_vectors_are_embedded(self):
+        documents = self.documents + [document("c1", "c")]
+        clustering = VectorClusteringFilter(embeddings=self.embeddings, num_clusters=3)
+        kept = clustering.transform_documents(documents)
+
+        self.assertEqual(self.embeddings.embedded, ["c1"])
+        self.assertEqual(len(kept), 3)
+
+    def test_more_clusters_than_documents(self):
+        clustering = VectorClusteringFilter(embeddings=self.embeddings, num_clusters=9)
+        kept = clustering.transform_documents(self.documents[:2])
+
+        self.assertEqual(len(kept), 2)
+        self.assertEqual(clustering.transform_documents([]), [])
+
+
+def markdown_document(markdown: str, index: str) -> Document:
+    return document(
+        index, index, source=f"https://{index}.org/advice", raw_markdown=markdown
+    )
+
+
+class ContextPackerTests(unittest.TestCase):
+    def setUp(self):
+        self.documents = [
+            markdown_document(
+                "Universal credit eligibility depends on age.\n\n"
+                "Parking fines are appealed separately.\n\n"
+                "Universal credit claims are made online.",
+                "a",
+            ),
+            markdown_document(
+                "Housing benefit is being replaced.\n\n"
+                "Universal credit covers housing costs.",
+                "b",
+            ),
+        ]
+
+    def pack(self, budget: int) -> List[Document]:
+        packer = ContextPacker(token_budget=budget, passage_tokens=12)
+        return packer.compress_documents(self.documents, "universal credit")
+
+    def test_large_budget_keeps_everything(self):
+        packed = self.pack(1000)
+        self.assertEqual(
+            [d.metadata["raw_markdown"] for d in packed],
+            [d.metadata["raw_markdown"] for d in self.documents],
+        )
+
+    def test_each_document_keeps_its_best_passage_first(self):
+        packed = self.pack(45)
+        self.assertEqual(
+            [d.metadata["raw_markdown"] for d in packed],
+            [
+                "Universal credit eligibility depends on age.",
+                "Universal credit covers housing costs.",
+            ],
+        )
+        self.assertEqual(packed[0].metadata["source"], "https://a.org/advice")
+        self.assertEqual(packed[0].page_content, "a")
+
+    def test_remaining_budget_keeps_page_order(self):
+        packed = self.pack(40)
+        self.assertEqual(
+            packed[0].metadata["raw_markdown"],
+            "Universal credit eligibility depends on age.\n\n"
+            "Universal credit claims are made online.",
+        )
+
+    def test_documents_without_a_kept_passage_are_dropped(self):
+        self.assertEqual(len(self.pack(40)), 1)
+        self.assertEqual(self.pack(12), [])
+
+    def test_zero_budget_disables_packing(self):
+        packer = ContextPacker(token_budget=0)
+        self.assertIs(
+            packer.compress_documents(self.documents, "query"), self.documents
+        )
+
+    def test_long_paragraphs_split_on_sentences(self):
+        pieces = ContextPacker()._split("One sentence here. Another one. " * 5, 40)
+        self.assertTrue(all(len(piece) <= 40 for piece in pieces))
+        self.assertEqual(pieces[0], "One sentence here. Another one.")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+import asyncio
+import time
+import unittest
+
+from caddy_core.services.rewrite_cache import RewriteCache, message_hash
+
+
+class FakeTable:
+    def __init__(self):
+        self.items = {}
+
+    def get_item(self, Key):
+        item = self.items.get(Key["messageHash"])
+        return {"Item": item} if item else {}
+
+    def put_item(self, Item):
+        self.items[Item["messageHash"]] = Item
+
+
+class Rewriter:
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.calls = []
+
+    async def __call__(self, message):
+        self.calls.append(message)
+        await asyncio.sleep(self.delay)
+        return f"rewritten: {message}"
+
+
+class RewriteCacheTests(unittest.IsolatedAsyncioTestCase):
+    def test_key_ignores_case_and_whitespace(self):
+        self.assertEqual(
+            message_hash("Can my client  claim PIP?\n", "model"),
+            message_hash("can my client claim pip?", "model"),
+        )
+        self.assertNotEqual(
+            message_hash("can my client claim pip?", "model"),
+            message_hash("can my client claim pip?", "other-model"),
+        )
+
+    async def test_message_is_rewritten_once(self):
+        cache = RewriteCache(ttl=60, max_size=16)
+        rewrite = Rewriter()
+
+        first = await cache.get_or_rewrite("Can my client claim PIP?", rewrite)
+        second = await cache.get_or_rewrite("can my client claim pip? ", rewrite)
+
+        self.assertEqual(first, second)
+        self.assertEqual(len(rewrite.calls), 1)
+
+    async def test_concurrent_requests_share_one_rewrite(self):
+        cache = RewriteCache(ttl=60, max_size=16)
+        rewrite = Rewriter(delay=0.01)
+
+        results = await asyncio.gather(
+            *(cache.get_or_rewrite("section 21 advice", rewrite) for _ in range(5))
+        )
+
+        self.assertEqual(len(set(results)), 1)
+        self.assertEqual(len(rewrite.calls), 1)
+
+    async def test_failed_rewrite_is_not_cached(self):
+        cache = RewriteCache(ttl=60, max_size=16)
+
+        async def failing(message):
+            raise RuntimeError("throttled")
+
+        with self.assertRaises(RuntimeError):
+            await cache.get_or_rewrite("section 21 advice", failing)
+
+        rewrite = Rewriter()
+        await cache.get_or_rewrite("section 21 advice", rewrite)
+        self.assertEqual(len(rewrite.calls), 1)
+
+    async def test_workers_share_rewrites_through_the_table(self):
+        table = FakeTable()
+        rewrite = Rewriter()
+        await RewriteCache(60, 16, table).get_or_rewrite("section 21 advice", rewrite)
+        result = await RewriteCache(60, 16, table).get_or_rewrite(
+            "section 21 advice", rewrite
+        )
+
+        self.assertEqual(result, "rewritten: section 21 advice")
+        self.assertEqual(len(rewrite.calls), 1)
+
+    async def test_expired_shared_rewrite_is_ignored(self):
+        table = FakeTable()
+        key = message_hash("section 21 advice")
+        table.put_item(
+            {
+                "messageHash": key,
+                "rewrittenQuery": "stale",
+                "expiresAt": int(time.time() - 1),
+            }
+        )
+
+        result = await RewriteCache(60, 16, table).get_or_rewrite(
+            "section 21 advice", Rewriter()
+        )
+        self.assertEqual(result, "rewritten: section 21 advice")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,190 @@
+import hashlib
+import importlib
+import os
+import sys
+import tempfile
+import types
+import unittest
+from unittest import mock
+
+import numpy as np
+
+EMBEDDING_MODEL = "cohere.embed-multilingual-v3"
+
+
+def fake_vector(text):
+    digest = hashlib.sha256(text.encode("utf-8")).digest()
+    return [byte / 255 for byte in digest[:4]]
+
+
+class FakeBedrockEncoder:
+    def __init__(self, **kwargs):
+        self.credentials = kwargs
+
+    def __call__(self, docs):
+        return [fake_vector(doc) for doc in docs]
+
+
+class FakeLocalIndex:
+    def __init__(self, index=None, routes=None, utterances=None):
+        self.index = index
+        self.routes = routes
+        self.utterances = utterances
+
+    def get_routes(self):
+        return list(zip(self.routes, self.utterances))
+
+
+class FakeRoute:
+    def __init__(self, name, utterances):
+        self.name = name
+        self.utterances = utterances
+
+
+class FakeRouteLayer:
+    def __init__(self, encoder, routes=None, index=None, **kwargs):
+        self.encoder = encoder
+        self.routes = routes
+        self.index = index
+
+
+def module(name, **attributes):
+    fake = types.ModuleType(name)
+    fake.__dict__.update(attributes)
+    return fake
+
+
+semantic_router = {
+    "semantic_router": module(
+        "semantic_router", Route=FakeRoute, RouteLayer=FakeRouteLayer
+    ),
+    "semantic_router.encoders": module(
+        "semantic_router.encoders", BedrockEncoder=FakeBedrockEncoder
+    ),
+    "semantic_router.utils.defaults": module(
+        "semantic_router.utils.defaults",
+        EncoderDefault=types.SimpleNamespace(
+            BEDROCK=types.SimpleNamespace(value={"embedding_model": EMBEDDING_MODEL})
+        ),
+    ),
+    "semantic_router.index.local": module(
+        "semantic_router.index.local", LocalIndex=FakeLocalIndex
+    ),
+    "semantic_router.index.postgres": module(
+        "semantic_router.index.postgres", PostgresIndex=None
+    ),
+}
+ambient_credentials = types.SimpleNamespace(
+    access_key="AKIAEXAMPLE", secret_key="secret", token=None
+)
+session = mock.Mock()
+session.get_credentials.return_value.get_frozen_credentials.return_value = (
+    ambient_credentials
+)
+
+# The router builds its route layer at import, so it is imported against a fake
+# semantic_router and ambient credentials, with no task role, writing its snapshot
+# to a temporary directory
+snapshot = tempfile.TemporaryDirectory()
+snapshot_dir = snapshot.name
+with (
+    mock.patch.dict(sys.modules, semantic_router),
+    mock.patch.dict(os.environ, {"ROUTE_SNAPSHOT_DIR": snapshot_dir}),
+    mock.patch("boto3.Session", return_value=session),
+):
+    os.environ.pop("TASK_ROLE_ARN", None)
+    os.environ.pop("POSTGRES_CONNECTION_STRING", None)
+    sys.modules.pop("caddy_core.services.router", None)
+    router = importlib.import_module("caddy_core.services.router")
+    sys.modules.pop("caddy_core.services.router", None)
+
+
+class CountingEncoder:
+    model_name = EMBEDDING_MODEL
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, docs):
+        self.calls += 1
+        return [fake_vector(doc) for doc in docs]
+
+
+def routes():
+    return [
+        FakeRoute("benefits", ["can I claim PIP", "universal credit advice"]),
+        FakeRoute("housing", ["section 21 advice"]),
+    ]
+
+
+class RouterImportTests(unittest.TestCase):
+    def test_encoder_uses_ambient_credentials_without_task_role(self):
+        encoder = router.get_route.encoder
+        self.assertIsInstance(encoder.encoder, FakeBedrockEncoder)
+        self.assertEqual(encoder.encoder.credentials["access_key_id"], "AKIAEXAMPLE")
+        self.assertIsNone(encoder.encoder.credentials["session_token"])
+
+    def test_import_builds_snapshot(self):
+        version = router.routes_hash(router.get_route.routes, EMBEDDING_MODEL)
+        index = router.load_route_snapshot(snapshot_dir, version)
+        utterances = sum(len(route.utterances) for route in router.get_route.routes)
+        self.assertEqual(len(index.index), utterances)
+        self.assertIsInstance(router.get_route, router.CachedRouteLayer)
+
+
+class RouteSnapshotTests(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def test_round_trip(self):
+        version = router.routes_hash(routes(), EMBEDDING_MODEL)
+        router.save_route_snapshot(self.directory, version, routes(), CountingEncoder())
+
+        index = router.load_route_snapshot(self.directory, version)
+        self.assertEqual(list(index.routes), ["benefits", "benefits", "housing"])
+        self.assertEqual(list(index.utterances)[2], "section 21 advice")
+        np.testing.assert_allclose(
+            index.index[2], fake_vector("section 21 advice"), rtol=1e-6
+        )
+
+    def test_changed_routes_or_model_miss(self):
+        version = router.routes_hash(routes(), EMBEDDING_MODEL)
+        router.save_route_snapshot(self.directory, version, routes(), CountingEncoder())
+
+        changed = routes()
+        changed[1].utterances.append("eviction notice")
+        self.assertIsNone(
+            router.load_route_snapshot(
+                self.directory, router.routes_hash(changed, EMBEDDING_MODEL)
+            )
+        )
+        self.assertIsNone(
+            router.load_route_snapshot(
+                self.directory, router.routes_hash(routes(), "another-model")
+            )
+        )
+
+    def test_save_removes_earlier_versions(self):
+        first = router.routes_hash(routes(), EMBEDDING_MODEL)
+        second = router.routes_hash(routes(), "another-model")
+        router.save_route_snapshot(self.directory, first, routes(), CountingEncoder())
+        router.save_route_snapshot(self.directory, second, routes(), CountingEncoder())
+
+        self.assertIsNone(router.load_route_snapshot(self.directory, first))
+        self.assertEqual(len(os.listdir(self.directory)), 2)
+
+    def test_local_route_index_embeds_once(self):
+        encoder = CountingEncoder()
+        with mock.patch.object(router, "ROUTE_SNAPSHOT_DIR", self.directory):
+            first = router.local_route_index(routes(), encoder)
+            second = router.local_route_index(routes(), encoder)
+
+        self.assertEqual(encoder.calls, 1)
+        self.assertEqual(len(first.index), 3)
+        self.assertEqual(len(second.index), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+import os
+import tempfile
+import unittest
+
+from caddy_core.services.score_calibration import (
+    ScoreCalibration,
+    calibration_key,
+    fit_calibration,
+)
+
+
+class ScoreCalibrationTests(unittest.TestCase):
+    def setUp(self):
+        self.calibration = fit_calibration(
+            {
+                "citizensadvice": [0.5 + i / 200 for i in range(101)],
+                "govuk:hybrid": [0.01, 0.02, 0.03],
+                "empty": [],
+            },
+            quantiles=11,
+        )
+
+    def test_scores_map_to_their_position_in_the_distribution(self):
+        self.assertAlmostEqual(self.calibration.calibrate("citizensadvice", 0.75), 0.5)
+        self.assertEqual(self.calibration.calibrate("citizensadvice", 0.1), 0.0)
+        self.assertEqual(self.calibration.calibrate("citizensadvice", 1.5), 1.0)
+
+    def test_uncalibrated_key(self):
+        self.assertIsNone(self.calibration.calibrate("advisernet", 0.75))
+        self.assertNotIn("empty", self.calibration.quantiles)
+
+    def test_relevance_falls_back_to_min_max_scaling(self):
+        self.assertEqual(
+            self.calibration.relevance_scores("advisernet", [0.25, 0.75, 0.5]),
+            [0.0, 1.0, 0.5],
+        )
+        self.assertEqual(
+            self.calibration.relevance_scores("advisernet", [0.3, 0.3]), [1.0, 1.0]
+        )
+        self.assertEqual(self.calibration.relevance_scores("advisernet", []), [])
+
+    def test_whole_result_set_can_be_weak(self):
+        relevance = self.calibration.relevance_scores("citizensadvice", [0.5, 0.51])
+        self.assertTrue(all(score < 0.05 for score in relevance))
+
+    def test_keys_per_mode(self):
+        self.assertEqual(calibration_key("govuk"), "govuk")
+        self.assertEqual(calibration_key("govuk", "hybrid"), "govuk:hybrid")
+
+    def test_round_trip(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "calibration.json")
+            self.calibration.save(path)
+            loaded = ScoreCalibration.load(path)
+
+        self.assertEqual(
+            loaded.calibrate("govuk:hybrid", 0.02),
+            self.calibration.calibrate("govuk:hybrid", 0.02),
+        )
+
+    def test_quantiles_are_made_monotonic(self):
+        calibration = ScoreCalibration({"index": [0.1, 0.3, 0.2, 0.4]})
+        self.assertEqual(calibration.quantiles["index"].tolist(), [0.1, 0.3, 0.3, 0.4])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,245 @@
+import unittest
+from typing import Dict, List
+from unittest import mock
+
+from langchain_core.embeddings import Embeddings
+
+from caddy_core.services.retrievers import KNN_SCORE_KEY, RELEVANCE_KEY
+from caddy_core.services.score_calibration import ScoreCalibration
+from caddy_core.services import search
+from caddy_core.services.search import (
+    MultiIndexRetriever,
+    OpenSearchBackend,
+    interleave,
+    reciprocal_rank_fusion,
+    with_knn_scores,
+)
+
+
+class QueryEmbeddings(Embeddings):
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [[1.0, 0.0] for _ in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return [1.0, 0.0]
+
+
+def hit(text: str, score: float, vector=(1.0, 0.0), **metadata):
+    return (
+        text,
+        {"source": f"https://example.org/{text}", **metadata},
+        list(vector),
+        score,
+    )
+
+
+class FakeBackend:
+    """Returns canned hits per index, as OpenSearchBackend and the local backend do"""
+
+    def __init__(self, knn: Dict[str, list], hybrid: Dict[str, list] = None):
+        self.knn = knn
+        self.hybrid = hybrid or {}
+        self.calls = []
+
+    def knn_search(self, query_vector, fetch_k):
+        self.calls.append(("knn", dict(fetch_k)))
+        return {index: self.knn.get(index, []) for index in fetch_k}
+
+    def hybrid_search(self, query, query_vector, fetch_k):
+        self.calls.append(("hybrid", dict(fetch_k)))
+        return {index: self.hybrid.get(index, []) for index in fetch_k}
+
+
+KNN_HITS = {
+    "a_scrape_db": [hit("a1", 0.9), hit("a2", 0.5, (0.6, 0.8))],
+    "b_scrape_db": [hit("b1", 0.8), hit("b2", 0.2, (0.0, 1.0))],
+}
+
+
+def retriever(backend, **kwargs) -> MultiIndexRetriever:
+    return MultiIndexRetriever(
+        backend=backend,
+        embeddings=QueryEmbeddings(),
+        indices=["a_scrape_db", "b_scrape_db"],
+        k=2,
+        fetch_k=4,
+        **kwargs,
+    )
+
+
+class MultiIndexRetrieverTests(unittest.IsolatedAsyncioTestCase):
+    def test_documents_carry_scores_from_every_index(self):
+        backend = FakeBackend(KNN_HITS)
+        documents = retriever(backend).invoke("question")
+        by_text = {d.page_content: d.metadata for d in documents}
+        self.assertEqual(set(by_text), {"a1", "a2", "b1", "b2"})
+        self.assertEqual(by_text["a1"]["index_name"], "a_scrape_db")
+        self.assertEqual(by_text["b2"][KNN_SCORE_KEY], 0.2)
+        self.assertIsNone(by_text["a1"][RELEVANCE_KEY])
+        self.assertEqual(backend.calls, [("knn", {"a_scrape_db": 4, "b_scrape_db": 4})])
+        # Sources alternate so each is represented
+        self.assertNotEqual(
+            documents[0].metadata["index_name"], documents[1].metadata["index_name"]
+        )
+
+    async def test_async_path_without_async_backend(self):
+        documents = await retriever(FakeBackend(KNN_HITS)).ainvoke("question")
+        self.assertEqual(len(documents), 4)
+
+    def test_relevance_cutoff_drops_weak_hits(self):
+        calibration = ScoreCalibration(
+            {"a_scrape_db": [0.0, 1.0], "b_scrape_db": [0.0, 1.0]}
+        )
+        documents = retriever(
+            FakeBackend(KNN_HITS), calibration=calibration, relevance_cutoff=0.4
+        )._documents([1.0, 0.0], KNN_HITS)
+        by_text = {d.page_content: d.metadata for d in documents}
+        self.assertEqual(set(by_text), {"a1", "a2", "b1"})
+        self.assertAlmostEqual(by_text["a2"][RELEVANCE_KEY], 0.5)
+
+    def test_uncalibrated_index_is_kept(self):
+        calibration = ScoreCalibration({"a_scrape_db": [0.0, 1.0]})
+        documents = retriever(
+            FakeBackend(KNN_HITS), calibration=calibration, relevance_cutoff=0.4
+        )._documents([1.0, 0.0], KNN_HITS)
+        self.assertIn("b2", {d.page_content for d in documents})
+
+    def test_hybrid_cutoff_uses_knn_scores(self):
+        knn = [hit("a1", 0.9), hit("a2", 0.3)]
+        lexical = [hit("a3", 12.0), hit("a2", 8.0)]
+        fused = with_knn_scores(reciprocal_rank_fusion([knn, lexical]), knn)
+        calibration = ScoreCalibration({"a_scrape_db": [0.0, 1.0]})
+        documents = retriever(
+            FakeBackend({}, hybrid={"a_scrape_db": fused}),
+            hybrid=True,
+            calibration=calibration,
+            relevance_cutoff=0.5,
+        ).invoke("question")
+        by_text = {d.page_content: d.metadata for d in documents}
+        # a3 only matched BM25, so it gets the weakest kNN score of the index
+        self.assertEqual(set(by_text), {"a1"})
+        self.assertEqual(by_text["a1"][KNN_SCORE_KEY], 0.9)
+
+
+def response(*texts):
+    return {
+        "hits": {
+            "hits": [
+                {
+                    "_score": 1.0 / (rank + 1),
+                    "_source": {
+                        "text": text,
+                        "metadata": {"source": f"https://example.org/{text}"},
+                        "vector_field": [1.0, 0.0],
+                    },
+                }
+                for rank, text in enumerate(texts)
+            ]
+        }
+    }
+
+
+INDEX_ERROR = {"error": {"type": "index_not_found_exception"}, "status": 404}
+
+
+class FakeClient:
+    """Answers each search from canned responses per index, in order"""
+
+    def __init__(self, responses: Dict[str, list]):
+        self.responses = responses
+        self.bodies = []
+
+    def _respond(self, index, body):
+        self.bodies.append((index, body))
+        return self.responses[index].pop(0)
+
+    def msearch(self, body):
+        pairs = zip(body[::2], body[1::2])
+        return {"responses": [self._respond(h["index"], b) for h, b in pairs]}
+
+    def search(self, index, body):
+        result = self._respond(index, body)
+        if result is INDEX_ERROR:
+            raise RuntimeError("index_not_found_exception")
+        return result
+
+
+class AsyncFakeClient(FakeClient):
+    async def msearch(self, body):
+        return super().msearch(body)
+
+    async def search(self, index, body):
+        return super().search(index, body)
+
+
+class OpenSearchBackendTests(unittest.IsolatedAsyncioTestCase):
+    FETCH_K = {"a_scrape_db": 2, "b_scrape_db": 2}
+
+    def test_failed_index_contributes_no_hits(self):
+        client = FakeClient(
+            {"a_scrape_db": [response("a1", "a2")], "b_scrape_db": [INDEX_ERROR]}
+        )
+        hits = OpenSearchBackend(client).knn_search([1.0, 0.0], self.FETCH_K)
+        self.assertEqual([h[0] for h in hits["a_scrape_db"]], ["a1", "a2"])
+        self.assertEqual(hits["b_scrape_db"], [])
+        self.assertEqual(len(client.bodies), 2)
+
+    def test_failure_on_every_index_raises(self):
+        client = FakeClient(
+            {"a_scrape_db": [INDEX_ERROR], "b_scrape_db": [INDEX_ERROR]}
+        )
+        with self.assertRaises(RuntimeError):
+            OpenSearchBackend(client).knn_search([1.0, 0.0], self.FETCH_K)
+
+    def test_concurrent_searches_without_msearch(self):
+        client = FakeClient(
+            {"a_scrape_db": [response("a1")], "b_scrape_db": [INDEX_ERROR]}
+        )
+        with mock.patch.object(search, "OPENSEARCH_MSEARCH", False):
+            hits = OpenSearchBackend(client).knn_search([1.0, 0.0], self.FETCH_K)
+        self.assertEqual([h[0] for h in hits["a_scrape_db"]], ["a1"])
+        self.assertEqual(hits["b_scrape_db"], [])
+
+    def test_hybrid_fuses_each_index(self):
+        client = FakeClient(
+            {
+                "a_scrape_db": [response("a1", "a2"), response("a3", "a2")],
+                "b_scrape_db": [response("b1"), response("b1")],
+            }
+        )
+        hits = OpenSearchBackend(client).hybrid_search(
+            "question", [1.0, 0.0], self.FETCH_K
+        )
+        self.assertEqual([h[0] for h in hits["a_scrape_db"]], ["a2", "a1"])
+        self.assertEqual(hits["a_scrape_db"][0][1][KNN_SCORE_KEY], 0.5)
+        self.assertEqual([h[0] for h in hits["b_scrape_db"]], ["b1"])
+
+    async def test_async_client(self):
+        responses = {"a_scrape_db": [response("a1")], "b_scrape_db": [INDEX_ERROR]}
+        for msearch in (True, False):
+            client = AsyncFakeClient({k: list(v) for k, v in responses.items()})
+            with mock.patch.object(search, "OPENSEARCH_MSEARCH", msearch):
+                hits = await OpenSearchBackend(None, client).aknn_search(
+                    [1.0, 0.0], self.FETCH_K
+                )
+            self.assertEqual([h[0] for h in hits["a_scrape_db"]], ["a1"])
+            self.assertEqual(hits["b_scrape_db"], [])
+
+
+class FusionTests(unittest.TestCase):
+    def test_reciprocal_rank_fusion_rewards_agreement(self):
+        fused = reciprocal_rank_fusion(
+            [[hit("x", 1.0), hit("y", 0.9)], [hit("y", 5.0), hit("z", 4.0)]]
+        )
+        self.assertEqual([h[0] for h in fused], ["y", "x", "z"])
+
+    def test_with_knn_scores_without_knn_hits(self):
+        fused = with_knn_scores([hit("x", 0.1)], [])
+        self.assertIsNone(fused[0][1][KNN_SCORE_KEY])
+
+    def test_interleave(self):
+        self.assertEqual(interleave([[1, 2, 3], [4]]), [1, 4, 2, 3])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+import asyncio
+import types
+import unittest
+from unittest import mock
+
+from caddy_core.services import streaming
+from caddy_core.services.streaming import (
+    CardUpdateScheduler,
+    is_rate_limited,
+    send_with_backoff,
+)
+
+
+class RateLimited(Exception):
+    status = 429
+
+
+class Recorder:
+    def __init__(self, failures=()):
+        self.failures = list(failures)
+        self.states = []
+
+    async def __call__(self, state):
+        if self.failures:
+            raise self.failures.pop(0)
+        self.states.append(state)
+        return state
+
+
+class CardUpdateSchedulerTests(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        patcher = mock.patch.object(streaming, "RATE_LIMIT_BACKOFF", 0.01)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_rapid_updates_are_coalesced(self):
+        flush = Recorder()
+        scheduler = CardUpdateScheduler(flush, min_interval=0.05, min_chars=10_000)
+        for i in range(50):
+            scheduler.update(f"state {i}", 1)
+            await asyncio.sleep(0.002)
+        await asyncio.sleep(0.1)
+        await scheduler.close()
+
+        self.assertLess(len(flush.states), 10)
+        self.assertEqual(flush.states[-1], "state 49")
+
+    async def test_character_threshold_flushes_early(self):
+        flush = Recorder()
+        scheduler = CardUpdateScheduler(flush, min_interval=60, min_chars=10)
+        scheduler.update("long answer", 11)
+        await asyncio.sleep(0.05)
+        await scheduler.close()
+
+        self.assertEqual(flush.states, ["long answer"])
+
+    async def test_close_sends_final_state(self):
+        flush = Recorder()
+        scheduler = CardUpdateScheduler(flush, min_interval=60, min_chars=10_000)
+        scheduler.update("partial", 1)
+
+        self.assertEqual(await scheduler.close("final"), "final")
+        self.assertEqual(flush.states, ["final"])
+
+    async def test_rate_limited_flush_backs_off_and_recovers(self):
+        flush = Recorder(failures=[RateLimited()])
+        scheduler = CardUpdateScheduler(flush, min_interval=0, min_chars=10_000)
+        scheduler.update("first", 1)
+        await asyncio.sleep(0.005)
+        scheduler.update("second", 1)
+        await asyncio.sleep(0.05)
+        await scheduler.close()
+
+        self.assertEqual(flush.states, ["second"])
+        self.assertEqual(scheduler._backoff, 0.0)
+
+    async def test_failed_flush_does_not_stop_updates(self):
+        flush = Recorder(failures=[RuntimeError("chat API down")])
+        scheduler = CardUpdateScheduler(flush, min_interval=0, min_chars=10_000)
+        scheduler.update("first", 1)
+        await asyncio.sleep(0.01)
+        scheduler.update("second", 1)
+        await asyncio.sleep(0.01)
+        await scheduler.close()
+
+        self.assertEqual(flush.states, ["second"])
+
+
+class SendWithBackoffTests(unittest.IsolatedAsyncioTestCase):
+    def test_rate_limit_detection(self):
+        self.assertTrue(is_rate_limited(RateLimited()))
+        error = Exception()
+        error.resp = types.SimpleNamespace(status="429")
+        self.assertTrue(is_rate_limited(error))
+        self.assertFalse(is_rate_limited(RuntimeError("not found")))
+
+    async def test_retries_rate_limited_sends(self):
+        send = Recorder(failures=[RateLimited(), RateLimited()])
+        with mock.patch.object(streaming, "RATE_LIMIT_BACKOFF", 0.001):
+            self.assertEqual(await send_with_backoff(lambda: send("card")), "card")
+
+    async def test_other_errors_are_not_retried(self):
+        send = Recorder(failures=[RuntimeError("bad card"), None])
+        with self.assertRaises(RuntimeError):
+            await send_with_backoff(lambda: send("card"))
+        self.assertEqual(len(send.failures), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+import asyncio
+import threading
+import types
+import unittest
+from unittest import mock
+
+import requests
+
+from caddy_core.services import url_validation
+
+
+class FakeChecker:
+    def __init__(self, valid_urls, delay=0.0):
+        self.valid_urls = set(valid_urls)
+        self.delay = delay
+        self.checked = []
+        self._lock = threading.Lock()
+
+    def __call__(self, url):
+        with self._lock:
+            self.checked.append(url)
+        threading.Event().wait(self.delay)
+        return url in self.valid_urls
+
+
+class UrlValidationTests(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        url_validation.url_cache.clear()
+        self.addCleanup(url_validation.url_cache.clear)
+
+    def patch_checker(self, checker):
+        patcher = mock.patch.object(url_validation, "check_url", checker)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_validates_each_url_once(self):
+        checker = FakeChecker({"https://a.org"}, delay=0.01)
+        self.patch_checker(checker)
+
+        results = await asyncio.gather(
+            url_validation.validate_urls(["https://a.org", "https://b.org"]),
+            url_validation.validate_urls(["https://a.org", "https://a.org"]),
+        )
+
+        self.assertEqual(results[0], {"https://a.org": True, "https://b.org": False})
+        self.assertEqual(results[1], {"https://a.org": True})
+        self.assertEqual(sorted(checker.checked), ["https://a.org", "https://b.org"])
+
+    async def test_results_are_cached(self):
+        checker = FakeChecker({"https://a.org"})
+        self.patch_checker(checker)
+
+        await url_validation.validate_url("https://a.org")
+        await url_validation.validate_url("https://dead.org")
+        self.assertTrue(await url_validation.validate_url("https://a.org"))
+        self.assertFalse(await url_validation.validate_url("https://dead.org"))
+        self.assertEqual(len(checker.checked), 2)
+
+    async def test_dead_links_expire_sooner(self):
+        self.patch_checker(FakeChecker({"https://a.org"}))
+        with mock.patch.object(url_validation, "URL_VALIDATION_NEGATIVE_TTL", 0):
+            await url_validation.validate_urls(["https://a.org", "https://dead.org"])
+
+        self.assertTrue(url_validation.cached_url_status("https://a.org"))
+        self.assertIsNone(url_validation.cached_url_status("https://dead.org"))
+
+    async def test_request_validation_does_not_wait(self):
+        checker = FakeChecker({"https://a.org", "https://b.org"}, delay=0.01)
+        self.patch_checker(checker)
+        url_validation.url_cache.set("https://a.org", True)
+
+        statuses = url_validation.request_validation(["https://a.org", "https://b.org"])
+        self.assertEqual(statuses, {"https://a.org": True, "https://b.org": None})
+
+        self.assertTrue(await url_validation.validate_url("https://b.org"))
+        self.assertEqual(checker.checked, ["https://b.org"])
+
+
+class CheckUrlTests(unittest.TestCase):
+    def head(self, status_code=None, error=None):
+        def head(url, timeout, allow_redirects):
+            if error is not None:
+                raise error
+            return types.SimpleNamespace(status_code=status_code)
+
+        return mock.patch.object(url_validation._session, "head", head)
+
+    def test_status_codes(self):
+        for status_code, valid in ((200, True), (403, True), (404, False)):
+            with self.head(status_code):
+                self.assertEqual(url_validation.check_url("https://a.org"), valid)
+
+    def test_request_errors_are_invalid(self):
+        with self.head(error=requests.ConnectionError("refused")):
+            self.assertFalse(url_validation.check_url("https://a.org"))
+
+
+if __name__ == "__main__":
+    unittest.main()